@@ -1,17 +1,40 @@
-from flask import Flask, render_template, request, jsonify, send_file
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, send_file, Response, has_request_context, g, redirect
 import os
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import io
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
 import base64
+import csv
+import gzip
+import hashlib
+import html
 import re
 import sqlite3
-import requests
 import json
+import tempfile
 import threading
-import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows - без межпроцессной блокировки
+    fcntl = None
+
+import glycemia
+import charts
+import db
+import downsample
+import metrics
+import profiling
+import backups
+import notifier
+import restore
+import scheduler
+import snapshots
 
 app = Flask(__name__)
 app.template_folder = '.'
@@ -21,12 +44,21 @@ BOT_TOKEN = "8202623703:AAHReI5nLyAzDB6a0y3Dus9nUYJrQmuhT9I"
 CHAT_ID = "2108365479"
 # ===============================
 
-# Используем SQLite в постоянной папке
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glucose.db')
+# Все исходящие вызовы Telegram - через один транспорт с пулом соединений.
+# TELEGRAM_API_URL позволяет подставить локальную заглушку Bot API
+telegram, telegram_notifier = notifier.create_notifier(
+    BOT_TOKEN, CHAT_ID,
+    base_url=os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org'))
+
+# Используем SQLite в постоянной папке; DB_PATH - другая база (бенчмарки, стенды)
+DB_PATH = os.environ.get('DB_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glucose.db')
+database = db.Database(DB_PATH)
 
 # ============ АВТОМАТИЧЕСКОЕ ВОССТАНОВЛЕНИЕ ИЗ TELEGRAM ============
 def auto_restore_from_telegram():
-    """Автоматически восстановить базу из Telegram при старте"""
+    """Автоматически восстановить базу из Telegram при старте.
+    -> 'restored', 'not_needed' (база не пуста или бэкапа нет) или 'error'
+    (Telegram недоступен или сбой) - тогда стоит попробовать ещё раз"""
     try:
         print("🔄 Проверяю базу данных...")
         
@@ -40,103 +72,84 @@ def auto_restore_from_telegram():
                 conn.close()
                 if count > 0:
                     print(f"✅ База уже есть, записей: {count}")
-                    return False
+                    return 'not_needed'
             except:
                 conn.close()
         
         print("🔍 Ищу бэкап в Telegram...")
         
         # Получаем последние сообщения
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates?limit=10"
-        response = requests.get(url, timeout=10)
-        
-        if not response.json().get('ok'):
+        try:
+            updates = telegram.call('getUpdates', limit=100)
+        except notifier.TelegramError:
             print("⚠️ Не могу подключиться к Telegram")
-            return False
-        
-        # Ищем JSON бэкап
-        json_file_id = None
-        for update in reversed(response.json()['result']):
-            if 'message' in update and 'document' in update['message']:
-                doc = update['message']['document']
-                if doc['file_name'].endswith('.json'):
-                    json_file_id = doc['file_id']
-                    print(f"📦 Найден бэкап: {doc['file_name']}")
-                    break
-        
-        if not json_file_id:
-            print("⚠️ Бэкап не найден")
-            return False
-        
-        # Получаем файл
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/getFile?file_id={json_file_id}"
-        response = requests.get(url)
-        file_info = response.json()
-        
-        if not file_info['ok']:
-            print("⚠️ Не могу получить файл")
-            return False
+            return 'error'
         
-        # Скачиваем и восстанавливаем
-        print("⬇️ Скачиваю бэкап...")
-        file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_info['result']['file_path']}"
-        response = requests.get(file_url)
-        data = json.loads(response.text)
+        documents = [(update['message']['document'].get('file_name', ''),
+                      update['message']['document']['file_id'])
+                     for update in updates
+                     if 'message' in update and 'document' in update['message']]
         
-        print(f"📊 Восстанавливаю {len(data)} записей...")
-        
-        # Создаём базу
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        # Последний полный снимок и его дельты; если их нет - старый JSON-бэкап
+        chain = backups.pick_chain(documents)
+        if not chain:
+            legacy = [doc for doc in documents if doc[0].endswith('.json')]
+            chain = legacy[-1:]
         
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS measurements
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             value REAL NOT NULL,
-             note TEXT,
-             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
-        ''')
+        if not chain:
+            print("⚠️ Бэкап не найден")
+            return 'not_needed'
         
-        # Очищаем и вставляем
-        c.execute("DELETE FROM measurements")
+        for file_name, _ in chain:
+            print(f"📦 Найден бэкап: {file_name}")
         
-        for item in data:
-            c.execute(
-                "INSERT INTO measurements (value, note, created_at) VALUES (?, ?, ?)",
-                (item['value'], item['note'], item.get('created_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-            )
+        # Скачиваем и восстанавливаем потоком: JSON разбирается по мере загрузки,
+        # снимок и дельты вставляются одной транзакцией
+        print("⬇️ Скачиваю и восстанавливаю бэкап...")
         
-        conn.commit()
-        conn.close()
+        # База уже создана init_db(). Восстановление идёт в фоне, пока приложение
+        # принимает запросы, поэтому ничего не удаляем - записи, добавленные
+        # за время скачивания, остаются рядом с восстановленными
+        period = BackupPeriod()
+        conn = get_db_connection(readonly=False)
+        try:
+            count = restore.restore_json(conn, _iter_telegram_backup(chain),
+                                         INSERT_MEASUREMENT_SQL, period.track)
+        except notifier.TelegramError:
+            print("⚠️ Не могу получить файл")
+            return 'error'
+        finally:
+            conn.close()
+        chart_cache.invalidate()
         
-        print(f"✅ Восстановлено {len(data)} записей!")
+        print(f"✅ Восстановлено {count} записей!")
         
         # Отправляем уведомление
-        try:
-            message = f"🔄 *Автовосстановление базы*\n\n"
-            message += f"📊 Записей восстановлено: {len(data)}\n"
-            if data:
-                first_date = data[0].get('created_at', '')[:10]
-                last_date = data[-1].get('created_at', '')[:10]
-                if first_date and last_date:
-                    message += f"📅 Период: {first_date} — {last_date}\n"
-            message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
-            
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-            payload = {
-                'chat_id': CHAT_ID,
-                'text': message,
-                'parse_mode': 'Markdown'
-            }
-            requests.post(url, json=payload, timeout=5)
-        except:
-            pass
+        message = f"🔄 *Автовосстановление базы*\n\n"
+        message += f"📊 Записей восстановлено: {count}\n"
+        if period.first_ms is not None:
+            message += f"📅 Период: {format_ms(period.first_ms, '%Y-%m-%d')} — {format_ms(period.last_ms, '%Y-%m-%d')}\n"
+        message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        telegram_notifier.notify(message)
         
-        return True
+        return 'restored'
         
     except Exception as e:
         print(f"⚠️ Ошибка автовосстановления: {e}")
-        return False
+        return 'error'
+
+def _iter_telegram_backup(chain):
+    """Записи из цепочки файлов бэкапа в Telegram, по одному файлу за раз"""
+    for file_name, file_id in chain:
+        file_info = telegram.call('getFile', file_id=file_id)
+        response = telegram.download(file_info['file_path'], stream=True)
+        try:
+            chunks = response.iter_content(restore.READ_CHUNK_SIZE)
+            if file_name.endswith('.gz'):
+                chunks = backups.iter_gunzip(chunks)
+            yield from restore.iter_json_items(chunks)
+        finally:
+            response.close()
 
 # ============ РУЧНАЯ ЗАГРУЗКА БЭКАПА ============
 @app.route('/admin/upload_backup', methods=['GET', 'POST'])
@@ -180,13 +193,13 @@ def upload_backup():
                 <h3>📱 Из Telegram:</h3>
                 <ol>
                     <li>Открой Telegram</li>
-                    <li>Найди файл от бота (glucose_backup_*.db или .json)</li>
+                    <li>Найди файл от бота (.db.gz, .json или полный снимок glucose_*_full.json.gz)</li>
                     <li>Скачай файл</li>
                     <li>Загрузи здесь:</li>
                 </ol>
                 
                 <form method="post" enctype="multipart/form-data">
-                    <input type="file" name="backup_file" accept=".db,.json" required>
+                    <input type="file" name="backup_file" accept=".db,.json,.gz" required>
                     <br>
                     <button type="submit" class="btn btn-success">📤 Загрузить</button>
                     <a href="/" class="btn">🏠 На главную</a>
@@ -195,8 +208,8 @@ def upload_backup():
             
             <div class="card" style="background: #fff3cd;">
                 <h3>⚠️ Внимание!</h3>
-                <p><strong>.db файл</strong> - полностью заменит текущую базу</p>
-                <p><strong>.json файл</strong> - добавит данные к существующим</p>
+                <p><strong>.db / .db.gz файл</strong> - полностью заменит текущую базу</p>
+                <p><strong>.json файл</strong> - заменит записи данными из файла</p>
                 <a href="/admin/setup_test_data" class="btn btn-danger">🗑️ Начать с чистой базы</a>
             </div>
         </body>
@@ -215,15 +228,28 @@ def upload_backup():
         filename = file.filename.lower()
         
         # .db файл - полная замена базы
-        if filename.endswith('.db'):
-            file.save(DB_PATH)
+        if filename.endswith('.db') or filename.endswith('.db.gz'):
+            # Загрузка пишется во временный файл рядом с базой; рабочая база
+            # не трогается, пока копия не проверена и не доведена до схемы
+            stream = gzip.GzipFile(fileobj=file.stream) if filename.endswith('.gz') else file.stream
+            tmp_path = restore.save_temp_copy(stream, DB_PATH)
+            try:
+                restore.validate_db_file(tmp_path)
+                if not init_db(tmp_path, wal=False):
+                    raise restore.RestoreError('Не удалось обновить схему загруженной базы')
+                run_migrations(tmp_path, pause=0)
+                
+                # Подмена одной транзакцией backup API: подключения из пулов
+                # остаются рабочими и сразу видят новые данные
+                restore.swap_database(tmp_path, DB_PATH)
+            finally:
+                for suffix in ('', '-journal'):
+                    if os.path.exists(tmp_path + suffix):
+                        os.unlink(tmp_path + suffix)
             
-            # Проверяем
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM measurements")
-            count = c.fetchone()[0]
-            conn.close()
+            _bump_data_version()
+            chart_cache.invalidate()
+            count = get_stats()['count']
             
             return f'''
             <div style="text-align: center; padding: 40px;">
@@ -237,28 +263,25 @@ def upload_backup():
             '''
         
         # .json файл - восстановление данных
-        elif filename.endswith('.json'):
-            data = json.load(file)
-            
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            
-            # Очищаем и вставляем
-            c.execute("DELETE FROM measurements")
-            
-            for item in data:
-                c.execute(
-                    "INSERT INTO measurements (value, note, created_at) VALUES (?, ?, ?)",
-                    (item['value'], item['note'], item.get('created_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-                )
-            
-            conn.commit()
-            conn.close()
+        elif filename.endswith('.json') or filename.endswith('.json.gz'):
+            # Очищаем и вставляем одной транзакцией, разбирая файл потоком
+            chunks = restore.iter_file_chunks(file.stream)
+            if filename.endswith('.gz'):
+                chunks = backups.iter_gunzip(chunks)
+            conn = get_db_connection(readonly=False)
+            try:
+                count = restore.restore_json(
+                    conn, restore.iter_json_items(chunks),
+                    INSERT_MEASUREMENT_SQL, backup_item_params,
+                    clear=clear_measurements, finish=finish_bulk_load)
+            finally:
+                conn.close()
+            chart_cache.invalidate()
             
             return f'''
             <div style="text-align: center; padding: 40px;">
                 <h1 style="color: #27ae60;">✅ Данные восстановлены!</h1>
-                <p style="font-size: 18px;">Добавлено: <strong>{len(data)}</strong> записей</p>
+                <p style="font-size: 18px;">Добавлено: <strong>{count}</strong> записей</p>
                 <div style="margin: 30px;">
                     <a href="/print_report" class="btn btn-success">📊 Отчет</a>
                     <a href="/" class="btn">➕ Добавить данные</a>
@@ -269,10 +292,18 @@ def upload_backup():
         else:
             return '''
             <h1 style="color: #e74c3c;">❌ Неверный формат</h1>
-            <p>Только .db или .json</p>
+            <p>Только .db, .json или их .gz</p>
             <p><a href="/admin/upload_backup">← Назад</a></p>
             '''
             
+    except restore.RestoreError as e:
+        # База не тронута: транзакция откатилась или подмена не началась
+        return f'''
+        <h1 style="color: #e74c3c;">❌ Бэкап не принят</h1>
+        <pre>{str(e)}</pre>
+        <p>Текущая база не изменена.</p>
+        <p><a href="/admin/upload_backup">← Попробовать снова</a></p>
+        ''', 400
     except Exception as e:
         return f'''
         <h1 style="color: #e74c3c;">❌ Ошибка</h1>
@@ -280,11 +311,438 @@ def upload_backup():
         <p><a href="/admin/upload_backup">← Попробовать снова</a></p>
         '''
 
+# ============ ВРЕМЯ ============
+# Время измерения хранится в created_ms - целые миллисекунды Unix (UTC),
+# по ним идут сортировка, диапазоны и индекс. Текстовый created_at (UTC, как
+# CURRENT_TIMESTAMP) пишется рядом для совместимости бэкапов со старыми
+# версиями. Показывается время в часовом поясе APP_TZ.
+APP_TZ = ZoneInfo(os.environ.get('APP_TZ', 'UTC'))
+
+def now_ms():
+    return time.time_ns() // 1_000_000
+
+def to_epoch_ms(value, tz=timezone.utc):
+    """Число (мс) или строка '2024-11-29 10:00:00' / ISO -> мс.
+    Строки без пояса считаются в tz (по умолчанию UTC, как в базе)."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    dt = datetime.fromisoformat(str(value).strip())
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz)
+    return round(dt.timestamp() * 1000)
+
+def from_epoch_ms(ms):
+    """мс -> datetime в APP_TZ"""
+    return datetime.fromtimestamp(ms / 1000, tz=APP_TZ)
+
+def format_ms(ms, fmt='%Y-%m-%d %H:%M:%S'):
+    return from_epoch_ms(ms).strftime(fmt) if ms is not None else None
+
+def utc_text(ms):
+    """мс -> текст для колонки created_at"""
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def utc_offset_of(ms):
+    """Смещение APP_TZ от UTC в секундах на момент ms (с учётом летнего времени)"""
+    return int(from_epoch_ms(ms).utcoffset().total_seconds())
+
+# ============ ДАВЛЕНИЕ ============
+# Давление приходит в примечании ("Давление: 130-140"). Оно разбирается один
+# раз при записи в колонки systolic/diastolic: первое число - верхнее,
+# второе - нижнее. Читающий код строки больше не разбирает.
+def parse_pressure(note):
+    """"Давление: 130-140" -> (130, 140); "Давление: 160+" -> (160, None)"""
+    if not note or 'Давление:' not in note:
+        return None, None
+    numbers = re.findall(r'\d+', note.split('Давление:')[1])
+    if not numbers:
+        return None, None
+    return int(numbers[0]), (int(numbers[1]) if len(numbers) >= 2 else None)
+
+def format_pressure(systolic, diastolic):
+    """(130, 140) -> "130-140", (160, None) -> "160", нет данных -> пустая строка"""
+    if not systolic:
+        return ''
+    return f"{systolic}-{diastolic}" if diastolic else str(systolic)
+
+INSERT_MEASUREMENT_SQL = '''
+    INSERT INTO measurements (value, note, created_at, created_ms, systolic, diastolic, utc_offset)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+def measurement_params(value, note, created=None):
+    """Параметры для INSERT_MEASUREMENT_SQL: время (мс или строка) приводится
+    к created_ms, давление разбирается из примечания"""
+    created_ms = to_epoch_ms(created)
+    if created_ms is None:
+        created_ms = now_ms()
+    systolic, diastolic = parse_pressure(note)
+    return (value, note, utc_text(created_ms), created_ms, systolic, diastolic,
+            utc_offset_of(created_ms))
+
+def measurement_from_payload(data, default_ms=None, check_range=False):
+    """JSON одного измерения из API -> параметры для INSERT_MEASUREMENT_SQL.
+    Время - created_ms или created_at (без пояса - UTC), иначе default_ms/сейчас.
+    check_range - отбрасывать значения вне 0..100 (пакетная загрузка с
+    устройств; одиночный POST, как и раньше, принимает любое число).
+    При неверных данных - ValueError с понятным текстом."""
+    if not isinstance(data, dict) or data.get('value') is None:
+        raise ValueError('Нет значения глюкозы')
+    try:
+        value = float(data['value'])
+    except (TypeError, ValueError):
+        raise ValueError(f"Неверное значение: {data['value']!r}")
+    if check_range and not 0 < value < 100:
+        raise ValueError(f'Значение вне диапазона: {value}')
+    
+    note = data.get('note') or ''
+    if not isinstance(note, str):
+        raise ValueError('Примечание должно быть строкой')
+    
+    try:
+        created_ms = to_epoch_ms(data.get('created_ms') or data.get('created_at'))
+    except (TypeError, ValueError):
+        raise ValueError('Неверное время измерения')
+    if created_ms is None:
+        created_ms = default_ms if default_ms is not None else now_ms()
+    
+    # Давление можно передать числами; иначе разбираем примечание
+    systolic, diastolic = parse_pressure(note)
+    try:
+        if data.get('systolic') is not None:
+            systolic = int(data['systolic'])
+            diastolic = int(data['diastolic']) if data.get('diastolic') is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('Неверное значение давления')
+    
+    return (value, note, utc_text(created_ms), created_ms, systolic, diastolic,
+            utc_offset_of(created_ms))
+
+def backup_item_params(item):
+    """Запись из JSON-бэкапа -> параметры для INSERT_MEASUREMENT_SQL"""
+    return measurement_params(item['value'], item.get('note'),
+                              item.get('created_ms') or item.get('created_at'))
+
+class BackupPeriod:
+    """backup_item_params, запоминающий период восстановленных записей"""
+    
+    def __init__(self):
+        self.first_ms = None
+        self.last_ms = None
+    
+    def track(self, item):
+        params = backup_item_params(item)
+        created_ms = params[3]
+        if self.first_ms is None or created_ms < self.first_ms:
+            self.first_ms = created_ms
+        if self.last_ms is None or created_ms > self.last_ms:
+            self.last_ms = created_ms
+        return params
+
 # ============ ИНИЦИАЛИЗАЦИЯ БАЗЫ ============
-def init_db():
-    """Инициализация базы данных"""
+# measurement_stats - производная таблица: при смене её схемы она просто
+# пересоздаётся и пересчитывается
+STATS_SCHEMA_VERSION = 3
+
+# Текущее время в мс средствами SQLite - для changed_ms в триггерах
+NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+# Массовая загрузка (полная очистка и восстановление): пока в app_meta есть
+# эта отметка, триггеры агрегатов молчат, а в конце агрегаты пересчитываются
+# один раз. Отметка живёт только внутри транзакции загрузки
+BULK_LOAD_KEY = 'bulk_load'
+TRIGGERS_ACTIVE_SQL = f"NOT EXISTS (SELECT 1 FROM app_meta WHERE key = '{BULK_LOAD_KEY}')"
+
+def _pressure_sql(row=None):
+    """SQL-выражения верхнего/нижнего давления строки для триггеров (0 - нет данных).
+    Берутся только колонки: разбирать примечание в SQL так же, как
+    parse_pressure, нельзя. Старые строки, которые фоновая миграция ещё не
+    заполнила, в агрегаты давления не попадают, пока после миграции агрегаты
+    не пересчитаются."""
+    prefix = f"{row}." if row else ''
+    return f"coalesce({prefix}systolic, 0)", f"coalesce({prefix}diastolic, 0)"
+
+def _create_stats_triggers(c):
+    """Триггеры, поддерживающие таблицу measurement_stats при вставке и удалении"""
+    new_sys, new_dia = _pressure_sql('NEW')
+    old_sys, old_dia = _pressure_sql('OLD')
+    
+    # Пересоздаём каждый раз, чтобы старые базы получали актуальные триггеры
+    c.execute('DROP TRIGGER IF EXISTS trg_stats_insert')
+    c.execute('DROP TRIGGER IF EXISTS trg_stats_delete')
+    
+    c.execute(f'''
+        CREATE TRIGGER trg_stats_insert AFTER INSERT ON measurements
+        WHEN {TRIGGERS_ACTIVE_SQL}
+        BEGIN
+            UPDATE measurement_stats SET
+                data_version = data_version + 1,
+                changed_ms = {NOW_MS_SQL},
+                glucose_count = glucose_count + 1,
+                glucose_sum = glucose_sum + NEW.value,
+                glucose_min = min(coalesce(glucose_min, NEW.value), NEW.value),
+                glucose_max = max(coalesce(glucose_max, NEW.value), NEW.value),
+                pressure_count = pressure_count + ({new_sys} > 0),
+                systolic_sum = systolic_sum + {new_sys},
+                diastolic_count = diastolic_count + ({new_dia} > 0),
+                diastolic_sum = diastolic_sum + {new_dia},
+                first_ms = min(coalesce(first_ms, NEW.created_ms), NEW.created_ms),
+                last_id = CASE WHEN last_ms IS NULL OR NEW.created_ms >= last_ms THEN NEW.id ELSE last_id END,
+                last_value = CASE WHEN last_ms IS NULL OR NEW.created_ms >= last_ms THEN NEW.value ELSE last_value END,
+                last_ms = max(coalesce(last_ms, NEW.created_ms), NEW.created_ms)
+            WHERE id = 1;
+        END
+    ''')
+    
+    # При удалении min/max/последняя запись пересчитываются только если удалили
+    # именно их - по индексам это O(log n), а не полный проход
+    c.execute(f'''
+        CREATE TRIGGER trg_stats_delete AFTER DELETE ON measurements
+        WHEN {TRIGGERS_ACTIVE_SQL}
+        BEGIN
+            UPDATE measurement_stats SET
+                data_version = data_version + 1,
+                changed_ms = {NOW_MS_SQL},
+                glucose_count = glucose_count - 1,
+                glucose_sum = glucose_sum - OLD.value,
+                pressure_count = pressure_count - ({old_sys} > 0),
+                systolic_sum = systolic_sum - {old_sys},
+                diastolic_count = diastolic_count - ({old_dia} > 0),
+                diastolic_sum = diastolic_sum - {old_dia}
+            WHERE id = 1;
+            
+            UPDATE measurement_stats SET glucose_min = (SELECT MIN(value) FROM measurements)
+            WHERE id = 1 AND OLD.value <= glucose_min;
+            
+            UPDATE measurement_stats SET glucose_max = (SELECT MAX(value) FROM measurements)
+            WHERE id = 1 AND OLD.value >= glucose_max;
+            
+            UPDATE measurement_stats SET first_ms = (SELECT MIN(created_ms) FROM measurements)
+            WHERE id = 1 AND OLD.created_ms <= first_ms;
+            
+            UPDATE measurement_stats SET
+                (last_id, last_value, last_ms) =
+                (SELECT id, value, created_ms FROM measurements
+                 ORDER BY created_ms DESC, id DESC LIMIT 1)
+            WHERE id = 1 AND OLD.id = last_id;
+        END
+    ''')
+
+def rebuild_stats(conn):
+    """Полный пересчёт measurement_stats (после загрузки чужой базы или миграции)"""
+    sys_expr, dia_expr = _pressure_sql()
+    c = conn.cursor()
+    c.execute("INSERT OR IGNORE INTO measurement_stats (id) VALUES (1)")
+    c.execute(f'''
+        UPDATE measurement_stats SET
+            (glucose_count, glucose_sum, glucose_min, glucose_max,
+             pressure_count, systolic_sum, diastolic_count, diastolic_sum,
+             first_ms, last_ms) =
+            (SELECT COUNT(*), COALESCE(SUM(value), 0), MIN(value), MAX(value),
+                    COALESCE(SUM({sys_expr} > 0), 0), COALESCE(SUM({sys_expr}), 0),
+                    COALESCE(SUM({dia_expr} > 0), 0), COALESCE(SUM({dia_expr}), 0),
+                    MIN(created_ms), MAX(created_ms)
+             FROM measurements)
+        WHERE id = 1
+    ''')
+    c.execute('''
+        UPDATE measurement_stats SET (last_id, last_value) =
+            (SELECT id, value FROM measurements ORDER BY created_ms DESC, id DESC LIMIT 1)
+        WHERE id = 1
+    ''')
+    c.execute(f"UPDATE measurement_stats SET data_version = data_version + 1, changed_ms = {NOW_MS_SQL} WHERE id = 1")
+
+# ============ СВОДКИ ПО ДНЯМ / НЕДЕЛЯМ / МЕСЯЦАМ ============
+# measurement_rollups поддерживается триггерами так же, как measurement_stats:
+# на каждый период - количество, сумма, сумма квадратов, min и max глюкозы
+# и давления. Границы периодов - по местному времени APP_TZ. SQLite не знает
+# часовых поясов, поэтому смещение от UTC на момент измерения (летнее время
+# учтено) сохраняется в колонку utc_offset при записи, а триггеры просто
+# прибавляют его к created_ms.
+ROLLUP_SCHEMA_VERSION = 1
+
+# Период: ключ (дата начала 'ГГГГ-ММ-ДД') и длина для модификатора date()
+ROLLUP_GRANULARITIES = {
+    'day': ("date({t}, 'unixepoch')", '+1 day'),
+    'week': ("date({t}, 'unixepoch', 'weekday 0', '-6 days')", '+7 days'),
+    'month': ("date({t}, 'unixepoch', 'start of month')", '+1 month'),
+}
+
+ROLLUP_METRICS = ('glucose', 'systolic', 'diastolic')
+
+# Смещения поясов укладываются в ±14 часов
+MAX_UTC_OFFSET_MS = 14 * 3600 * 1000
+
+def _rollup_bucket_sql(granularity, row=None):
+    """SQL ключа периода для строки measurements (NEW/OLD в триггерах)"""
+    prefix = f"{row}." if row else ''
+    local = f"{prefix}created_ms / 1000 + coalesce({prefix}utc_offset, 0)"
+    return ROLLUP_GRANULARITIES[granularity][0].format(t=local)
+
+def _rollup_range_sql(granularity):
+    """Диапазон created_ms, заведомо покрывающий период строки
+    measurement_rollups при любом смещении, - для пересчёта min/max по индексу"""
+    step = ROLLUP_GRANULARITIES[granularity][1]
+    start = f"CAST(strftime('%s', measurement_rollups.bucket) AS INTEGER) * 1000 - {MAX_UTC_OFFSET_MS}"
+    end = f"CAST(strftime('%s', measurement_rollups.bucket, '{step}') AS INTEGER) * 1000 + {MAX_UTC_OFFSET_MS}"
+    return start, end
+
+def _rollup_values_sql(row=None):
+    """SQL-значения метрик строки: глюкоза и давление (NULL - нет данных)"""
+    prefix = f"{row}." if row else ''
+    systolic, diastolic = _pressure_sql(row)
+    return {
+        'glucose': f"{prefix}value",
+        'systolic': f"NULLIF({systolic}, 0)",
+        'diastolic': f"NULLIF({diastolic}, 0)",
+    }
+
+def _rollup_columns():
+    return ', '.join(f"{m}_count, {m}_sum, {m}_sumsq, {m}_min, {m}_max" for m in ROLLUP_METRICS)
+
+def _create_rollup_triggers(c):
+    """Триггеры, поддерживающие measurement_rollups при вставке и удалении"""
+    c.execute('DROP TRIGGER IF EXISTS trg_rollups_insert')
+    c.execute('DROP TRIGGER IF EXISTS trg_rollups_delete')
+
+    new = _rollup_values_sql('NEW')
+    old = _rollup_values_sql('OLD')
+    current = _rollup_values_sql('measurements')
+
+    values = ', '.join(
+        f"{new[m]} IS NOT NULL, coalesce({new[m]}, 0), coalesce({new[m]} * {new[m]}, 0), {new[m]}, {new[m]}"
+        for m in ROLLUP_METRICS)
+    # min()/max() от NULL дают NULL, поэтому пустые стороны подменяются другой
+    increments = ', '.join(
+        f"{m}_count = {m}_count + excluded.{m}_count, "
+        f"{m}_sum = {m}_sum + excluded.{m}_sum, "
+        f"{m}_sumsq = {m}_sumsq + excluded.{m}_sumsq, "
+        f"{m}_min = min(coalesce({m}_min, excluded.{m}_min), coalesce(excluded.{m}_min, {m}_min)), "
+        f"{m}_max = max(coalesce({m}_max, excluded.{m}_max), coalesce(excluded.{m}_max, {m}_max))"
+        for m in ROLLUP_METRICS)
+    decrements = ', '.join(
+        f"{m}_count = {m}_count - ({old[m]} IS NOT NULL), "
+        f"{m}_sum = {m}_sum - coalesce({old[m]}, 0), "
+        f"{m}_sumsq = {m}_sumsq - coalesce({old[m]} * {old[m]}, 0)"
+        for m in ROLLUP_METRICS)
+    extremes = ' OR '.join(f"{old[m]} IN ({m}_min, {m}_max)" for m in ROLLUP_METRICS)
+    extreme_columns = ', '.join(f"{m}_min, {m}_max" for m in ROLLUP_METRICS)
+    recompute = ', '.join(f"MIN({current[m]}), MAX({current[m]})" for m in ROLLUP_METRICS)
+
+    inserts = []
+    deletes = []
+    for granularity in ROLLUP_GRANULARITIES:
+        new_bucket = _rollup_bucket_sql(granularity, 'NEW')
+        old_bucket = _rollup_bucket_sql(granularity, 'OLD')
+        start, end = _rollup_range_sql(granularity)
+        where = f"granularity = '{granularity}' AND bucket = {old_bucket}"
+
+        inserts.append(f"""
+            INSERT INTO measurement_rollups (granularity, bucket, {_rollup_columns()})
+            VALUES ('{granularity}', {new_bucket}, {values})
+            ON CONFLICT (granularity, bucket) DO UPDATE SET {increments};""")
+
+        # min/max пересчитываются по строкам периода (диапазон по индексу),
+        # только если удалили именно крайнее значение
+        deletes.append(f"""
+            UPDATE measurement_rollups SET {decrements} WHERE {where};
+            DELETE FROM measurement_rollups WHERE {where} AND glucose_count <= 0;
+            UPDATE measurement_rollups SET ({extreme_columns}) =
+                (SELECT {recompute} FROM measurements
+                 WHERE measurements.created_ms >= {start} AND measurements.created_ms < {end}
+                   AND {_rollup_bucket_sql(granularity, 'measurements')} = measurement_rollups.bucket)
+            WHERE {where} AND ({extremes});""")
+
+    c.execute(f"""
+        CREATE TRIGGER trg_rollups_insert AFTER INSERT ON measurements
+        WHEN NEW.created_ms IS NOT NULL AND {TRIGGERS_ACTIVE_SQL}
+        BEGIN {''.join(inserts)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_rollups_delete AFTER DELETE ON measurements
+        WHEN OLD.created_ms IS NOT NULL AND {TRIGGERS_ACTIVE_SQL}
+        BEGIN {''.join(deletes)}
+        END
+    """)
+
+def rebuild_rollups(conn):
+    """Пересчитать все сводки с нуля (после миграций)"""
+    values = _rollup_values_sql()
+    aggregates = ', '.join(
+        f"COUNT({values[m]}), COALESCE(SUM({values[m]}), 0), COALESCE(SUM({values[m]} * {values[m]}), 0), "
+        f"MIN({values[m]}), MAX({values[m]})"
+        for m in ROLLUP_METRICS)
+    c = conn.cursor()
+    c.execute("DELETE FROM measurement_rollups")
+    for granularity in ROLLUP_GRANULARITIES:
+        c.execute(f"""
+            INSERT INTO measurement_rollups (granularity, bucket, {_rollup_columns()})
+            SELECT '{granularity}', {_rollup_bucket_sql(granularity)} AS period, {aggregates}
+            FROM measurements
+            WHERE created_ms IS NOT NULL
+            GROUP BY period
+        """)
+
+def _init_rollups(conn):
+    """Таблица и триггеры сводок; пересчёт при смене схемы"""
+    c = conn.cursor()
+    metrics = ',\n'.join(
+        f"{m}_count INTEGER NOT NULL DEFAULT 0, {m}_sum REAL NOT NULL DEFAULT 0, "
+        f"{m}_sumsq REAL NOT NULL DEFAULT 0, {m}_min REAL, {m}_max REAL"
+        for m in ROLLUP_METRICS)
+
+    schema_changed = _get_meta(c, 'rollup_schema') != str(ROLLUP_SCHEMA_VERSION)
+    if schema_changed:
+        c.execute('DROP TABLE IF EXISTS measurement_rollups')
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS measurement_rollups
+        (granularity TEXT NOT NULL,
+         bucket TEXT NOT NULL,
+         {metrics},
+         PRIMARY KEY (granularity, bucket)) WITHOUT ROWID
+    """)
+    _create_rollup_triggers(c)
+
+    if schema_changed:
+        rebuild_rollups(conn)
+        _set_meta(c, 'rollup_schema', ROLLUP_SCHEMA_VERSION)
+
+    # Сменился APP_TZ - смещения всех записей пересчитает миграция
+    # utc_offset_backfill, после неё пересчитываются и сводки
+    if _get_meta(c, 'utc_offset_zone') != APP_TZ.key:
+        c.execute("DELETE FROM app_meta WHERE key IN ('utc_offset_backfill_id', 'utc_offset_backfill_done')")
+        _set_meta(c, 'utc_offset_zone', APP_TZ.key)
+
+def clear_measurements(c):
+    """Удалить все измерения в начале массовой загрузки. Триггеры агрегатов
+    выключены отметкой BULK_LOAD_KEY - иначе каждая удалённая строка
+    пересчитывает min/max. В той же транзакции, до фиксации, обязательно
+    вызвать finish_bulk_load(c)."""
+    _set_meta(c, BULK_LOAD_KEY, 1)
+    c.execute("DELETE FROM measurements")
+
+def finish_bulk_load(c):
+    """Пересчитать агрегаты по загруженным данным и снова включить триггеры"""
+    rebuild_stats(c.connection)
+    rebuild_rollups(c.connection)
+    c.execute("DELETE FROM app_meta WHERE key = ?", (BULK_LOAD_KEY,))
+
+def _ensure_column(c, table, column, ddl):
+    """Добавить колонку в существующую таблицу, если её ещё нет"""
+    c.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in c.fetchall()]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+def init_db(path=DB_PATH, wal=True):
+    """Инициализация базы данных (path - рабочая база или проверяемая копия)"""
     try:
-        conn = sqlite3.connect(DB_PATH)
+        if wal:
+            db.enable_wal(path)
+        
+        conn = sqlite3.connect(path)
         c = conn.cursor()
         
         c.execute('''
@@ -295,41 +753,326 @@ def init_db():
              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
         ''')
         
-        # Создаем индекс для быстрого поиска по дате
-        c.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON measurements(created_at)')
+        # Давление в отдельных колонках, время - в мс (для старых баз - добавляем)
+        _ensure_column(c, 'measurements', 'systolic', 'INTEGER')
+        _ensure_column(c, 'measurements', 'diastolic', 'INTEGER')
+        _ensure_column(c, 'measurements', 'created_ms', 'INTEGER')
+        _ensure_column(c, 'measurements', 'utc_offset', 'INTEGER')
+        
+        # Служебные отметки (прогресс миграций, версия схемы агрегатов)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS app_meta
+            (key TEXT PRIMARY KEY,
+             value TEXT)
+        ''')
+        
+        # Покрывающий индекс: диапазоны по времени и значения глюкозы читаются
+        # прямо из индекса, без обращения к таблице
+        c.execute('DROP INDEX IF EXISTS idx_created_at')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_created_ms_value ON measurements(created_ms, value)')
+        # Индекс по значению - для пересчёта min/max при удалении
+        c.execute('CREATE INDEX IF NOT EXISTS idx_value ON measurements(value)')
+        
+        # Агрегаты, которые поддерживаются триггерами на каждую вставку/удаление
+        if _get_meta(c, 'stats_schema') != str(STATS_SCHEMA_VERSION):
+            c.execute('DROP TABLE IF EXISTS measurement_stats')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS measurement_stats
+            (id INTEGER PRIMARY KEY CHECK (id = 1),
+             glucose_count INTEGER NOT NULL DEFAULT 0,
+             glucose_sum REAL NOT NULL DEFAULT 0,
+             glucose_min REAL,
+             glucose_max REAL,
+             pressure_count INTEGER NOT NULL DEFAULT 0,
+             systolic_sum INTEGER NOT NULL DEFAULT 0,
+             diastolic_count INTEGER NOT NULL DEFAULT 0,
+             diastolic_sum INTEGER NOT NULL DEFAULT 0,
+             first_ms INTEGER,
+             last_ms INTEGER,
+             last_id INTEGER,
+             last_value REAL,
+             data_version INTEGER NOT NULL DEFAULT 0,
+             changed_ms INTEGER)
+        ''')
+        _create_stats_triggers(c)
+        
+        c.execute("SELECT 1 FROM measurement_stats WHERE id = 1")
+        if c.fetchone() is None:
+            rebuild_stats(conn)
+        _set_meta(c, 'stats_schema', STATS_SCHEMA_VERSION)
+        
+        _init_rollups(conn)
         
         conn.commit()
         
         # Проверяем что таблица создана
-        c.execute("SELECT COUNT(*) FROM measurements")
-        count = c.fetchone()[0]
+        count = c.execute("SELECT glucose_count FROM measurement_stats WHERE id = 1").fetchone()[0]
         
         conn.close()
-        print(f"✅ База создана/проверена: {DB_PATH}, записей: {count}")
+        print(f"✅ База создана/проверена: {path}, записей: {count}")
         return True
     except Exception as e:
         print(f"❌ Ошибка создания БД: {e}")
         return False
 
-def get_db_connection():
-    """Получить подключение к SQLite"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+def _get_meta(c, key, default=None):
+    c.execute("SELECT value FROM app_meta WHERE key = ?", (key,))
+    row = c.fetchone()
+    return row[0] if row else default
+
+def _set_meta(c, key, value):
+    c.execute("INSERT OR REPLACE INTO app_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+# ============ ОНЛАЙН-МИГРАЦИИ ============
+# Каждая миграция идёт пачками по id: пачка - своя короткая транзакция,
+# прогресс (последний id) хранится в app_meta, поэтому миграция переживает
+# перезапуск и не блокирует запись надолго
+def _backfill_pressure_batch(c, last_id, batch_size):
+    c.execute('''
+        SELECT id, note FROM measurements
+        WHERE id > ? ORDER BY id LIMIT ?
+    ''', (last_id, batch_size))
+    rows = c.fetchall()
+    if not rows:
+        return None
+    
+    updates = []
+    for row_id, note in rows:
+        systolic, diastolic = parse_pressure(note)
+        if systolic is not None:
+            updates.append((systolic, diastolic, row_id))
+    
+    # Триггеров на UPDATE нет - агрегаты пересчитываются после миграции
+    c.executemany(
+        "UPDATE measurements SET systolic = ?, diastolic = ? WHERE id = ? AND systolic IS NULL",
+        updates)
+    return rows[-1][0]
+
+def _backfill_created_ms_batch(c, last_id, batch_size):
+    c.execute('''
+        SELECT MAX(id) FROM
+            (SELECT id FROM measurements WHERE id > ? ORDER BY id LIMIT ?)
+    ''', (last_id, batch_size))
+    upper_id = c.fetchone()[0]
+    if upper_id is None:
+        return None
+    
+    # Нераспознанное время заменяем текущим - как раньше делал отчёт
+    c.execute('''
+        UPDATE measurements
+        SET created_ms = COALESCE(CAST(strftime('%s', created_at) AS INTEGER) * 1000, ?)
+        WHERE id > ? AND id <= ? AND created_ms IS NULL
+    ''', (now_ms(), last_id, upper_id))
+    return upper_id
+
+def _backfill_utc_offset_batch(c, last_id, batch_size):
+    # Пересчитываются все строки пачки: миграция перезапускается при смене APP_TZ
+    c.execute('''
+        SELECT id, created_ms FROM measurements
+        WHERE id > ? AND created_ms IS NOT NULL
+        ORDER BY id LIMIT ?
+    ''', (last_id, batch_size))
+    rows = c.fetchall()
+    if not rows:
+        return None
+    
+    c.executemany(
+        "UPDATE measurements SET utc_offset = ? WHERE id = ?",
+        [(utc_offset_of(created_ms), row_id) for row_id, created_ms in rows])
+    return rows[-1][0]
+
+MIGRATIONS = [
+    ('pressure_backfill', _backfill_pressure_batch),
+    ('created_ms_backfill', _backfill_created_ms_batch),
+    ('utc_offset_backfill', _backfill_utc_offset_batch),
+]
+
+def run_migrations(path=DB_PATH, batch_size=1000, pause=0.05):
+    """Прогнать все незавершённые онлайн-миграции; после них пересчитать агрегаты"""
+    conn = sqlite3.connect(path, timeout=30)
+    migrated = False
+    try:
+        c = conn.cursor()
+        for name, batch in MIGRATIONS:
+            if _get_meta(c, f'{name}_done') == '1':
+                continue
+            
+            last_id = int(_get_meta(c, f'{name}_id', 0))
+            while True:
+                c.execute('BEGIN IMMEDIATE')
+                next_id = batch(c, last_id, batch_size)
+                if next_id is None:
+                    _set_meta(c, f'{name}_done', 1)
+                    conn.commit()
+                    break
+                last_id = next_id
+                _set_meta(c, f'{name}_id', last_id)
+                conn.commit()
+                migrated = True
+                time.sleep(pause)
+            print(f"✅ Миграция {name} завершена")
+        
+        if migrated:
+            c.execute('BEGIN IMMEDIATE')
+            rebuild_stats(conn)
+            rebuild_rollups(conn)
+            conn.commit()
+            chart_cache.invalidate()
+        return migrated
+    except Exception as e:
+        print(f"⚠️ Ошибка миграции: {e}")
+        return False
+    finally:
+        conn.close()
+
+def start_migrations():
+    threading.Thread(target=run_migrations, name='db-migrations', daemon=True).start()
+
+# GET-маршруты, которые всё-таки пишут в базу
+WRITE_GET_ENDPOINTS = {'setup_test_data'}
+
+def get_db_connection(readonly=None):
+    """Получить подключение к SQLite из пула (close() возвращает его обратно).
+    По умолчанию GET-запросы получают подключение только на чтение."""
+    if readonly is None:
+        readonly = (has_request_context()
+                    and request.method in ('GET', 'HEAD')
+                    and request.endpoint not in WRITE_GET_ENDPOINTS)
+    return database.connect(readonly=readonly)
+
+def get_stats(conn=None):
+    """Сводная статистика из measurement_stats - одна строка, без прохода по таблице"""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        c.execute('''
+            SELECT s.*, m.systolic AS last_systolic, m.diastolic AS last_diastolic
+            FROM measurement_stats s
+            LEFT JOIN measurements m ON m.id = s.last_id
+            WHERE s.id = 1
+        ''')
+        row = c.fetchone()
+    finally:
+        if own_conn:
+            conn.close()
+    
+    if row is None or not row['glucose_count']:
+        return {
+            'count': 0,
+            'first_ms': None,
+            'last_ms': None,
+            'first_at': None,
+            'last_at': None,
+            'glucose': {'last': None, 'avg': None, 'min': None, 'max': None},
+            'pressure': {'count': 0, 'diastolic_count': 0, 'avg_systolic': None,
+                         'avg_diastolic': None, 'last': None}
+        }
+    
+    return {
+        'count': row['glucose_count'],
+        'first_ms': row['first_ms'],
+        'last_ms': row['last_ms'],
+        'first_at': format_ms(row['first_ms']),
+        'last_at': format_ms(row['last_ms']),
+        'glucose': {
+            'last': row['last_value'],
+            'avg': round(row['glucose_sum'] / row['glucose_count'], 1),
+            'min': row['glucose_min'],
+            'max': row['glucose_max'],
+        },
+        'pressure': {
+            'count': row['pressure_count'],
+            'diastolic_count': row['diastolic_count'],
+            'avg_systolic': round(row['systolic_sum'] / row['pressure_count']) if row['pressure_count'] else None,
+            'avg_diastolic': round(row['diastolic_sum'] / row['diastolic_count']) if row['diastolic_count'] else None,
+            'last': format_pressure(row['last_systolic'], row['last_diastolic']) or None,
+        }
+    }
 
 # ============ ЗАПУСК И АВТОВОССТАНОВЛЕНИЕ ============
-print("=" * 60)
-print("🚀 GLIKOSA Tracker запускается...")
-print("=" * 60)
+# Состояние запуска для /ready и /health
+startup_state = {
+    'ready': False,
+    'restore': 'pending',
+    'startup_ms': None,
+    'restore_ms': None,
+}
 
-# Пытаемся восстановить из Telegram
-if auto_restore_from_telegram():
-    print("✅ Данные восстановлены из Telegram")
-else:
-    print("📝 Используем существующую/новую базу")
+RESTORE_LOCK_PATH = DB_PATH + '.restore.lock'
+RESTORE_MARKER_PATH = DB_PATH + '.restored'
 
-# Инициализируем базу
-init_db()
+def deferred_restore():
+    """Автовосстановление в фоне: один раз на деплой и только в одном воркере.
+    Файловая блокировка отсекает параллельные воркеры gunicorn, маркер рядом
+    с базой - повторные запуски (на Render диск чистый после каждого деплоя).
+    Маркер пишется только после восстановления или подтверждённого «бэкапа
+    нет»: при недоступном Telegram следующий запуск попробует снова."""
+    started = time.perf_counter()
+    lock_file = open(RESTORE_LOCK_PATH, 'w')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Готовность этого воркера - когда тот закончит (см. /ready)
+                startup_state['restore'] = 'other_worker'
+                lock_file.close()
+                lock_file = None
+                return
+        
+        if os.path.exists(RESTORE_MARKER_PATH):
+            startup_state['restore'] = 'skipped'
+            return
+        
+        startup_state['restore'] = 'running'
+        result = auto_restore_from_telegram()
+        startup_state['restore'] = result
+        if result == 'error':
+            print("⚠️ Восстановление не удалось, повторим при следующем запуске")
+            return
+        if result == 'restored':
+            print("✅ Данные восстановлены из Telegram")
+        else:
+            print("📝 Используем существующую/новую базу")
+        
+        with open(RESTORE_MARKER_PATH, 'w') as marker:
+            marker.write(datetime.now().isoformat())
+    except Exception as e:
+        print(f"⚠️ Ошибка фонового восстановления: {e}")
+        startup_state['restore'] = 'error'
+    finally:
+        if lock_file is not None:
+            startup_state['restore_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            startup_state['ready'] = True
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+def _restore_finished_elsewhere():
+    """Восстановление в другом воркере закончилось: есть маркер или
+    блокировка уже свободна (тот воркер завершил попытку, пусть и с ошибкой)"""
+    if os.path.exists(RESTORE_MARKER_PATH):
+        return True
+    with open(RESTORE_LOCK_PATH, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return True
+
+# Процессы пула рендера (charts.py) импортируют запущенный скрипт под именем
+# __mp_main__ - им база и Telegram не нужны
+if __name__ != '__mp_main__':
+    print("=" * 60)
+    print("🚀 GLIKOSA Tracker запускается...")
+    print("=" * 60)
+    
+    # Инициализируем базу; восстановление из Telegram и миграции стартуют
+    # в фоне в конце модуля, когда определено всё, что они используют
+    init_db()
 
 # ============ ОСНОВНЫЕ МАРШРУТЫ ============
 @app.route('/')
@@ -348,18 +1091,23 @@ def dashboard():
 def analytics():
     return render_template('dashboard.html')
 
+@app.route('/ready')
+def readiness():
+    """Готовность: база инициализирована и фоновое восстановление завершено"""
+    if not startup_state['ready'] and startup_state['restore'] == 'other_worker':
+        if _restore_finished_elsewhere():
+            startup_state['ready'] = True
+    return jsonify(startup_state), (200 if startup_state['ready'] else 503)
+
 @app.route('/health')
 def health_check():
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM measurements")
-        count = c.fetchone()[0]
-        
-        conn.close()
+        count = get_stats()['count']
         
         return jsonify({
             "status": "healthy",
+            "ready": startup_state['ready'],
+            "startup_ms": startup_state['startup_ms'],
             "timestamp": datetime.now().isoformat(),
             "service": "glucose_tracker",
             "db_path": DB_PATH,
@@ -385,39 +1133,30 @@ def add_measurement():
         if not data or 'value' not in data:
             return jsonify({'error': 'Нет данных', 'success': False}), 400
             
-        value = float(data['value'])
-        note = data.get('note', '')
+        try:
+            params = measurement_from_payload(data)
+        except ValueError as e:
+            return jsonify({'error': str(e), 'success': False}), 400
+        value, note = params[0], params[1]
         
         conn = get_db_connection()
         c = conn.cursor()
-        c.execute(
-            'INSERT INTO measurements (value, note) VALUES (?, ?)',
-            (value, note)
-        )
+        c.execute(INSERT_MEASUREMENT_SQL, params)
         conn.commit()
         
         inserted_id = c.lastrowid
+        chart_cache.invalidate()
         
         c.close()
         conn.close()
         
-        # Отправляем уведомление в Telegram о новой записи
-        try:
-            message = f"📝 *Новая запись глюкозы*\n\n"
-            message += f"📊 Значение: *{value} mmol/L*\n"
-            if note:
-                message += f"📝 Примечание: {note}\n"
-            message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
-            
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-            payload = {
-                'chat_id': CHAT_ID,
-                'text': message,
-                'parse_mode': 'Markdown'
-            }
-            requests.post(url, json=payload, timeout=5)
-        except:
-            pass  # Игнорируем ошибки Telegram
+        # Уведомление в Telegram уходит из фоновой очереди, ответ его не ждёт
+        message = f"📝 *Новая запись глюкозы*\n\n"
+        message += f"📊 Значение: *{value} mmol/L*\n"
+        if note:
+            message += f"📝 Примечание: {note}\n"
+        message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        telegram_notifier.notify(message)
         
         return jsonify({
             'message': '✅ Данные сохранены!',
@@ -428,91 +1167,691 @@ def add_measurement():
     except Exception as e:
         return jsonify({'error': str(e), 'success': False}), 500
 
-@app.route('/api/measurements')
-def get_measurements():
+# Пакетная загрузка: показания глюкометра/CGM приходят массивом и пишутся
+# одной транзакцией через executemany
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 10000))
+
+@app.route('/api/measurements/batch', methods=['POST'])
+def add_measurements_batch():
+    """Принимает [{value, note, created_at|created_ms, systolic, diastolic}, ...]
+    или {"measurements": [...]}. Неверные элементы пропускаются, результат -
+    по каждому элементу в порядке запроса."""
+    try:
+        data = request.get_json(silent=True)
+        items = data.get('measurements') if isinstance(data, dict) else data
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Ожидается непустой массив измерений', 'success': False}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Не больше {BATCH_MAX_ITEMS} измерений за запрос', 'success': False}), 413
+        
+        received_ms = now_ms()
+        results = []
+        rows = []
+        for index, item in enumerate(items):
+            try:
+                rows.append(measurement_from_payload(item, default_ms=received_ms, check_range=True))
+                results.append({'index': index, 'success': True})
+            except ValueError as e:
+                results.append({'index': index, 'success': False, 'error': str(e)})
+        
+        if rows:
+            conn = get_db_connection()
+            try:
+                c = conn.cursor()
+                c.execute('BEGIN IMMEDIATE')
+                c.executemany(INSERT_MEASUREMENT_SQL, rows)
+                # Писатель один (BEGIN IMMEDIATE), поэтому id пачки идут подряд
+                # и заканчиваются на последнем вставленном
+                last_id = c.execute('SELECT last_insert_rowid()').fetchone()[0]
+                conn.commit()
+                c.close()
+            finally:
+                # При ошибке пул откатит незавершённую транзакцию
+                conn.close()
+            chart_cache.invalidate()
+            
+            ids = iter(range(last_id - len(rows) + 1, last_id + 1))
+            for result in results:
+                if result['success']:
+                    result['id'] = next(ids)
+            
+            # Одно сводное уведомление на всю пачку
+            values = [row[0] for row in rows]
+            times = [row[3] for row in rows]
+            message = f"📥 *Пакетная загрузка*\n\n"
+            message += f"📊 Записей: {len(rows)}"
+            if len(rows) < len(items):
+                message += f" (отклонено: {len(items) - len(rows)})"
+            message += f"\n📅 Период: {format_ms(min(times), '%d.%m.%Y %H:%M')} — {format_ms(max(times), '%d.%m.%Y %H:%M')}\n"
+            message += f"📉 Мин/средн/макс: {min(values)} / {round(sum(values) / len(values), 1)} / {max(values)} mmol/L\n"
+            message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+            telegram_notifier.notify(message)
+        
+        return jsonify({
+            'success': bool(rows),
+            'inserted': len(rows),
+            'rejected': len(items) - len(rows),
+            'results': results
+        }), (200 if rows else 400)
+        
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@app.route('/api/stats')
+def api_stats():
+    """Сводка по глюкозе и давлению из таблицы агрегатов"""
+    try:
+        return jsonify(get_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _rollup_bucket_key(granularity, value):
+    """Дата 'ГГГГ-ММ-ДД' -> ключ периода, в который она попадает"""
+    day = datetime.fromisoformat(value.strip()[:10]).date()
+    if granularity == 'week':
+        day -= timedelta(days=day.weekday())
+    elif granularity == 'month':
+        day = day.replace(day=1)
+    return day.isoformat()
+
+def _rollup_metric(row, metric):
+    count = row[f'{metric}_count']
+    if not count:
+        return {'count': 0, 'avg': None, 'min': None, 'max': None, 'sd': None}
+    total = row[f'{metric}_sum']
+    mean = total / count
+    # Выборочное стандартное отклонение по сумме и сумме квадратов
+    sd = None
+    if count > 1:
+        sd = round(max(0.0, (row[f'{metric}_sumsq'] - total * mean) / (count - 1)) ** 0.5, 2)
+    return {
+        'count': count,
+        'avg': round(mean, 1),
+        'min': row[f'{metric}_min'],
+        'max': row[f'{metric}_max'],
+        'sd': sd,
+    }
+
+@app.route('/api/rollups')
+def api_rollups():
+    """Сводки по периодам: ?granularity=day|week|month&from=ГГГГ-ММ-ДД&to=ГГГГ-ММ-ДД"""
     try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ROLLUP_GRANULARITIES:
+            return jsonify({'error': f'granularity: одно из {", ".join(ROLLUP_GRANULARITIES)}'}), 400
+        
+        where = ['granularity = ?']
+        params = [granularity]
+        try:
+            if request.args.get('from'):
+                where.append('bucket >= ?')
+                params.append(_rollup_bucket_key(granularity, request.args['from']))
+            if request.args.get('to'):
+                where.append('bucket <= ?')
+                params.append(_rollup_bucket_key(granularity, request.args['to']))
+        except ValueError as e:
+            return jsonify({'error': f'Неверная дата: {e}'}), 400
+        
         conn = get_db_connection()
         c = conn.cursor()
+        c.execute(f'''
+            SELECT * FROM measurement_rollups
+            WHERE {' AND '.join(where)}
+            ORDER BY bucket
+        ''', params)
+        rows = c.fetchall()
+        conn.close()
+        
+        return jsonify({
+            'granularity': granularity,
+            'timezone': APP_TZ.key,
+            'rollups': [
+                dict({'period': row['bucket']},
+                     **{metric: _rollup_metric(row, metric) for metric in ROLLUP_METRICS})
+                for row in rows
+            ]
+        })
         
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ КЭШ ГРАФИКОВ ============
+def get_data_version(conn=None):
+    """Версия данных: счётчик изменений из measurement_stats плюс count/последняя
+    запись/сумма - чтобы не совпасть с версией другой, загруженной базы"""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        c = conn.cursor()
         c.execute('''
-            SELECT id, value, note, 
-                   datetime(created_at) as created_at 
-            FROM measurements 
-            ORDER BY created_at DESC
+            SELECT data_version, glucose_count, last_id, last_ms, glucose_sum
+            FROM measurement_stats WHERE id = 1
         ''')
+        row = c.fetchone()
+    finally:
+        if own_conn:
+            conn.close()
+    return tuple(row) if row else (0,)
+
+def get_data_changed_ms(conn):
+    """Когда данные менялись последний раз (мс) - для Last-Modified"""
+    row = conn.execute("SELECT changed_ms FROM measurement_stats WHERE id = 1").fetchone()
+    return row[0] if row and row[0] is not None else None
+
+class ChartCache:
+    """LRU-кэш отрендеренных графиков с ограничением по числу и объёму"""
+    
+    _MISSING = object()
+    
+    def __init__(self, max_items=32, max_bytes=16 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+    
+    def put(self, key, value):
+        size = len(value) if value else 0
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                old = self._items.pop(key)
+                self._bytes -= len(old) if old else 0
+            self._items[key] = value
+            self._bytes += size
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted) if evicted else 0
+    
+    def get_or_render(self, key, render):
+        """Вернуть график из кэша или отрендерить и запомнить.
+        None (нечего рисовать) тоже кэшируется."""
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            value = render()
+            self.put(key, value)
+        return value
+    
+    def invalidate(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+chart_cache = ChartCache()
+
+def _bump_data_version():
+    """Сдвинуть версию данных (например, после подмены файла базы)"""
+    conn = get_db_connection(readonly=False)
+    conn.execute(f"UPDATE measurement_stats SET data_version = data_version + 1, changed_ms = {NOW_MS_SQL} WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+# Постраничная выдача: keyset по (created_ms, id), без OFFSET. Страница -
+# только по запросу (limit/before/after), без них ответ прежний: весь список
+MEASUREMENTS_PAGE_PARAMS = ('limit', 'before', 'after')
+MEASUREMENTS_PAGE_DEFAULT = 100
+MEASUREMENTS_PAGE_MAX = 1000
+
+def _encode_cursor(created_ms, row_id):
+    raw = f"{created_ms}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    created_ms, row_id = raw.rsplit('|', 1)
+    return int(created_ms), int(row_id)
+
+def _parse_date_bound(value, end=False):
+    """'2024-11-29' или '2024-11-29 10:00[:00]' (время APP_TZ) -> граница в мс.
+    Для конца диапазона дата без времени включает весь день."""
+    value = value.strip()
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=APP_TZ)
+    if end and len(value) == 10:
+        return round((dt + timedelta(days=1)).timestamp() * 1000) - 1
+    return round(dt.timestamp() * 1000)
+
+def _measurement_filters(args):
+    """Условия WHERE для from/to/before/after. Все условия - по голому
+    measurements.created_ms, чтобы SQLite сканировал диапазон idx_created_ms_value."""
+    where = []
+    params = []
+    
+    if args.get('from'):
+        where.append('measurements.created_ms >= ?')
+        params.append(_parse_date_bound(args['from']))
+    if args.get('to'):
+        where.append('measurements.created_ms <= ?')
+        params.append(_parse_date_bound(args['to'], end=True))
+    
+    if args.get('before'):
+        created_ms, row_id = _decode_cursor(args['before'])
+        where.append('measurements.created_ms <= ? AND (measurements.created_ms < ? OR measurements.id < ?)')
+        params.extend([created_ms, created_ms, row_id])
+    elif args.get('after'):
+        created_ms, row_id = _decode_cursor(args['after'])
+        where.append('measurements.created_ms >= ? AND (measurements.created_ms > ? OR measurements.id > ?)')
+        params.extend([created_ms, created_ms, row_id])
+    
+    return (' WHERE ' + ' AND '.join(where)) if where else '', params
+
+def _range_filters(args):
+    """Условия WHERE только по периоду from/to (без курсоров)"""
+    return _measurement_filters({key: args[key] for key in ('from', 'to') if args.get(key)})
+
+@app.route('/api/measurements')
+def get_measurements():
+    try:
+        # Старые клиенты ждут голый список всех записей - отдаём его, пока
+        # не запрошена страница
+        paged = any(request.args.get(key) for key in MEASUREMENTS_PAGE_PARAMS)
+        try:
+            limit = int(request.args.get('limit', MEASUREMENTS_PAGE_DEFAULT))
+            limit = max(1, min(limit, MEASUREMENTS_PAGE_MAX))
+            where_sql, params = _measurement_filters(request.args)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Неверные параметры: {e}'}), 400
+        
+        # При after идём по возрастанию от курсора и потом разворачиваем,
+        # чтобы ответ всегда был от новых к старым
+        ascending = bool(request.args.get('after')) and not request.args.get('before')
+        order = 'ASC' if ascending else 'DESC'
+        
+        conn = get_db_connection()
+        c = conn.cursor()
+        
+        limit_sql = ' LIMIT ?' if paged else ''
+        if paged:
+            params = params + [limit + 1]
+        c.execute(f'''
+            SELECT id, value, note, systolic, diastolic, created_ms
+            FROM measurements{where_sql}
+            ORDER BY measurements.created_ms {order}, measurements.id {order}{limit_sql}
+        ''', params)
+        rows = c.fetchall()
+        conn.close()
+        
+        has_more = paged and len(rows) > limit
+        rows = rows[:limit]
+        if ascending:
+            rows.reverse()
         
         measurements = []
-        for row in c.fetchall():
+        for row in rows:
+            created_at = format_ms(row['created_ms']) or ''
             measurements.append({
                 'id': row['id'],
                 'value': row['value'],
                 'note': row['note'] or '',
-                'created_at': row['created_at'],
-                'date': row['created_at'][:10],
-                'time': row['created_at'][11:16]
+                'systolic': row['systolic'],
+                'diastolic': row['diastolic'],
+                'pressure': format_pressure(row['systolic'], row['diastolic']),
+                'created_at': created_at,
+                'created_ms': row['created_ms'],
+                'date': created_at[:10],
+                'time': created_at[11:16]
             })
         
-        conn.close()
-        return jsonify(measurements)
+        if not paged:
+            return jsonify(measurements)
+        
+        # next_cursor - к более старым записям, prev_cursor - к более новым
+        next_cursor = None
+        prev_cursor = None
+        if rows:
+            older_exist = ascending or has_more
+            newer_exist = has_more if ascending else bool(request.args.get('before'))
+            if older_exist:
+                next_cursor = _encode_cursor(rows[-1]['created_ms'], rows[-1]['id'])
+            if newer_exist:
+                prev_cursor = _encode_cursor(rows[0]['created_ms'], rows[0]['id'])
+        
+        return jsonify({
+            'measurements': measurements,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
+        })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Функция для создания графиков
-def create_pressure_chart(measurements):
-    """Создать график артериального давления"""
+# ============ РЯДЫ ДЛЯ ГРАФИКОВ ============
+# Графики получают не «последние N точек», а весь выбранный период,
+# прореженный LTTB (downsample.py) до фиксированного числа точек
+SERIES_POINTS_DEFAULT = 500
+SERIES_POINTS_MAX = 5000
+
+def load_series(conn, where_sql='', params=(), points=SERIES_POINTS_DEFAULT):
+    """Ряды глюкозы и давления за период (по возрастанию времени), прореженные
+    до points точек - см. downsample.measurement_series"""
+    c = conn.cursor()
+    # Кортежи вместо sqlite3.Row: NumPy разбирает их в разы быстрее
+    c.row_factory = None
+    c.execute(f'''
+        SELECT created_ms, value, systolic, diastolic
+        FROM measurements{where_sql}
+        ORDER BY measurements.created_ms, measurements.id
+    ''', list(params))
+    return downsample.measurement_series(c.fetchall(), points)
+
+@app.route('/api/series')
+def get_series():
+    """Ряды для графиков: ?from=&to=&points=N (LTTB, по умолчанию 500)"""
     try:
-        systolic_list = []
-        diastolic_list = []
-        dates_list = []
-        
-        for m in measurements:
-            pressure = m.get('pressure', '')
-            if pressure and pressure != '-':
-                numbers = re.findall(r'\d+', str(pressure))
-                if len(numbers) >= 2:
-                    systolic_list.append(int(numbers[0]))
-                    diastolic_list.append(int(numbers[1]))
-                    
-                    date_obj = datetime.strptime(m['date'], '%Y-%m-%d')
-                    date_str = date_obj.strftime('%d.%m')
-                    dates_list.append(f"{date_str}\n{m['time']}")
-        
-        if len(systolic_list) < 2:
-            return None
+        try:
+            points = int(request.args.get('points', SERIES_POINTS_DEFAULT))
+            points = max(3, min(points, SERIES_POINTS_MAX))
+            where_sql, params = _range_filters(request.args)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Неверные параметры: {e}'}), 400
         
-        plt.figure(figsize=(14, 6))
-        x_indices = range(len(systolic_list))
+        conn = get_db_connection()
+        series = load_series(conn, where_sql, params, points)
+        conn.close()
         
-        plt.plot(x_indices, systolic_list, 'ro-', 
-                linewidth=2, markersize=8, label='Верхнее (систолическое)')
-        plt.plot(x_indices, diastolic_list, 'bs-',
-                linewidth=2, markersize=8, label='Нижнее (диастолическое)')
+        return jsonify({
+            'total': series['total'],
+            'points': points,
+            'glucose': [
+                {'created_ms': created_ms, 'value': value}
+                for created_ms, value in series['glucose']
+            ],
+            'pressure': [
+                {'created_ms': created_ms, 'systolic': systolic, 'diastolic': diastolic}
+                for created_ms, systolic, diastolic in series['pressure']
+            ]
+        })
         
-        plt.axhspan(110, 130, alpha=0.1, color='green', label='Норма верхнего')
-        plt.axhspan(70, 85, alpha=0.1, color='lightblue', label='Норма нижнего')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ АНАЛИТИКА ============
+def load_analytics(conn, where_sql='', params=()):
+    """Гликемические показатели за период (см. glycemia.py). Местное время
+    считается в SQL из сохранённого смещения - как в сводках. Результат
+    лежит в chart_cache (как JSON) до изменения данных"""
+    cache_key = ('analytics', get_data_version(conn), where_sql, tuple(params))
+    cached = chart_cache.get(cache_key)
+    if cached is not None:
+        return json.loads(cached)
+    
+    c = conn.cursor()
+    # Кортежи вместо sqlite3.Row: NumPy разбирает их в разы быстрее
+    c.row_factory = None
+    c.execute(f'''
+        SELECT created_ms, created_ms / 1000 + coalesce(utc_offset, 0), value
+        FROM measurements{where_sql}
+        ORDER BY measurements.created_ms, measurements.id
+    ''', list(params))
+    result = glycemia.analyze(c.fetchall())
+    result['timezone'] = APP_TZ.key
+    chart_cache.put(cache_key, json.dumps(result).encode('utf-8'))
+    return result
+
+@app.route('/api/analytics')
+def get_analytics():
+    """Гликемические показатели: ?from=&to= (по умолчанию - все измерения)"""
+    try:
+        try:
+            where_sql, params = _range_filters(request.args)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Неверные параметры: {e}'}), 400
         
-        plt.title('Динамика артериального давления', fontsize=16, fontweight='bold', pad=20)
-        plt.xlabel('Дата и время измерения →', fontsize=12, labelpad=10)
-        plt.ylabel('Давление (мм рт. ст.)', fontsize=12, labelpad=10)
-        plt.grid(True, alpha=0.3, linestyle='--')
-        plt.legend(loc='upper left', fontsize=10)
+        conn = get_db_connection()
+        try:
+            result = load_analytics(conn, where_sql, params)
+        finally:
+            conn.close()
         
-        if dates_list:
-            plt.xticks(x_indices, dates_list, rotation=45, fontsize=10, ha='right')
+        return jsonify(result)
         
-        plt.tight_layout()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ ПОТОКОВЫЙ ЭКСПОРТ ============
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = ('id', 'value', 'note', 'created_at', 'created_ms', 'systolic', 'diastolic')
+
+def iter_measurement_rows(where_sql='', params=(), batch_size=EXPORT_BATCH_SIZE):
+    """Генератор строк measurements пачками через fetchmany - в памяти
+    одновременно не больше batch_size записей"""
+    conn = get_db_connection(readonly=True)
+    try:
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT id, value, note, created_at, created_ms, systolic, diastolic
+            FROM measurements{where_sql}
+            ORDER BY measurements.created_ms, measurements.id
+        ''', list(params))
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        conn.close()
+
+def iter_ndjson(rows):
+    """Одна JSON-запись на строку"""
+    for row in rows:
+        yield json.dumps(dict(row), ensure_ascii=False, default=str) + '\n'
+
+def iter_json_array(rows):
+    """Компактный JSON-массив по кусочкам - формат бэкапа для восстановления"""
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + json.dumps(dict(row), ensure_ascii=False, default=str)
+        first = False
+    yield ']'
+
+class _LineBuffer:
+    """Приёмник для csv.writer: отдаёт последнюю записанную строку"""
+    def write(self, line):
+        return line
+
+def iter_csv(rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+def _export_response(serializer, mimetype, extension):
+    try:
+        where_sql, params = _measurement_filters({
+            'from': request.args.get('from'),
+            'to': request.args.get('to')
+        })
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Неверные параметры: {e}'}), 400
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return Response(
+        serializer(iter_measurement_rows(where_sql, params)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=glucose_export_{timestamp}.{extension}'}
+    )
+
+@app.route('/api/measurements.ndjson')
+def export_measurements_ndjson():
+    """Экспорт всех измерений в NDJSON без загрузки таблицы в память"""
+    return _export_response(iter_ndjson, 'application/x-ndjson', 'ndjson')
+
+@app.route('/api/measurements.csv')
+def export_measurements_csv():
+    """Экспорт всех измерений в CSV без загрузки таблицы в память"""
+    return _export_response(iter_csv, 'text/csv', 'csv')
+
+# Функции для создания графиков: здесь только подготовка данных,
+# сам рендер - в charts.py, в пуле процессов
+chart_renderer = charts.RenderPool.from_env()
+
+# Сколько точек рисуется на графиках отчёта (ряд прореживается LTTB)
+REPORT_CHART_POINTS = int(os.environ.get('REPORT_CHART_POINTS', '200'))
+
+def _chart_label(created_ms):
+    return format_ms(created_ms, '%d.%m\n%H:%M')
+
+def create_pressure_chart(series, **options):
+    """Создать график артериального давления по ряду load_series.
+    options - fmt/dpi/size для charts.render_pressure_chart"""
+    try:
+        points = [(created_ms, systolic, diastolic)
+                  for created_ms, systolic, diastolic in series['pressure'] if diastolic]
+        if len(points) < 2:
+            return None
+        
+        dates_list = [_chart_label(created_ms) for created_ms, _, _ in points]
+        systolic_list = [systolic for _, systolic, _ in points]
+        diastolic_list = [diastolic for _, _, diastolic in points]
         
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', facecolor='white')
-        plt.close()
-        buf.seek(0)
-        return buf.getvalue()
+        return chart_renderer.render(charts.render_pressure_chart,
+                                     dates_list, systolic_list, diastolic_list, **options)
         
+    except charts.RenderError:
+        raise
     except Exception as e:
         print(f"⚠️ Ошибка создания графика давления: {e}")
         return None
 
+def create_glucose_chart(series, **options):
+    """Создать график глюкозы по ряду load_series"""
+    try:
+        if not series['glucose']:
+            return None
+        
+        dates_for_x = [_chart_label(created_ms) for created_ms, _ in series['glucose']]
+        values_for_y = [value for _, value in series['glucose']]
+        
+        return chart_renderer.render(charts.render_glucose_chart, dates_for_x, values_for_y, **options)
+        
+    except charts.RenderError:
+        raise
+    except Exception as e:
+        print(f"⚠️ Ошибка создания графика глюкозы: {e}")
+        return None
+
+# ============ ГРАФИКИ ОТДЕЛЬНЫМИ КАРТИНКАМИ ============
+# Отчёт ссылается на /charts/<вид>.<формат>, а не встраивает base64: страница
+# отдаётся сразу, картинки грузятся параллельно и кэшируются браузером.
+# ETag считается из версии данных, периода и параметров картинки ещё до
+# рендера, поэтому повторный запрос с If-None-Match получает 304 без
+# обращения к графикам.
+#
+# Формат: svg (по умолчанию в отчёте - меньше и печатается чётко) или png.
+# Параметры: ?dpi= (только png) и ?width=&height= в дюймах.
+CHART_DPI_RANGE = (50, 300)
+CHART_WIDTH_RANGE = (4, 20)
+CHART_HEIGHT_RANGE = (3, 12)
+CHART_KINDS = {
+    'glucose': create_glucose_chart,
+    'pressure': create_pressure_chart,
+}
+
+_NOT_CACHED = object()
+
+def _clamp(value, bounds):
+    return max(bounds[0], min(value, bounds[1]))
+
+def _chart_options(fmt, args):
+    """Параметры рендера из запроса -> словарь для charts.render_*_chart.
+    Неверные числа - ValueError"""
+    width = _clamp(float(args.get('width', charts.DEFAULT_SIZE[0])), CHART_WIDTH_RANGE)
+    height = _clamp(float(args.get('height', charts.DEFAULT_SIZE[1])), CHART_HEIGHT_RANGE)
+    # SVG от DPI не зависит - не плодим одинаковые варианты в кэше
+    dpi = charts.DEFAULT_DPI
+    if fmt == 'png':
+        dpi = _clamp(int(args.get('dpi', charts.DEFAULT_DPI)), CHART_DPI_RANGE)
+    return {'fmt': fmt, 'dpi': dpi, 'size': (width, height)}
+
+def _chart_not_modified(etag, last_modified):
+    """Подходит ли закэшированная у клиента картинка (ETag важнее даты)"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return bool(since and last_modified and last_modified <= since)
+
+@app.route('/charts/<kind>.<fmt>')
+def chart_image(kind, fmt):
+    """График отчёта: ?from=&to= (по умолчанию - все измерения), dpi, width, height"""
+    if kind not in CHART_KINDS or fmt not in charts.CHART_FORMATS:
+        return jsonify({'error': f'Неизвестный график: {kind}.{fmt}'}), 404
+    try:
+        try:
+            where_sql, params = _range_filters(request.args)
+            options = _chart_options(fmt, request.args)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Неверные параметры: {e}'}), 400
+        period = (request.args.get('from', ''), request.args.get('to', ''))
+        # SVG - текст и сжимается в разы; PNG уже сжат
+        gzipped = fmt == 'svg' and 'gzip' in request.accept_encodings
+        
+        conn = get_db_connection()
+        try:
+            data_version = get_data_version(conn)
+            changed_ms = get_data_changed_ms(conn)
+            variant = (kind, period, fmt, options['dpi'], options['size'])
+            etag = hashlib.md5(repr((data_version, variant, REPORT_CHART_POINTS)).encode()).hexdigest()
+            # Сжатое и несжатое тело - разные представления, у них разные ETag
+            if gzipped:
+                etag += '-gz'
+            # Last-Modified - с точностью до секунды, как в HTTP
+            last_modified = (datetime.fromtimestamp(changed_ms // 1000, tz=timezone.utc)
+                             if changed_ms is not None else None)
+            
+            if _chart_not_modified(etag, last_modified):
+                response = Response(status=304)
+                chart = series = None
+            else:
+                response = None
+                cache_key = (data_version,) + variant
+                chart = chart_cache.get(cache_key, _NOT_CACHED)
+                series = (load_series(conn, where_sql, params, REPORT_CHART_POINTS)
+                          if chart is _NOT_CACHED else None)
+        finally:
+            conn.close()
+        
+        if response is None:
+            # Рендер - уже без подключения к базе; None (нечего рисовать) тоже кэшируется
+            if chart is _NOT_CACHED:
+                chart = CHART_KINDS[kind](series, **options)
+                chart_cache.put(cache_key, chart)
+            if chart is None:
+                return jsonify({'error': 'Недостаточно данных для графика'}), 404
+            response = Response(chart, mimetype=charts.CHART_FORMATS[fmt])
+            if gzipped:
+                response.set_data(gzip.compress(chart, compresslevel=6))
+                response.content_encoding = 'gzip'
+        
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        if fmt == 'svg':
+            response.vary.add('Accept-Encoding')
+        # Браузер хранит картинку, но перед показом сверяет ETag
+        response.cache_control.no_cache = True
+        return response
+        
+    except charts.RenderError as e:
+        return jsonify({'error': f'График не построен: {e}'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/print_report')
 def print_report():
     """Генерация печатного отчета"""
@@ -520,132 +1859,44 @@ def print_report():
         conn = get_db_connection()
         c = conn.cursor()
         
+        # Таблица - последние 30 записей
         c.execute('''
             SELECT 
                 value, 
-                COALESCE(note, '') as note,
-                datetime(created_at) as created_at
+                systolic,
+                diastolic,
+                created_ms
             FROM measurements 
-            ORDER BY created_at DESC
+            ORDER BY created_ms DESC
+            LIMIT 30
         ''')
         
         measurements_for_table = []
-        measurements_for_chart = []
-        glucose_values = []
-        
         for row in c.fetchall():
-            value = float(row['value'])
-            note = row['note']
-            created_at = row['created_at']
-            
-            # Парсим дату
-            try:
-                dt = datetime.strptime(created_at[:19], '%Y-%m-%d %H:%M:%S')
-                date_str = dt.strftime('%Y-%m-%d')
-                time_str = dt.strftime('%H:%M')
-                timestamp = dt
-            except:
-                date_str = datetime.now().strftime('%Y-%m-%d')
-                time_str = datetime.now().strftime('%H:%M')
-                timestamp = datetime.now()
+            # Время хранится числом - строки не разбираем
+            timestamp = from_epoch_ms(row['created_ms'] if row['created_ms'] is not None else now_ms())
             
-            # Извлекаем давление
-            pressure = ''
-            if note and 'Давление:' in note:
-                try:
-                    pressure_part = note.split('Давление:')[1].strip()
-                    numbers = re.findall(r'\d+', pressure_part)
-                    if numbers:
-                        if len(numbers) >= 2:
-                            pressure = f"{numbers[0]}-{numbers[1]}"
-                        else:
-                            pressure = numbers[0]
-                except:
-                    pass
+            # Давление уже разобрано при записи
+            pressure = format_pressure(row['systolic'], row['diastolic'])
             
-            if len(measurements_for_table) < 30:
-                measurements_for_table.append({
-                    'date': date_str,
-                    'time': time_str,
-                    'value': value,
-                    'pressure': pressure if pressure else '-'
-                })
-            
-            measurements_for_chart.append({
-                'date': date_str,
-                'time': time_str,
-                'value': value,
-                'pressure': pressure,
-                'timestamp': timestamp
+            measurements_for_table.append({
+                'date': timestamp.strftime('%Y-%m-%d'),
+                'time': timestamp.strftime('%H:%M'),
+                'value': float(row['value']),
+                'pressure': pressure if pressure else '-'
             })
-            glucose_values.append(value)
-        
-        conn.close()
-        
-        # Сортировка для графиков
-        measurements_for_chart.sort(key=lambda x: x['timestamp'])
         
-        # График глюкозы
-        glucose_chart_base64 = ""
-        if measurements_for_chart:
-            try:
-                chart_data = measurements_for_chart[-20:] if len(measurements_for_chart) > 20 else measurements_for_chart
-                
-                dates_for_x = []
-                values_for_y = []
-                
-                for m in chart_data:
-                    date_obj = datetime.strptime(m['date'], '%Y-%m-%d')
-                    date_str = date_obj.strftime('%d.%m')
-                    dates_for_x.append(f"{date_str}\n{m['time']}")
-                    values_for_y.append(m['value'])
-                
-                plt.figure(figsize=(14, 6))
-                plt.plot(values_for_y, marker='o', linewidth=2, markersize=6, 
-                        color='#2c3e50', markerfacecolor='white', markeredgewidth=2)
-                
-                plt.title('Динамика уровня глюкозы', fontsize=16, fontweight='bold', pad=20)
-                plt.xlabel('Дата и время измерения →', fontsize=12, labelpad=10)
-                plt.ylabel('Глюкоза (mmol/L)', fontsize=12, labelpad=10)
-                plt.grid(True, alpha=0.3, linestyle='--')
-                
-                if len(dates_for_x) > 0:
-                    plt.xticks(range(len(dates_for_x)), dates_for_x, rotation=45, fontsize=10, ha='right')
-                
-                plt.axhspan(3.9, 5.5, alpha=0.1, color='green')
-                plt.tight_layout()
-                
-                buf = io.BytesIO()
-                plt.savefig(buf, format='png', dpi=100, bbox_inches='tight', facecolor='white')
-                plt.close()
-                buf.seek(0)
-                glucose_chart_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-                
-            except Exception as chart_error:
-                print(f"⚠️ Ошибка создания графика глюкозы: {chart_error}")
-                glucose_chart_base64 = ""
-        
-        # График давления
-        pressure_chart_base64 = ""
-        if measurements_for_chart:
-            pressure_chart = create_pressure_chart(measurements_for_chart)
-            if pressure_chart:
-                pressure_chart_base64 = base64.b64encode(pressure_chart).decode('utf-8')
-        
-        # Статистика
-        if glucose_values:
+        # Статистика - из агрегатов, без прохода по таблице
+        summary = get_stats(conn)
+        if summary['count']:
             stats = {
-                'total': len(glucose_values),
-                'avg_glucose': round(sum(glucose_values) / len(glucose_values), 1),
-                'min_glucose': min(glucose_values),
-                'max_glucose': max(glucose_values),
+                'total': summary['count'],
+                'avg_glucose': summary['glucose']['avg'],
+                'min_glucose': summary['glucose']['min'],
+                'max_glucose': summary['glucose']['max'],
             }
-            
-            if measurements_for_chart:
-                start_date = measurements_for_chart[0]['date']
-                end_date = measurements_for_chart[-1]['date']
-            else:
-                start_date = end_date = datetime.now().strftime('%Y-%m-%d')
+            start_date = format_ms(summary['first_ms'], '%Y-%m-%d')
+            end_date = format_ms(summary['last_ms'], '%Y-%m-%d')
         else:
             stats = {
                 'total': 0,
@@ -655,13 +1906,24 @@ def print_report():
             }
             start_date = end_date = datetime.now().strftime('%Y-%m-%d')
         
+        # Графики браузер загружает отдельно с /charts/<вид>.png
+        has_glucose_chart = summary['count'] > 0
+        # График давления рисует только записи с нижним давлением
+        # (create_pressure_chart) - «160+» без него не в счёт
+        has_pressure_chart = summary['pressure']['diastolic_count'] >= 2
+        
+        glycemic = load_analytics(conn) if summary['count'] else None
+        
+        conn.close()
+        
         return render_template('print_report.html',
                              measurements=measurements_for_table,
                              stats=stats,
                              start_date=start_date,
                              end_date=end_date,
-                             glucose_chart_base64=glucose_chart_base64,
-                             pressure_chart_base64=pressure_chart_base64)
+                             has_glucose_chart=has_glucose_chart,
+                             has_pressure_chart=has_pressure_chart,
+                             analytics=glycemic)
         
     except Exception as e:
         error_msg = str(e)[:200]
@@ -675,6 +1937,90 @@ def print_report():
         </div>
         '''
 
+# ============ PDF-ОТЧЁТ ============
+def build_report_data(conn, where_sql='', params=()):
+    """Данные PDF-отчёта за период - простые списки и словари, чтобы их
+    можно было передать в процесс рендера"""
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT value, systolic, diastolic, created_ms
+        FROM measurements{where_sql}
+        ORDER BY measurements.created_ms DESC, measurements.id DESC
+        LIMIT 30
+    ''', list(params))
+    table = [
+        [format_ms(row['created_ms'], '%Y-%m-%d'), format_ms(row['created_ms'], '%H:%M'),
+         float(row['value']), format_pressure(row['systolic'], row['diastolic']) or '-']
+        for row in c.fetchall()
+    ]
+    
+    glycemic = load_analytics(conn, where_sql, params)
+    series = load_series(conn, where_sql, params, REPORT_CHART_POINTS)
+    
+    if glycemic['count']:
+        period = (f"{format_ms(glycemic['first_ms'], '%Y-%m-%d')} - "
+                  f"{format_ms(glycemic['last_ms'], '%Y-%m-%d')}")
+    else:
+        period = datetime.now(APP_TZ).strftime('%Y-%m-%d')
+    
+    pressure = [(created_ms, systolic, diastolic)
+                for created_ms, systolic, diastolic in series['pressure'] if diastolic]
+    return {
+        'period': period,
+        'stats': {
+            'total': glycemic['count'],
+            'avg': glycemic['mean'],
+            'min': glycemic['min'],
+            'max': glycemic['max'],
+        },
+        'table': table,
+        'glucose': ([_chart_label(created_ms) for created_ms, _ in series['glucose']],
+                    [value for _, value in series['glucose']]),
+        'pressure': ([_chart_label(created_ms) for created_ms, _, _ in pressure],
+                     [systolic for _, systolic, _ in pressure],
+                     [diastolic for _, _, diastolic in pressure]),
+        'analytics': glycemic,
+    }
+
+@app.route('/print_report.pdf')
+def print_report_pdf():
+    """PDF-отчёт: ?from=&to= (по умолчанию - все измерения). Готовый файл
+    кэшируется по версии данных и периоду - повторные скачивания не рендерят"""
+    try:
+        try:
+            where_sql, params = _range_filters(request.args)
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'Неверные параметры: {e}'}), 400
+        
+        conn = get_db_connection()
+        try:
+            data_version = get_data_version(conn)
+            cache_key = ('report_pdf', data_version, request.args.get('from', ''), request.args.get('to', ''))
+            pdf = chart_cache.get(cache_key)
+            report = None if pdf else build_report_data(conn, where_sql, params)
+        finally:
+            conn.close()
+        
+        # Рендер - уже без подключения к базе
+        if pdf is None:
+            pdf = chart_renderer.render(charts.render_report_pdf, report)
+            chart_cache.put(cache_key, pdf)
+        
+        response = send_file(
+            io.BytesIO(pdf),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f"glucose_report_{datetime.now(APP_TZ).strftime('%Y%m%d')}.pdf",
+            etag=hashlib.md5(pdf).hexdigest(),
+            conditional=True
+        )
+        return response
+        
+    except charts.RenderError as e:
+        return jsonify({'error': f'Отчёт не построен: {e}'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Тестовые данные
 @app.route('/admin/setup_test_data')
 def setup_test_data():
@@ -684,7 +2030,7 @@ def setup_test_data():
         c = conn.cursor()
         
         # Очищаем старые данные
-        c.execute("DELETE FROM measurements")
+        clear_measurements(c)
         
         # Тестовые данные
         test_data = [
@@ -694,30 +2040,22 @@ def setup_test_data():
         ]
         
         c.executemany(
-            "INSERT INTO measurements (value, note, created_at) VALUES (?, ?, ?)", 
-            test_data
+            INSERT_MEASUREMENT_SQL,
+            [measurement_params(*item) for item in test_data]
         )
+        finish_bulk_load(c)
         
         conn.commit()
         conn.close()
+        chart_cache.invalidate()
         
         # Отправляем уведомление
-        try:
-            message = "✅ *Тестовые данные добавлены!*\n\n"
-            message += "📅 29.11.2024: 6.4 mmol/L\n"
-            message += "📅 30.11.2024: 6.9 mmol/L\n"
-            message += "📅 01.12.2024: 6.8 mmol/L\n\n"
-            message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
-            
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-            payload = {
-                'chat_id': CHAT_ID,
-                'text': message,
-                'parse_mode': 'Markdown'
-            }
-            requests.post(url, json=payload, timeout=5)
-        except:
-            pass
+        message = "✅ *Тестовые данные добавлены!*\n\n"
+        message += "📅 29.11.2024: 6.4 mmol/L\n"
+        message += "📅 30.11.2024: 6.9 mmol/L\n"
+        message += "📅 01.12.2024: 6.8 mmol/L\n\n"
+        message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        telegram_notifier.notify(message)
         
         return '''
         <!DOCTYPE html>
@@ -759,129 +2097,199 @@ def setup_test_data():
         '''
 
 # Telegram функции
-@app.route('/admin/backup_to_telegram')
-def backup_to_telegram():
-    """Отправить бэкап данных в Telegram"""
+# ============ ИНКРЕМЕНТАЛЬНЫЕ БЭКАПЫ ============
+# Полный снимок - раз в BACKUP_FULL_EVERY_DAYS дней, между ними - дельты
+# с записями, добавленными после прошлого бэкапа (см. backups.py)
+BACKUP_FULL_EVERY_DAYS = float(os.environ.get('BACKUP_FULL_EVERY_DAYS', 7))
+
+def plan_backup(conn, force_full=False):
+    """Что отправлять: полный снимок или дельту с прошлого бэкапа.
+    Читается одним снимком базы, чтобы id и количество были согласованы."""
+    c = conn.cursor()
+    c.execute('BEGIN')
+    try:
+        last_id = int(_get_meta(c, 'backup_last_id', 0))
+        sent_count = int(_get_meta(c, 'backup_count', -1))
+        snapshot = _get_meta(c, 'backup_snapshot')
+        full_ms = int(_get_meta(c, 'backup_full_ms', 0))
+        seq = int(_get_meta(c, 'backup_delta_seq', 0))
+        
+        c.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM measurements')
+        total, max_id = c.fetchone()
+        c.execute('SELECT COUNT(*) FROM measurements WHERE id > ?', (last_id,))
+        new_count = c.fetchone()[0]
+    finally:
+        conn.rollback()
+    
+    # Записи удалялись или база подменена - дельтой это не передать
+    changed = total != sent_count + new_count or max_id < last_id
+    due = now_ms() - full_ms >= BACKUP_FULL_EVERY_DAYS * 86400000
+    
+    if force_full or snapshot is None or changed or due:
+        return {
+            'mode': backups.FULL,
+            'snapshot': backups.new_snapshot_id(datetime.now(timezone.utc)),
+            'seq': 0,
+            'since_id': 0,
+            'until_id': max_id,
+            'rows': total,
+            'total': total,
+        }
+    # Пустая дельта файла не создаёт - и номер не занимает, иначе в цепочке
+    # появится пропуск и восстановление на нём остановится
+    return {
+        'mode': backups.DELTA,
+        'snapshot': snapshot,
+        'base_seq': seq,
+        'seq': seq + 1 if new_count else seq,
+        'since_id': last_id,
+        'until_id': max_id,
+        'rows': new_count,
+        'total': total,
+    }
+
+def send_backup_files(plan):
+    """Выгрузить записи плана в gzip-файл и отправить в Telegram;
+    после успешной отправки запомнить, докуда дошёл бэкап"""
+    if plan['mode'] == backups.FULL:
+        file_name = backups.full_name(plan['snapshot'])
+    else:
+        file_name = backups.delta_name(plan['snapshot'], plan['seq'])
+    
+    if plan['rows'] > 0:
+        # Полный снимок заодно сопровождается файлом базы для ручной загрузки
+        if plan['mode'] == backups.FULL:
+            _, db_file = snapshot_service.open()
+            with db_file:
+                telegram.send_document(CHAT_ID, db_file, filename=f"glucose_{plan['snapshot']}.db.gz")
+        
+        fd, temp_path = tempfile.mkstemp(suffix='.json.gz')
+        os.close(fd)
+        try:
+            rows = iter_measurement_rows(' WHERE measurements.id > ? AND measurements.id <= ?',
+                                         (plan['since_id'], plan['until_id']))
+            backups.write_gzip(temp_path, iter_json_array(rows))
+            with open(temp_path, 'rb') as f:
+                telegram.send_document(CHAT_ID, f, filename=file_name)
+        finally:
+            os.unlink(temp_path)
+    
+    conn = get_db_connection(readonly=False)
+    try:
+        c = conn.cursor()
+        # Проверка и запись одной транзакцией записи: дельта продолжает
+        # цепочку, только если её не продвинул кто-то другой
+        c.execute('BEGIN IMMEDIATE')
+        if plan['mode'] == backups.DELTA and (
+                _get_meta(c, 'backup_snapshot') != plan['snapshot']
+                or int(_get_meta(c, 'backup_delta_seq', 0)) != plan['base_seq']):
+            conn.rollback()
+            raise RuntimeError(f'Цепочка бэкапов уже изменилась, {file_name} не учтён')
+        _set_meta(c, 'backup_last_id', plan['until_id'])
+        _set_meta(c, 'backup_count', plan['total'])
+        _set_meta(c, 'backup_snapshot', plan['snapshot'])
+        _set_meta(c, 'backup_delta_seq', plan['seq'])
+        if plan['mode'] == backups.FULL:
+            _set_meta(c, 'backup_full_ms', now_ms())
+        conn.commit()
+    finally:
+        conn.close()
+    return file_name
+
+# Бэкапы идут строго по одному: маршрут и планировщик (под gunicorn - в
+# разных воркерах) иначе читают одни и те же backup_last_id/backup_delta_seq
+# и отправляют одинаковые дельты. Замок - между потоками процесса, flock -
+# между процессами
+BACKUP_LOCK_PATH = DB_PATH + '.backup.lock'
+_backup_lock = threading.Lock()
+
+def run_telegram_backup(force_full=False):
+    """Сводка, снимок или дельта в Telegram. Вызывается маршрутом и планировщиком;
+    ошибки Telegram пробрасываются как notifier.TelegramError.
+    Параллельный вызов ждёт окончания текущего бэкапа."""
+    with _backup_lock, open(BACKUP_LOCK_PATH, 'a') as lock_file:
+        # Блокировка снимается закрытием файла
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return _run_telegram_backup(force_full)
+
+def _run_telegram_backup(force_full):
+    # === ПОДГОТОВКА ДАННЫХ ===
+    conn = get_db_connection()
     try:
-        # === ПОДГОТОВКА ДАННЫХ ===
-        conn = get_db_connection()
         c = conn.cursor()
         
+        plan = plan_backup(conn, force_full=force_full)
+        
         # Получаем статистику
-        c.execute("SELECT COUNT(*) as count FROM measurements")
-        count = c.fetchone()['count']
-        
-        c.execute("""
-            SELECT MIN(datetime(created_at)) as first_date,
-                   MAX(datetime(created_at)) as last_date,
-                   ROUND(AVG(value), 1) as avg_value,
-                   MIN(value) as min_value,
-                   MAX(value) as max_value
-            FROM measurements
-        """)
-        stats = c.fetchone()
+        stats = get_stats(conn)
+        count = stats['count']
         
         # Получаем последние 5 записей
         c.execute('''
-            SELECT value, note, datetime(created_at) as created_at 
+            SELECT value, note, created_ms
             FROM measurements 
-            ORDER BY created_at DESC
+            ORDER BY created_ms DESC
             LIMIT 5
         ''')
         recent_data = c.fetchall()
-        
+    finally:
         conn.close()
-        
-        # === 1. ОТПРАВКА СТАТИСТИКИ ===
-        message = f"""
+    
+    # === 1. ОТПРАВКА СТАТИСТИКИ ===
+    message = f"""
 📊 *Бэкап данных глюкозы*
 
-📅 *Период:* {stats['first_date'][:10] if stats['first_date'] else 'Нет данных'} — {stats['last_date'][:10] if stats['last_date'] else 'Нет данных'}
+📅 *Период:* {stats['first_at'][:10] if stats['first_at'] else 'Нет данных'} — {stats['last_at'][:10] if stats['last_at'] else 'Нет данных'}
 📈 *Всего записей:* {count}
 
 📉 *Статистика:*
-• Среднее: {stats['avg_value'] or 0} mmol/L
-• Минимум: {stats['min_value'] or 0} mmol/L
-• Максимум: {stats['max_value'] or 0} mmol/L
+• Среднее: {stats['glucose']['avg'] or 0} mmol/L
+• Минимум: {stats['glucose']['min'] or 0} mmol/L
+• Максимум: {stats['glucose']['max'] or 0} mmol/L
+
+💾 *Бэкап:* {'полный снимок' if plan['mode'] == backups.FULL else f"изменения №{plan['seq']}"}, записей в файле: {plan['rows']}
 
 📋 *Последние записи:*
 """
+    
+    for row in recent_data:
+        created_at = format_ms(row['created_ms']) or ''
+        date_str = created_at[:10]
+        time_str = created_at[11:16]
+        note = f" ({row['note']})" if row['note'] else ""
+        message += f"• {date_str} {time_str}: {row['value']} mmol/L{note}\n"
+    
+    message += f"\n🔄 *Автоматический бэкап*\n⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+    
+    # Отправляем сообщение
+    telegram.send_message(CHAT_ID, message, disable_web_page_preview=True)
+    
+    # === 2. ОТПРАВКА СНИМКА ИЛИ ДЕЛЬТЫ ===
+    send_backup_files(plan)
+    return plan
+
+@app.route('/admin/backup_to_telegram')
+def backup_to_telegram():
+    """Отправить бэкап данных в Telegram (?full=1 - принудительно полный снимок)"""
+    try:
+        try:
+            run_telegram_backup(force_full=request.args.get('full') == '1')
+        except notifier.TelegramError as e:
+            return f"❌ Ошибка отправки в Telegram: {e}<br><a href='/'>На главную</a>"
         
-        for row in recent_data:
-            created_at = row['created_at']
-            date_str = created_at[:10]
-            time_str = created_at[11:16]
-            note = f" ({row['note']})" if row['note'] else ""
-            message += f"• {date_str} {time_str}: {row['value']} mmol/L{note}\n"
-        
-        message += f"\n🔄 *Автоматический бэкап*\n⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
-        
-        # Отправляем сообщение
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {
-            'chat_id': CHAT_ID,
-            'text': message,
-            'parse_mode': 'Markdown',
-            'disable_web_page_preview': True
-        }
-        
-        response = requests.post(url, json=payload)
-        
-        if response.status_code != 200:
-            return f"❌ Ошибка отправки сообщения: {response.text}<br><a href='/'>На главную</a>"
-        
-        # === 2. ОТПРАВКА ФАЙЛА БАЗЫ ===
-        if count > 0 and os.path.exists(DB_PATH):
-            # Отправляем .db файл
-            with open(DB_PATH, 'rb') as db_file:
-                files = {'document': db_file}
-                data = {'chat_id': CHAT_ID}
-                url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument"
-                
-                response = requests.post(url, files=files, data=data, timeout=30)
-                
-                if response.status_code != 200:
-                    return f"❌ Ошибка отправки файла: {response.text}<br><a href='/'>На главную</a>"
+        next_run = task_scheduler.jobs['telegram_backup'].run_at
+        next_run_text = next_run.strftime('%d.%m %H:%M') if next_run else BACKUP_SCHEDULE
         
-        # === 3. ОТПРАВКА JSON ДАННЫХ ===
-        if count > 0:
-            # Экспортируем все данные в JSON
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute('SELECT * FROM measurements')
-            data = []
-            for row in c.fetchall():
-                data.append(dict(row))
-            conn.close()
-            
-            # Сохраняем временный JSON файл
-            import tempfile
-            temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False)
-            json.dump(data, temp_file, ensure_ascii=False, indent=2, default=str)
-            temp_file.close()
-            
-            # Отправляем JSON файл
-            with open(temp_file.name, 'rb') as f:
-                files = {'document': f}
-                data = {'chat_id': CHAT_ID}
-                url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendDocument"
-                response = requests.post(url, files=files, data=data, timeout=30)
-            
-            # Удаляем временный файл
-            os.unlink(temp_file.name)
-            
-            if response.status_code != 200:
-                return f"❌ Ошибка отправки JSON: {response.text}<br><a href='/'>На главную</a>"
-        
-        return '''
+        return f'''
         <!DOCTYPE html>
         <html>
         <head>
             <title>✅ Бэкап отправлен</title>
             <style>
-                body { font-family: Arial, sans-serif; padding: 40px; text-align: center; }
-                .success { color: #27ae60; font-size: 24px; margin: 20px 0; }
-                .button { 
+                body {{ font-family: Arial, sans-serif; padding: 40px; text-align: center; }}
+                .success {{ color: #27ae60; font-size: 24px; margin: 20px 0; }}
+                .button {{ 
                     display: inline-block; 
                     background: #3498db; 
                     color: white; 
@@ -890,8 +2298,8 @@ def backup_to_telegram():
                     border-radius: 8px; 
                     margin: 10px; 
                     font-size: 16px;
-                }
-                .telegram { background: #0088cc; }
+                }}
+                .telegram {{ background: #0088cc; }}
             </style>
         </head>
         <body>
@@ -900,12 +2308,13 @@ def backup_to_telegram():
             
             <div style="margin-top: 30px;">
                 <a href="/admin/backup_to_telegram" class="button telegram">🔄 Отправить ещё раз</a>
+                <a href="/admin/backup_to_telegram?full=1" class="button telegram">💾 Полный снимок</a>
                 <a href="/admin/backup" class="button">📥 Скачать вручную</a>
                 <a href="/" class="button">🏠 На главную</a>
             </div>
             
             <p style="margin-top: 30px; color: #7f8c8d;">
-                ⏰ Следующий автоматический бэкап будет в 21:00
+                ⏰ Следующий автоматический бэкап: {next_run_text}
             </p>
         </body>
         </html>
@@ -934,26 +2343,23 @@ def test_telegram():
         message += "📊 Все функции доступны\n"
         message += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}"
         
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {
-            'chat_id': CHAT_ID,
-            'text': message,
-            'parse_mode': 'Markdown'
-        }
-        
-        response = requests.post(url, json=payload)
+        try:
+            telegram.send_message(CHAT_ID, message)
+            error = None
+        except notifier.TelegramError as e:
+            error = str(e)
         
-        if response.status_code == 200:
+        if error is None:
             return '''
             <h1 style="color: #27ae60;">✅ Тест успешен!</h1>
             <p>Сообщение отправлено в Telegram.</p>
             <p>Проверь свой Telegram аккаунт.</p>
-            <p><a href="/admin/backup_to_telegram">📊 Отправить полный бэкап</a></p>
+            <p><a href="/admin/backup_to_telegram?full=1">📊 Отправить полный бэкап</a></p>
             '''
         else:
             return f'''
             <h1 style="color: #e74c3c;">❌ Ошибка</h1>
-            <pre>{response.text}</pre>
+            <pre>{error}</pre>
             <p>Проверь настройки бота.</p>
             '''
             
@@ -968,32 +2374,21 @@ def test_telegram():
 def db_status():
     """Проверка статуса базы данных"""
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
         # Проверяем таблицу
-        c.execute("""
-            SELECT 
-                (SELECT COUNT(*) FROM measurements) as total_records,
-                (SELECT MAX(created_at) FROM measurements) as last_record,
-                (SELECT MIN(created_at) FROM measurements) as first_record
-        """)
-        result = c.fetchone()
+        stats = get_stats()
         
         status = {
             "database_type": "SQLite",
             "connected": True,
             "db_file": DB_PATH,
             "file_size": os.path.getsize(DB_PATH) if os.path.exists(DB_PATH) else 0,
-            "total_records": result['total_records'],
-            "last_record": result['last_record'] if result['last_record'] else "Нет данных",
-            "first_record": result['first_record'] if result['first_record'] else "Нет данных",
+            "total_records": stats['count'],
+            "last_record": stats['last_at'] if stats['last_at'] else "Нет данных",
+            "first_record": stats['first_at'] if stats['first_at'] else "Нет данных",
             "telegram_bot": "настроен",
             "auto_restore": "включено"
         }
         
-        conn.close()
-        
         return jsonify(status)
         
     except Exception as e:
@@ -1003,28 +2398,38 @@ def db_status():
             "error": str(e)
         })
 
+# Снимки базы для скачивания и бэкапа: backup API по страницам, без
+# блокировки писателей; последний снимок переиспользуется до изменения данных
+snapshot_service = snapshots.SnapshotService(
+    DB_PATH, get_data_version,
+    pages=int(os.environ.get('SNAPSHOT_PAGES', 256)))
+
 @app.route('/admin/backup')
 def backup_database():
-    """Скачать резервную копию базы"""
+    """Скачать резервную копию базы (согласованный снимок, gzip)"""
     if not os.path.exists(DB_PATH):
         return "База данных не найдена", 404
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return send_file(
-        DB_PATH,
+    try:
+        snapshot, snapshot_file = snapshot_service.open()
+    except sqlite3.Error as e:
+        return jsonify({'error': str(e)}), 500
+    
+    timestamp = format_ms(snapshot.created_ms, "%Y%m%d_%H%M%S")
+    response = send_file(
+        snapshot_file,
+        mimetype='application/gzip',
         as_attachment=True,
-        download_name=f'glucose_backup_{timestamp}.db'
+        download_name=f'glucose_backup_{timestamp}.db.gz'
     )
+    response.headers['Content-Length'] = str(snapshot.size)
+    return response
 
 @app.route('/admin/simple_backup')
 def simple_backup():
     """Простой интерфейс для бэкапов"""
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) as count FROM measurements")
-        count = c.fetchone()['count']
-        conn.close()
+        count = get_stats()['count']
         
         return f'''
         <!DOCTYPE html>
@@ -1065,7 +2470,7 @@ def simple_backup():
             </div>
             
             <div style="margin: 20px 0;">
-                <a href="/api/measurements" style="
+                <a href="/api/measurements.ndjson" style="
                     display: inline-block;
                     background: #2ecc71;
                     color: white;
@@ -1077,6 +2482,18 @@ def simple_backup():
                 ">
                     📄 Скачать JSON
                 </a>
+                <a href="/api/measurements.csv" style="
+                    display: inline-block;
+                    background: #27ae60;
+                    color: white;
+                    padding: 15px 30px;
+                    text-decoration: none;
+                    border-radius: 5px;
+                    font-size: 18px;
+                    margin: 10px;
+                ">
+                    📊 Скачать CSV
+                </a>
             </div>
             
             <h3>📋 Рекомендация:</h3>
@@ -1095,45 +2512,269 @@ def simple_backup():
         return f"❌ Ошибка: {str(e)}"
 
 # Автоматический бэкап
-def auto_backup_daily():
-    """Ежедневный автоматический бэкап в 21:00"""
-    while True:
-        try:
-            now = datetime.now()
-            
-            # Проверяем время каждый час
-            if now.hour == 21 and now.minute == 59:
-                print(f"⏰ {now.strftime('%H:%M')} - Отправляю ежедневный бэкап...")
-                
-                try:
-                    # Отправляем бэкап
-                    requests.get("https://glikosa.onrender.com/admin/backup_to_telegram", timeout=30)
-                    print("✅ Ежедневный бэкап отправлен")
-                except Exception as e:
-                    print(f"⚠️ Ошибка авто-бэкапа: {e}")
-                
-                # Ждем 61 минуту чтобы не отправить дважды
-                time.sleep(3660)
-            else:
-                # Проверяем каждую минуту
-                time.sleep(60)
-                
-        except Exception as e:
-            print(f"⚠️ Ошибка в авто-бэкапе: {e}")
-            time.sleep(300)
+# ============ ПЛАНИРОВЩИК ============
+# Периодические задачи выполняются внутри приложения (и под gunicorn тоже),
+# только в одном процессе - см. scheduler.py
+BACKUP_SCHEDULE = os.environ.get('BACKUP_SCHEDULE', '59 21 * * *')
+BACKUP_JITTER_SECONDS = float(os.environ.get('BACKUP_JITTER_SECONDS', 60))
+SCHEDULER_LOCK_PATH = DB_PATH + '.scheduler.lock'
+
+def _load_job_run(name):
+    conn = get_db_connection(readonly=True)
+    try:
+        value = _get_meta(conn.cursor(), f'job_last_run:{name}')
+    finally:
+        conn.close()
+    return from_epoch_ms(int(value)) if value else None
+
+def _save_job_run(name, when):
+    conn = get_db_connection(readonly=False)
+    try:
+        _set_meta(conn.cursor(), f'job_last_run:{name}', round(when.timestamp() * 1000))
+        conn.commit()
+    finally:
+        conn.close()
+
+task_scheduler = scheduler.Scheduler(
+    [scheduler.Job('telegram_backup', BACKUP_SCHEDULE, run_telegram_backup,
+                   jitter=BACKUP_JITTER_SECONDS)],
+    lock_path=SCHEDULER_LOCK_PATH, tz=APP_TZ,
+    load_last_run=_load_job_run, save_last_run=_save_job_run)
+
+@app.route('/admin/scheduler')
+def scheduler_status():
+    """Состояние задач планировщика в этом процессе"""
+    return jsonify(dict(task_scheduler.status(), pid=os.getpid()))
+
+# ============ МЕТРИКИ ============
+# Гистограммы задержек по маршрутам, SQL (через пулы db.py), рендера графиков
+# и вызовов Telegram - на /metrics в формате Prometheus (см. metrics.py).
+# METRICS_ENABLED=0 выключает и замеры, и /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# SQL в основном укладывается в миллисекунды - корзины мельче
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+metrics_registry = metrics.Registry()
+http_duration = metrics_registry.histogram(
+    'glikosa_http_request_duration_seconds', 'Время обработки запроса до готового ответа',
+    ('route', 'method'))
+http_requests = metrics_registry.counter(
+    'glikosa_http_requests_total', 'Запросы по маршрутам и кодам ответа',
+    ('route', 'method', 'status'))
+sql_duration = metrics_registry.histogram(
+    'glikosa_sql_query_duration_seconds', 'Выполнение SQL (execute) через пул подключений',
+    ('route', 'statement'), buckets=SQL_BUCKETS)
+sql_fetch_duration = metrics_registry.histogram(
+    'glikosa_sql_fetch_duration_seconds', 'Выборка строк (fetch*) через пул подключений',
+    ('route', 'statement'), buckets=SQL_BUCKETS)
+chart_duration = metrics_registry.histogram(
+    'glikosa_chart_render_duration_seconds', 'Рендер графиков и PDF вместе с ожиданием пула',
+    ('chart', 'status'))
+telegram_duration = metrics_registry.histogram(
+    'glikosa_telegram_request_duration_seconds', 'Вызовы Telegram Bot API',
+    ('method', 'status'))
+
+metrics_registry.gauge(
+    'glikosa_chart_cache_requests_total', 'Обращения к кэшу графиков',
+    lambda: {'hit': chart_cache.hits, 'miss': chart_cache.misses}, ('result',), type='counter')
+metrics_registry.gauge(
+    'glikosa_chart_cache_bytes', 'Объём кэша графиков', lambda: chart_cache._bytes)
+metrics_registry.gauge(
+    'glikosa_telegram_notifications_total', 'Уведомления из фоновой очереди',
+    lambda: {'sent': telegram_notifier.sent, 'failed': telegram_notifier.failed,
+             'dropped': telegram_notifier.dropped}, ('result',), type='counter')
+metrics_registry.gauge(
+    'glikosa_measurements', 'Записей в базе', lambda: get_stats()['count'])
+metrics_registry.gauge(
+    'glikosa_startup_seconds', 'Холодный старт приложения',
+    lambda: startup_state['startup_ms'] / 1000 if startup_state['startup_ms'] else None)
+metrics_registry.gauge(
+    'glikosa_process_info', 'Процесс, ответивший на запрос', lambda: {str(os.getpid()): 1}, ('pid',))
+
+def _metrics_route():
+    """Маршрут текущего запроса - шаблон правила, а не путь (иначе меток без счёта)"""
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _observe_query(statement, seconds, fetch):
+    (sql_fetch_duration if fetch else sql_duration).observe(seconds, _metrics_route(), statement)
+
+def _observe_render(name, seconds, status):
+    chart_duration.observe(seconds, name, status)
+
+def _observe_telegram(method, seconds, status):
+    telegram_duration.observe(seconds, method, status)
+
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+def _record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = _metrics_route()
+        http_duration.observe(time.perf_counter() - started, route, request.method)
+        http_requests.inc(route, request.method, str(response.status_code))
+    return response
+
+if METRICS_ENABLED:
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request_metrics)
+    database.set_observer(_observe_query)
+    chart_renderer.observer = _observe_render
+    telegram.observer = _observe_telegram
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики этого процесса в текстовом формате Prometheus"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Метрики выключены (METRICS_ENABLED=0)'}), 404
+    return Response(metrics_registry.render(), content_type=metrics.CONTENT_TYPE)
+
+# ============ ПРОФИЛИРОВАНИЕ ============
+# Включается переменной PROFILE_TOKEN: запрос с заголовком X-Profile: <токен>
+# (или cookie glikosa_profile) выполняется под cProfile, профиль сохраняется в
+# PROFILE_DIR (последние PROFILE_KEEP). Без PROFILE_TOKEN обёртки нет вовсе.
+# Токен в адресе не принимается - cookie ставит форма на /admin/profiles
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'glikosa-profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 20))
+
+profiler = None
+if PROFILE_TOKEN:
+    profiler = profiling.Profiler(PROFILE_DIR, keep=PROFILE_KEEP)
+    app.wsgi_app = profiling.ProfilingMiddleware(app.wsgi_app, profiler, PROFILE_TOKEN,
+                                                 exclude=('/admin/profiles',))
+
+def _profile_access_error():
+    """None, если профили доступны этому запросу, иначе ответ с ошибкой"""
+    if profiler is None:
+        return jsonify({'error': 'Профилирование выключено (нет PROFILE_TOKEN)'}), 404
+    if not profiling.token_matches(profiling.request_token(request.environ), PROFILE_TOKEN):
+        return jsonify({'error': 'Нужен токен профилирования'}), 403
+    return None
+
+PROFILE_LOGIN_PAGE = '''
+    <!DOCTYPE html>
+    <html>
+    <head><title>🔬 Профили запросов</title></head>
+    <body style="font-family: Arial, sans-serif; padding: 20px;">
+        <h1>🔬 Профили запросов</h1>
+        <form method="post" action="/admin/profiles">
+            <input type="password" name="token" placeholder="PROFILE_TOKEN" autofocus>
+            <button type="submit">Войти</button>
+        </form>
+    </body>
+    </html>
+    '''
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+def profiles_list():
+    """Последние профили запросов с разбивкой времени.
+    POST с полем token ставит cookie (пока она есть, профилируется каждый
+    запрос этого браузера), POST с action=logout - убирает."""
+    if profiler is not None and request.method == 'POST':
+        response = redirect('/admin/profiles')
+        if request.form.get('action') == 'logout':
+            response.delete_cookie(profiling.COOKIE, path='/')
+            return response
+        if not profiling.token_matches(request.form.get('token'), PROFILE_TOKEN):
+            return PROFILE_LOGIN_PAGE, 403
+        response.set_cookie(profiling.COOKIE, PROFILE_TOKEN, path='/', httponly=True,
+                            samesite='Strict', secure=request.is_secure)
+        return response
+    
+    error = _profile_access_error()
+    if error:
+        if error[1] == 403 and request.args.get('format') != 'json':
+            return PROFILE_LOGIN_PAGE, 403
+        return error
+    
+    profiles = profiler.recent()
+    if request.args.get('format') == 'json':
+        return jsonify({'directory': PROFILE_DIR, 'keep': PROFILE_KEEP, 'profiles': profiles})
+    
+    rows = ''
+    for item in profiles:
+        parts = ', '.join(f"{key} {value:.0f}" for key, value in item['breakdown_ms'].items() if value >= 1)
+        link = html.escape(f"/admin/profiles/{item['name']}")
+        query = f"?{item['query']}" if item.get('query') else ''
+        rows += f"""
+            <tr>
+                <td>{item['created'].replace('T', ' ')}</td>
+                <td>{item['method']} {html.escape(item['path'] + query)}</td>
+                <td>{item['status']}</td>
+                <td><strong>{item['duration_ms']:.0f} мс</strong></td>
+                <td>{parts}</td>
+                <td><a href="{link}">📋 топ</a> · <a href="{link}?download=1">💾 .prof</a></td>
+            </tr>"""
+    
+    return f'''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>🔬 Профили запросов</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; padding: 20px; }}
+            table {{ border-collapse: collapse; width: 100%; }}
+            th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; font-size: 14px; }}
+            th {{ background: #f8f9fa; }}
+        </style>
+    </head>
+    <body>
+        <h1>🔬 Профили запросов</h1>
+        <p>Последние {PROFILE_KEEP} профилей, папка {PROFILE_DIR}. Время по частям - собственное
+        время функций в мс: sql, charts (matplotlib/NumPy), wait (замки и пул рендера), app, flask.</p>
+        <table>
+            <tr><th>Когда</th><th>Запрос</th><th>Код</th><th>Время</th><th>По частям</th><th></th></tr>
+            {rows or '<tr><td colspan="6">Профилей пока нет</td></tr>'}
+        </table>
+        <form method="post" action="/admin/profiles" style="margin-top: 20px;">
+            <button type="submit" name="action" value="logout">🚪 Выйти (убрать cookie)</button>
+        </form>
+    </body>
+    </html>
+    '''
+
+@app.route('/admin/profiles/<name>')
+def profile_detail(name):
+    """Топ функций профиля (?sort=tottime) или сам файл .prof (?download=1)"""
+    error = _profile_access_error()
+    if error:
+        return error
+    
+    path = profiler.path(name)
+    if path is None:
+        return jsonify({'error': 'Профиль не найден'}), 404
+    if request.args.get('download') == '1':
+        return send_file(path, mimetype='application/octet-stream',
+                         as_attachment=True, download_name=name + '.prof')
+    
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'ncalls'):
+        return jsonify({'error': f'Неверная сортировка: {sort}'}), 400
+    return Response(profiler.report(name, sort=sort), content_type='text/plain; charset=utf-8')
+
+# Время холодного старта: от первой строки модуля до готовых маршрутов
+startup_state['startup_ms'] = round((time.perf_counter() - _import_started) * 1000, 1)
+if __name__ != '__mp_main__':
+    print(f"⏱ Приложение загружено за {startup_state['startup_ms']} мс")
+    # Фоновые задачи - только после загрузки модуля целиком: им нужны
+    # chart_cache и остальные глобальные объекты
+    threading.Thread(target=deferred_restore, name='deferred-restore', daemon=True).start()
+    start_migrations()
+    if os.environ.get('SCHEDULER_ENABLED', '1') != '0':
+        task_scheduler.start()
 
 # Запуск приложения
 if __name__ == '__main__':
-    # Запускаем авто-бэкап
-    backup_thread = threading.Thread(target=auto_backup_daily, daemon=True)
-    backup_thread.start()
-    
     print("=" * 60)
     print("🚀 GLIKOSA Tracker запущен!")
     print(f"📊 База данных: SQLite ({DB_PATH})")
     print(f"🤖 Telegram бот: настроен")
     print(f"🔄 Автовосстановление: включено")
-    print(f"⏰ Авто-бэкап: 21:00 ежедневно")
+    print(f"⏰ Авто-бэкап: {BACKUP_SCHEDULE} (cron, {APP_TZ.key})")
     print("=" * 60)
     
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,85 @@
+"""Формат инкрементальных бэкапов.
+
+Бэкап - цепочка файлов: полный снимок и дельты после него. Снимок
+отправляется раз в несколько дней (или после удаления записей), дельта -
+только записи, добавленные после предыдущего бэкапа. Все файлы - JSON-массив
+записей в gzip.
+
+Имена файлов задают порядок восстановления:
+    glucose_20241201-210000000_full.json.gz    - снимок 20241201-210000000
+    glucose_20241201-210000000_d0003.json.gz   - его третья дельта
+"""
+import gzip
+import re
+import zlib
+
+FULL = 'full'
+DELTA = 'delta'
+
+_NAME_RE = re.compile(r'^glucose_(\d{8}-\d{9})_(full|d(\d+))\.json\.gz$')
+
+
+def new_snapshot_id(now):
+    """Метка снимка из времени UTC, с миллисекундами: ГГГГММДД-ЧЧММССммм"""
+    return now.strftime('%Y%m%d-%H%M%S') + f'{now.microsecond // 1000:03d}'
+
+
+def full_name(snapshot):
+    return f'glucose_{snapshot}_full.json.gz'
+
+
+def delta_name(snapshot, seq):
+    return f'glucose_{snapshot}_d{seq:04d}.json.gz'
+
+
+def parse_name(file_name):
+    """Имя файла -> (снимок, FULL|DELTA, номер дельты) или None"""
+    match = _NAME_RE.match(file_name or '')
+    if not match:
+        return None
+    if match.group(2) == FULL:
+        return match.group(1), FULL, 0
+    return match.group(1), DELTA, int(match.group(3))
+
+
+def pick_chain(documents):
+    """Из документов [(file_name, file_id), ...] выбрать последний снимок и
+    его дельты по порядку -> [(file_name, file_id), ...] или []"""
+    parsed = [(parse_name(name), name, file_id) for name, file_id in documents]
+    fulls = sorted((info[0], name, file_id) for info, name, file_id in parsed
+                   if info and info[1] == FULL)
+    if not fulls:
+        return []
+    snapshot, name, file_id = fulls[-1]
+
+    deltas = {}
+    for info, delta, delta_id in parsed:
+        if info and info[0] == snapshot and info[1] == DELTA:
+            deltas[info[2]] = (delta, delta_id)
+
+    chain = [(name, file_id)]
+    # Дельты применяются подряд: пропуск номера рвёт цепочку
+    seq = 1
+    while seq in deltas:
+        chain.append(deltas[seq])
+        seq += 1
+    return chain
+
+
+def write_gzip(path, chunks, compresslevel=6):
+    """Записать текстовые куски в gzip-файл, не собирая их в памяти"""
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=compresslevel) as out:
+        for chunk in chunks:
+            out.write(chunk)
+
+
+def iter_gunzip(chunks):
+    """Распаковать поток gzip-кусков (например, iter_content) по мере чтения"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,6 @@
+"""Бенчмарки GLIKOSA Tracker: синтетические истории измерений, заглушка
+Telegram и замер основных операций с результатом в JSON.
+
+    python -m benchmarks.run --sizes 1000,100000 --out bench.json
+    python -m benchmarks.compare old.json new.json
+"""
@@ -0,0 +1,57 @@
+"""Сравнение двух результатов benchmarks.run.
+
+    python -m benchmarks.compare old.json new.json [--threshold 1.2]
+
+Сравниваются медианы операций, общих для обоих файлов. Замедление больше
+threshold раз отмечается как регрессия, и код выхода становится 1 - так
+сравнение можно запускать в CI.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(old, new, threshold):
+    """[(размер, операция, старая медиана, новая медиана, отношение, регрессия)]"""
+    rows = []
+    for size, new_size in new['sizes'].items():
+        old_cases = old['sizes'].get(size, {}).get('cases', {})
+        for case, stats in new_size['cases'].items():
+            if case not in old_cases:
+                continue
+            before = old_cases[case]['median_ms']
+            after = stats['median_ms']
+            ratio = after / before if before else float('inf')
+            rows.append((size, case, before, after, ratio, ratio > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сравнение результатов бенчмарков')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='во сколько раз медленнее - уже регрессия')
+    args = parser.parse_args(argv)
+
+    old, new = load(args.old), load(args.new)
+    print(f"{old['environment'].get('revision')} -> {new['environment'].get('revision')}")
+    rows = compare(old, new, args.threshold)
+    for size, case, before, after, ratio, regressed in rows:
+        mark = '❌' if regressed else ('✅' if ratio < 1 / args.threshold else '  ')
+        print(f"{mark} {size:>8} {case:<20} {before:>10.2f} -> {after:>10.2f} мс  x{ratio:.2f}")
+
+    regressions = sum(1 for row in rows if row[5])
+    if regressions:
+        print(f"⚠️ Регрессий: {regressions}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
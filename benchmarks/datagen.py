@@ -0,0 +1,105 @@
+"""Генератор правдоподобной истории глюкозы и давления.
+
+Глюкоза идёт с шагом CGM-сенсора (5 минут): базовый уровень, утренний
+подъём, пики после завтрака, обеда и ужина и медленный случайный дрейф.
+Раз в несколько дней - замена сенсора и пара часов без данных. Давление
+пишется в примечание пару раз в день в тех форматах, что встречаются в
+реальных данных: "Давление: 130-85", "Давление: 130/85", "Давление: 160+",
+иногда после текста ("после еды. Давление: 135-88").
+
+Генерация детерминирована: одинаковые count и seed дают одинаковые строки,
+поэтому замеры разных версий идут на одних и тех же данных.
+"""
+import json
+import math
+import random
+
+import backups
+
+STEP_MS = 5 * 60 * 1000
+# Последняя запись истории - фиксированный момент, а не «сейчас»
+END_MS = 1733011200000  # 2024-12-01 00:00 UTC
+
+SENSOR_DAYS = 10
+SENSOR_GAP_STEPS = 24  # 2 часа без данных при замене сенсора
+
+# Приёмы пищи: час, высота пика (ммоль/л)
+MEALS = ((8, 3.0), (13, 3.5), (19, 3.2))
+
+PLAIN_NOTES = ('натощак', 'после еды', 'перед сном', 'после прогулки')
+
+
+def _meal_rise(hours_after):
+    """Форма пика после еды: подъём за ~45 минут и спад за 2-3 часа"""
+    if hours_after <= 0 or hours_after > 4:
+        return 0.0
+    return (hours_after / 0.75) * math.exp(1 - hours_after / 0.75)
+
+
+def _pressure_note(rnd):
+    systolic = int(rnd.gauss(132, 12))
+    diastolic = int(rnd.gauss(84, 8))
+    kind = rnd.random()
+    if kind < 0.6:
+        return f'Давление: {systolic}-{diastolic}'
+    if kind < 0.8:
+        return f'Давление: {systolic}/{diastolic}'
+    if kind < 0.9:
+        return f'Давление: {max(systolic, 160)}+'
+    return f'{rnd.choice(PLAIN_NOTES)}. Давление: {systolic}-{diastolic}'
+
+
+def generate(count, seed=0, end_ms=END_MS):
+    """count записей (value, note, created_ms) по возрастанию времени"""
+    rnd = random.Random(seed)
+    sensor_steps = SENSOR_DAYS * 288
+    # Пропуски при замене сенсора тоже занимают время
+    span = count + count // sensor_steps * SENSOR_GAP_STEPS
+    ms = end_ms - (span - 1) * STEP_MS
+
+    drift = 0.0
+    meal_sizes = {}
+    made = 0
+    step = 0
+    while made < count:
+        if step and step % sensor_steps == 0:
+            ms += SENSOR_GAP_STEPS * STEP_MS
+        step += 1
+
+        day, rest = divmod(ms // 1000, 86400)
+        hour = rest / 3600
+        if day not in meal_sizes:
+            meal_sizes = {day: [peak * rnd.uniform(0.5, 1.3) for _, peak in MEALS]}
+
+        value = 5.6 + 0.8 * math.exp(-((hour - 6) ** 2) / 4)
+        for (meal_hour, _), size in zip(MEALS, meal_sizes[day]):
+            value += size * _meal_rise(hour - meal_hour)
+        drift = 0.98 * drift + rnd.gauss(0, 0.12)
+        value = min(max(value + drift + rnd.gauss(0, 0.15), 2.2), 22.0)
+
+        note = ''
+        chance = rnd.random()
+        if chance < 2 / 288:
+            note = _pressure_note(rnd)
+        elif chance < 3 / 288:
+            note = rnd.choice(PLAIN_NOTES)
+
+        yield round(value, 1), note, ms
+        made += 1
+        ms += STEP_MS
+
+
+def iter_backup_json(rows):
+    """Строки generate() в формате JSON-бэкапа (см. app.iter_json_array)"""
+    yield '['
+    first = True
+    for value, note, created_ms in rows:
+        item = {'value': value, 'note': note, 'created_ms': created_ms}
+        yield ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+        first = False
+    yield ']'
+
+
+def write_backup_json(path, rows):
+    """JSON-бэкап .json.gz, который принимает /admin/upload_backup"""
+    backups.write_gzip(path, iter_backup_json(rows))
@@ -0,0 +1,205 @@
+"""Локальный HTTP-сервер, изображающий Telegram Bot API.
+
+Приложение, запущенное с TELEGRAM_API_URL=<адрес сервера>, проходит все
+свои пути с BOT_TOKEN без сети: уведомления (sendMessage), бэкапы
+(sendDocument), автовосстановление (getUpdates, getFile и скачивание
+файла). Отправленные документы сохраняются в памяти и появляются в
+getUpdates - так бэкап можно тут же восстановить.
+
+    python -m benchmarks.fake_telegram --port 8081 --latency 0.05
+
+latency - задержка ответа на каждый вызов (медленная сеть до Telegram).
+"""
+import argparse
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeTelegram/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _result(self, result):
+        self._reply(200, json.dumps({'ok': True, 'result': result}).encode('utf-8'))
+
+    def _error(self, status, description):
+        body = {'ok': False, 'error_code': status, 'description': description}
+        self._reply(status, json.dumps(body).encode('utf-8'))
+
+    def _route(self):
+        """/bot<token>/<method> -> ('method', имя) или /file/bot<token>/<путь> -> ('file', путь)"""
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if len(parts) >= 3 and parts[0] == 'file' and parts[1].startswith('bot'):
+            return 'file', '/'.join(parts[2:])
+        if len(parts) == 2 and parts[0].startswith('bot'):
+            return 'method', parts[1]
+        return None, None
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        self._handle(self._read_body())
+
+    def do_POST(self):
+        self._handle(self._read_body())
+
+    def _handle(self, body):
+        kind, name = self._route()
+        self.fake._record('file' if kind == 'file' else (name or self.path), len(body))
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+
+        if kind == 'file':
+            data = self.fake.files.get(name)
+            if data is None:
+                self._error(404, 'Not Found: file')
+            else:
+                self._reply(200, data, content_type='application/octet-stream')
+            return
+        if kind != 'method':
+            self._error(404, 'Not Found')
+            return
+
+        query = {key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        if name == 'getUpdates':
+            self._result(self.fake.updates())
+        elif name == 'getFile':
+            file_id = query.get('file_id')
+            if file_id not in self.fake.files:
+                self._error(400, 'Bad Request: invalid file_id')
+            else:
+                self._result({'file_id': file_id, 'file_path': file_id,
+                              'file_size': len(self.fake.files[file_id])})
+        elif name == 'sendMessage':
+            self._result({'message_id': self.fake._next_message_id()})
+        elif name == 'sendDocument':
+            file_name, data = self._document(body)
+            if data is None:
+                self._error(400, 'Bad Request: there is no document in the request')
+                return
+            self.fake._store(file_name, data)
+            self._result({'message_id': self.fake._next_message_id(),
+                          'document': {'file_name': file_name, 'file_id': file_name}})
+        else:
+            self._result(True)
+
+    def _document(self, body):
+        """Файл document из multipart/form-data -> (имя, байты)"""
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode('latin-1')
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        if not message.is_multipart():
+            return None, None
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'document':
+                return part.get_filename() or 'document', part.get_payload(decode=True)
+        return None, None
+
+
+class FakeTelegram:
+    """Сервер в фоновом потоке. calls - число вызовов по методам,
+    received_bytes - объём принятых тел запросов."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.files = {}
+        self.calls = {}
+        self.received_bytes = 0
+        self._documents = []
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, method, size):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.received_bytes += size
+
+    def _next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def _store(self, file_name, data):
+        with self._lock:
+            self.files[file_name] = data
+            self._documents.append(file_name)
+
+    def updates(self):
+        """getUpdates: по сообщению на каждый принятый документ"""
+        with self._lock:
+            return [{'update_id': index + 1,
+                     'message': {'message_id': index + 1,
+                                 'document': {'file_name': name, 'file_id': name}}}
+                    for index, name in enumerate(self._documents)]
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'received_bytes': self.received_bytes,
+                    'documents': len(self._documents)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Заглушка Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, с')
+    args = parser.parse_args(argv)
+
+    fake = FakeTelegram(args.host, args.port, args.latency)
+    print(f'🤖 Заглушка Telegram: TELEGRAM_API_URL={fake.url}')
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+        print(f'📊 {json.dumps(fake.stats(), ensure_ascii=False)}')
+
+
+if __name__ == '__main__':
+    main()
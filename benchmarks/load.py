@@ -0,0 +1,471 @@
+"""Нагрузочный тест: сколько одновременных читателей и писателей выдерживает
+развёрнутое приложение.
+
+    python -m benchmarks.load --duration 60 --workers 2 \\
+        --rates post=5,measurements=20,dashboard=2,report=1
+    python -m benchmarks.load --url http://127.0.0.1:5000 --duration 30
+
+Без --url приложение запускается отдельным процессом (gunicorn с --workers
+воркерами, при --workers 0 - встроенный сервер Flask) на временной базе,
+заполненной --rows записями истории, рядом поднимается заглушка Telegram
+(fake_telegram.py) - уведомления и бэкапы уходят в неё. С --url нагрузка
+идёт на уже запущенный сервер.
+
+Нагрузка открытая: запросы каждого маршрута приходят с заданной частотой
+(пуассоновский поток) независимо от того, успевает ли сервер. Задержка
+считается от момента, когда запрос должен был уйти, поэтому ожидание
+свободного соединения тоже в неё входит и перегрузка не прячется.
+
+Итог - по каждому маршруту: пропускная способность, p50/p95/p99 задержки
+и доля ошибок; JSON - в --out или stdout.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from benchmarks import datagen
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.run import environment
+
+# Маршрут нагрузки: метод и путь
+ROUTES = {
+    'post': ('POST', '/api/measurement'),
+    'measurements': ('GET', '/api/measurements?limit=100'),
+    'dashboard': ('GET', '/dashboard'),
+    'report': ('GET', '/print_report'),
+    'backup': ('GET', '/admin/backup_to_telegram'),
+}
+# Запросов в секунду по умолчанию; бэкап - только если задан явно
+DEFAULT_RATES = {'post': 2.0, 'measurements': 10.0, 'dashboard': 1.0, 'report': 0.5}
+
+SEED_BATCH = 5000
+START_TIMEOUT = 120
+
+
+class LoadError(Exception):
+    """Сервер не запустился или ответил не HTTP"""
+
+
+class ConnectionClosed(LoadError):
+    """Сервер закрыл соединение, не прислав ни байта ответа"""
+
+
+# ============ HTTP-КЛИЕНТ НА ASYNCIO ============
+class Connection:
+    """Одно соединение HTTP/1.1 с keep-alive (переоткрывается, если сервер закрыл)"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, content_type='application/json'):
+        """-> (статус, тело). Ошибка сети - исключение, соединение закрывается.
+        Простаивающее keep-alive соединение сервер вправе закрыть (gunicorn -
+        по keepalive-таймауту): если переиспользованное соединение оборвалось
+        до первого байта ответа, запрос повторяется один раз на новом.
+        Ошибкой считается только сбой на свежем соединении."""
+        head = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}',
+                'Connection: keep-alive', 'Accept-Encoding: identity']
+        if body is not None:
+            head += [f'Content-Type: {content_type}', f'Content-Length: {len(body)}']
+        data = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+        reused = self.writer is not None
+        try:
+            return await self._exchange(data)
+        except ConnectionClosed:
+            if not reused:
+                raise
+        return await self._exchange(data)
+
+    async def _exchange(self, data):
+        if self.writer is None:
+            await self._open()
+        try:
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+            except (ConnectionResetError, BrokenPipeError) as e:
+                raise ConnectionClosed(f'Сервер закрыл соединение: {e}')
+            return await self._read_response()
+        except BaseException:
+            self.close()
+            raise
+
+    async def _read_response(self):
+        try:
+            status_line = await self.reader.readline()
+        except ConnectionResetError as e:
+            raise ConnectionClosed(f'Сервер закрыл соединение: {e}')
+        if not status_line:
+            raise ConnectionClosed('Сервер закрыл соединение')
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+            self.close()
+        return int(status), body
+
+
+class ConnectionPool:
+    """Не больше size соединений; свободные переиспользуются"""
+
+    def __init__(self, url, size):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._free = asyncio.Queue()
+        for _ in range(size):
+            self._free.put_nowait(Connection(self.host, self.port))
+
+    async def request(self, method, path, body=None, timeout=30.0):
+        connection = await self._free.get()
+        try:
+            return await asyncio.wait_for(connection.request(method, path, body), timeout)
+        finally:
+            self._free.put_nowait(connection)
+
+    def close(self):
+        while not self._free.empty():
+            self._free.get_nowait().close()
+
+
+# ============ СТАТИСТИКА ============
+def percentile(sorted_values, q):
+    """Процентиль по ближайшему рангу"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.sent = 0
+        self.errors = 0
+        self.statuses = {}
+
+    def record(self, latency_ms, outcome, ok):
+        self.latencies.append(latency_ms)
+        self.statuses[outcome] = self.statuses.get(outcome, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        done = len(latencies)
+
+        def ms(value):
+            return round(value, 1) if value is not None else None
+
+        return {
+            'sent': self.sent,
+            'completed': done,
+            'errors': self.errors,
+            'error_rate': round(self.errors / done, 4) if done else 0.0,
+            'throughput_rps': round((done - self.errors) / duration, 2) if duration else 0.0,
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p95_ms': ms(percentile(latencies, 95)),
+            'p99_ms': ms(percentile(latencies, 99)),
+            'max_ms': ms(latencies[-1] if latencies else None),
+            'statuses': self.statuses,
+        }
+
+
+# ============ НАГРУЗКА ============
+def measurement_payload(rnd):
+    """Тело POST /api/measurement: глюкоза и иногда давление в примечании"""
+    item = {'value': round(min(max(rnd.gauss(6.5, 1.6), 2.5), 20.0), 1)}
+    if rnd.random() < 0.2:
+        item['note'] = f'Давление: {int(rnd.gauss(132, 12))}-{int(rnd.gauss(84, 8))}'
+    return json.dumps(item).encode('utf-8')
+
+
+async def _one_request(pool, name, stats, scheduled, rnd, timeout):
+    method, path = ROUTES[name]
+    body = measurement_payload(rnd) if method == 'POST' else None
+    try:
+        status, _ = await pool.request(method, path, body, timeout=timeout)
+        outcome, ok = str(status), status < 400
+    except asyncio.TimeoutError:
+        outcome, ok = 'timeout', False
+    except (OSError, LoadError, ValueError, asyncio.IncompleteReadError) as e:
+        outcome, ok = type(e).__name__, False
+    stats.record((time.perf_counter() - scheduled) * 1000, outcome, ok)
+
+
+async def _route_traffic(pool, name, rate, stats, deadline, rnd, timeout, tasks):
+    """Пуассоновский поток запросов маршрута name с частотой rate в секунду"""
+    scheduled = time.perf_counter()
+    while True:
+        scheduled += rnd.expovariate(rate)
+        if scheduled >= deadline:
+            return
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.sent += 1
+        tasks.add(asyncio.create_task(_one_request(pool, name, stats, scheduled, rnd, timeout)))
+
+
+async def run_load(url, rates, duration, connections, timeout, drain, seed=0):
+    pool = ConnectionPool(url, connections)
+    stats = {name: RouteStats() for name in rates}
+    rnd = random.Random(seed)
+    tasks = set()
+    started = time.perf_counter()
+    deadline = started + duration
+    try:
+        await asyncio.gather(*(_route_traffic(pool, name, rate, stats[name], deadline,
+                                              rnd, timeout, tasks)
+                               for name, rate in rates.items()))
+        # Дождаться запросов в полёте; не успевшие за drain секунд - ошибки
+        pending = [task for task in tasks if not task.done()]
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=drain)
+        for task in pending:
+            task.cancel()
+        elapsed = time.perf_counter() - started
+    finally:
+        pool.close()
+
+    for name, route in stats.items():
+        missing = route.sent - len(route.latencies)
+        for _ in range(missing):
+            route.record(elapsed * 1000, 'unfinished', False)
+    return {name: route.summary(duration) for name, route in stats.items()}, elapsed
+
+
+async def seed_history(url, rows, seed):
+    """Заполнить базу историей через /api/measurements/batch (до «сейчас»)"""
+    pool = ConnectionPool(url, 1)
+    batch = []
+    now_ms = time.time_ns() // 1_000_000
+    try:
+        for value, note, created_ms in datagen.generate(rows, seed, end_ms=now_ms):
+            batch.append({'value': value, 'note': note, 'created_ms': created_ms})
+            if len(batch) == SEED_BATCH:
+                await _post_batch(pool, batch)
+                batch = []
+        if batch:
+            await _post_batch(pool, batch)
+    finally:
+        pool.close()
+
+
+async def _post_batch(pool, batch):
+    status, body = await pool.request('POST', '/api/measurements/batch',
+                                      json.dumps(batch).encode('utf-8'), timeout=300)
+    if status != 200:
+        raise LoadError(f'Заполнение базы: {status} {body[:200]!r}')
+
+
+# ============ СЕРВЕР ПРИЛОЖЕНИЯ ============
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(work_dir, telegram_url, workers, threads):
+    """Запустить app.py отдельным процессом на временной базе -> (процесс, адрес)"""
+    port = free_port()
+    env = dict(os.environ,
+               DB_PATH=os.path.join(work_dir, 'glucose.db'),
+               TELEGRAM_API_URL=telegram_url,
+               SCHEDULER_ENABLED='0',
+               PORT=str(port))
+    if workers > 0:
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                   '--threads', str(threads), '--bind', f'127.0.0.1:{port}', 'app:app']
+    else:
+        command = [sys.executable, 'app.py']
+    log = open(os.path.join(work_dir, 'server.log'), 'wb')
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return process, f'http://127.0.0.1:{port}'
+
+
+async def wait_ready(url, process=None):
+    """Ждать /ready = 200 (автовосстановление закончено)"""
+    pool = ConnectionPool(url, 1)
+    deadline = time.monotonic() + START_TIMEOUT
+    try:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise LoadError(f'Сервер завершился с кодом {process.returncode}')
+            try:
+                status, _ = await pool.request('GET', '/ready', timeout=5)
+                if status == 200:
+                    return
+            except (OSError, LoadError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.2)
+        raise LoadError(f'Сервер не готов за {START_TIMEOUT} с')
+    finally:
+        pool.close()
+
+
+def stop_app(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# ============ ЗАПУСК ============
+def parse_rates(text):
+    """'post=5,report=0.5' -> {'post': 5.0, 'report': 0.5}"""
+    rates = {}
+    for part in text.split(','):
+        name, _, value = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Неизвестный маршрут {name!r}: {', '.join(ROUTES)}")
+        rates[name] = float(value)
+    return {name: rate for name, rate in rates.items() if rate > 0}
+
+
+def print_table(routes, elapsed, file=sys.stderr):
+    print(f"{'маршрут':<14}{'запросов':>9}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'ошибок':>9}",
+          file=file)
+    for name, s in routes.items():
+        p = [f"{s[key]:.0f}" if s[key] is not None else '-' for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        print(f"{name:<14}{s['completed']:>9}{s['throughput_rps']:>8.1f}"
+              f"{p[0]:>9}{p[1]:>9}{p[2]:>9}{s['error_rate'] * 100:>8.1f}%", file=file)
+    print(f"⏱ {elapsed:.1f} с, задержки в мс", file=file)
+
+
+async def _main(args):
+    work_dir = None
+    process = None
+    fake = None
+    url = args.url
+    try:
+        if url is None:
+            work_dir = tempfile.mkdtemp(prefix='glucose-load-')
+            fake = FakeTelegram(latency=args.telegram_latency).start()
+            process, url = start_app(work_dir, fake.url, args.workers, args.threads)
+            await wait_ready(url, process)
+            if args.rows:
+                started = time.perf_counter()
+                await seed_history(url, args.rows, args.seed)
+                print(f"📦 База заполнена: {args.rows} записей за "
+                      f"{time.perf_counter() - started:.1f} с", file=sys.stderr)
+        else:
+            await wait_ready(url)
+
+        print(f"🚀 Нагрузка на {url}: {args.duration} с, "
+              f"{', '.join(f'{k}={v:g}/с' for k, v in args.rates.items())}", file=sys.stderr)
+        routes, elapsed = await run_load(url, args.rates, args.duration, args.connections,
+                                         args.timeout, args.drain, args.seed)
+        print_table(routes, elapsed)
+
+        return {
+            'environment': environment(),
+            'config': {
+                'url': args.url, 'workers': None if args.url else args.workers,
+                'threads': None if args.url else args.threads, 'rows': args.rows,
+                'duration_s': args.duration, 'connections': args.connections,
+                'rates': args.rates, 'telegram_latency_s': args.telegram_latency,
+            },
+            'elapsed_s': round(elapsed, 2),
+            'routes': routes,
+            'telegram': fake.stats() if fake else None,
+        }
+    finally:
+        if process is not None:
+            stop_app(process)
+        if fake is not None:
+            fake.stop()
+        if work_dir is not None:
+            if args.keep:
+                print(f'📁 Временная папка (server.log, база): {work_dir}', file=sys.stderr)
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест GLIKOSA Tracker')
+    parser.add_argument('--url', help='уже запущенный сервер (иначе запускается свой)')
+    parser.add_argument('--rates', type=parse_rates, default=dict(DEFAULT_RATES),
+                        help=f"запросов в секунду по маршрутам: {','.join(ROUTES)}")
+    parser.add_argument('--duration', type=float, default=30.0, help='длительность, с')
+    parser.add_argument('--connections', type=int, default=32,
+                        help='одновременных соединений не больше')
+    parser.add_argument('--timeout', type=float, default=30.0, help='таймаут запроса, с')
+    parser.add_argument('--drain', type=float, default=30.0,
+                        help='сколько ждать запросы в полёте после окончания, с')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='воркеров gunicorn (0 - сервер Flask)')
+    parser.add_argument('--threads', type=int, default=1, help='потоков на воркер gunicorn')
+    parser.add_argument('--rows', type=int, default=10000, help='записей истории в базе')
+    parser.add_argument('--telegram-latency', type=float, default=0.0,
+                        help='задержка ответов заглушки Telegram, с')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='файл для JSON (по умолчанию stdout)')
+    parser.add_argument('--keep', action='store_true', help='не удалять временную папку')
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(_main(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f'✅ Результаты: {args.out}', file=sys.stderr)
+    else:
+        print(text)
+    errors = sum(route['errors'] for route in result['routes'].values())
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
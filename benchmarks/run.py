@@ -0,0 +1,276 @@
+"""Замер основных операций на историях разного размера.
+
+    python -m benchmarks.run                          # 1k, 100k и 1M записей
+    python -m benchmarks.run --sizes 1000,100000 --out bench.json
+
+Для каждого размера история генерируется заново (datagen.py), и
+замеряются:
+    init_db             - запуск на готовой базе
+    upload_db           - восстановление загрузкой .db.gz
+    upload_json         - восстановление загрузкой .json.gz
+    measurements        - первая страница /api/measurements
+    measurements_range  - /api/measurements за месяц в середине истории
+    print_report_cold   - /print_report с пустым кэшем
+    print_report_warm   - /print_report повторно
+    backup_full         - /admin/backup_to_telegram?full=1
+    backup_delta        - /admin/backup_to_telegram после часа новых записей
+
+Приложение импортируется с временной базой (DB_PATH), без планировщика и
+пула рендера; Telegram подменён заглушкой (telegram_stub.py). Результат -
+JSON с медианой и разбросом по каждой операции, его сравнивает compare.py.
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from benchmarks import datagen
+from benchmarks.telegram_stub import StubTransport
+
+DEFAULT_SIZES = (1000, 100_000, 1_000_000)
+BENCHMARK_FORMAT = 1
+
+
+class BenchmarkError(Exception):
+    """Операция ответила ошибкой - замер недействителен"""
+
+
+# ============ ПРИЛОЖЕНИЕ НА ВРЕМЕННОЙ БАЗЕ ============
+def load_app(work_dir):
+    """Импорт app.py с базой в work_dir. Окружение задаётся до импорта:
+    app читает его при загрузке модуля"""
+    db_path = os.path.join(work_dir, 'glucose.db')
+    os.environ['DB_PATH'] = db_path
+    os.environ['SCHEDULER_ENABLED'] = '0'
+    os.environ.setdefault('CHART_WORKERS', '0')
+    os.environ.setdefault('TELEGRAM_API_URL', 'http://telegram.invalid')
+    # Маркер app.RESTORE_MARKER_PATH: автовосстановление из Telegram пропускается
+    with open(db_path + '.restored', 'w') as marker:
+        marker.write('benchmark')
+
+    import app
+    app.telegram = StubTransport()
+    app.telegram_notifier.transport = app.telegram
+
+    # Фоновые задачи запуска не должны попадать в замеры
+    for thread in threading.enumerate():
+        if thread.name in ('deferred-restore', 'db-migrations'):
+            thread.join()
+    return app
+
+
+def fill_db(app, path, count, seed):
+    """Новая база path со сгенерированной историей - как её записало бы приложение"""
+    if os.path.exists(path):
+        os.unlink(path)
+    if not app.init_db(path, wal=False):
+        raise BenchmarkError(f'init_db не создал базу {path}')
+    conn = sqlite3.connect(path)
+    try:
+        conn.executemany(app.INSERT_MEASUREMENT_SQL,
+                         (app.measurement_params(value, note, created_ms)
+                          for value, note, created_ms in datagen.generate(count, seed)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def gzip_file(path):
+    with open(path, 'rb') as f:
+        return gzip.compress(f.read(), compresslevel=6)
+
+
+# ============ ЗАМЕРЫ ============
+def measure(func, repeat, setup=None):
+    """Запустить func repeat раз (setup - перед каждым запуском, вне замера)"""
+    times = []
+    info = {}
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        info = func() or {}
+        times.append((time.perf_counter() - started) * 1000)
+    result = {
+        'runs': len(times),
+        'median_ms': round(statistics.median(times), 2),
+        'min_ms': round(min(times), 2),
+        'max_ms': round(max(times), 2),
+        'mean_ms': round(statistics.fmean(times), 2),
+    }
+    result.update(info)
+    return result
+
+
+def request(client, url, method='GET', expect=None, **kwargs):
+    """Запрос тестовым клиентом Flask; не-200 или нет expect в ответе - ошибка"""
+    response = client.open(url, method=method, **kwargs)
+    body = response.get_data()
+    if response.status_code != 200 or (expect and expect.encode('utf-8') not in body):
+        raise BenchmarkError(f'{method} {url}: {response.status_code} {body[:300]!r}')
+    return body
+
+
+def upload(client, payload, filename):
+    def func():
+        request(client, '/admin/upload_backup', method='POST', expect='✅',
+                data={'backup_file': (io.BytesIO(payload), filename)},
+                content_type='multipart/form-data')
+        return {'bytes': len(payload)}
+    return func
+
+
+def add_recent_rows(app, count=12):
+    """Записи после последней в истории - материал для дельты бэкапа"""
+    conn = app.get_db_connection(readonly=False)
+    try:
+        c = conn.cursor()
+        c.execute('SELECT MAX(created_ms) FROM measurements')
+        last_ms = c.fetchone()[0] or datagen.END_MS
+        c.executemany(app.INSERT_MEASUREMENT_SQL,
+                      [app.measurement_params(6.0, '', last_ms + (i + 1) * datagen.STEP_MS)
+                       for i in range(count)])
+        conn.commit()
+    finally:
+        conn.close()
+    app._bump_data_version()
+
+
+def run_size(app, work_dir, count, repeat, heavy_repeat, seed):
+    """Все замеры для истории из count записей"""
+    client = app.app.test_client()
+    telegram = app.telegram
+    cases = {}
+
+    source_path = os.path.join(work_dir, f'source-{count}.db')
+    started = time.perf_counter()
+    fill_db(app, source_path, count, seed)
+    db_gz = gzip_file(source_path)
+    json_path = os.path.join(work_dir, f'source-{count}.json.gz')
+    datagen.write_backup_json(json_path, datagen.generate(count, seed))
+    with open(json_path, 'rb') as f:
+        json_gz = f.read()
+    os.unlink(json_path)
+    setup_s = round(time.perf_counter() - started, 2)
+    print(f'📦 {count} записей: данные готовы за {setup_s} с', file=sys.stderr)
+
+    cases['init_db'] = measure(lambda: {'ok': app.init_db(source_path, wal=False)}, repeat)
+    db_bytes = os.path.getsize(source_path)
+    os.unlink(source_path)
+
+    # JSON первым: после него рабочую базу подменяет .db.gz, и остальные
+    # замеры идут на базе, записанной обычным путём
+    cases['upload_json'] = measure(upload(client, json_gz, 'bench.json.gz'), heavy_repeat)
+    cases['upload_db'] = measure(upload(client, db_gz, 'bench.db.gz'), heavy_repeat)
+
+    first_ms, last_ms = datagen.END_MS - count * datagen.STEP_MS, datagen.END_MS
+    middle = datetime.fromtimestamp((first_ms + last_ms) / 2000, timezone.utc)
+    month = (f"/api/measurements?limit=1000&from={middle.strftime('%Y-%m-%d')}"
+             f"&to={(middle + timedelta(days=30)).strftime('%Y-%m-%d')}")
+    cases['measurements'] = measure(lambda: {'bytes': len(request(client, '/api/measurements?limit=100'))}, repeat)
+    cases['measurements_range'] = measure(lambda: {'bytes': len(request(client, month))}, repeat)
+
+    report = lambda: {'bytes': len(request(client, '/print_report'))}
+    cases['print_report_cold'] = measure(report, repeat, setup=app.chart_cache.invalidate)
+    cases['print_report_warm'] = measure(report, repeat)
+
+    def backup(url):
+        def func():
+            telegram.reset()
+            request(client, url, expect='✅')
+            files = sum(1 for kind, _, _ in telegram.sent if kind == 'document')
+            return {'sent_bytes': telegram.sent_bytes, 'sent_files': files}
+        return func
+
+    cases['backup_full'] = measure(backup('/admin/backup_to_telegram?full=1'), heavy_repeat)
+    cases['backup_delta'] = measure(backup('/admin/backup_to_telegram'), repeat,
+                                    setup=lambda: add_recent_rows(app))
+
+    return {'rows': count, 'db_bytes': db_bytes, 'db_gz_bytes': len(db_gz),
+            'json_gz_bytes': len(json_gz), 'setup_s': setup_s, 'cases': cases}
+
+
+# ============ ОКРУЖЕНИЕ ЗАМЕРА ============
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    return {
+        'format': BENCHMARK_FORMAT,
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def parse_sizes(text):
+    sizes = []
+    for part in text.split(','):
+        part = part.strip().lower().replace('_', '')
+        multiplier = {'k': 1000, 'm': 1_000_000}.get(part[-1:], 1)
+        sizes.append(int(part.rstrip('km')) * multiplier)
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замер основных операций GLIKOSA Tracker')
+    parser.add_argument('--sizes', type=parse_sizes, default=list(DEFAULT_SIZES),
+                        help='размеры истории через запятую: 1000,100k,1m')
+    parser.add_argument('--repeat', type=int, default=5, help='повторов быстрых операций')
+    parser.add_argument('--heavy-repeat', type=int, default=2,
+                        help='повторов восстановления и полного бэкапа')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='файл для JSON (по умолчанию stdout)')
+    parser.add_argument('--keep', action='store_true', help='не удалять временную папку')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='glucose-bench-')
+    # Журнал приложения - в stderr, чтобы stdout остался чистым JSON
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            app = load_app(work_dir)
+            result = {'environment': environment(), 'sizes': {}}
+            for count in args.sizes:
+                result['sizes'][str(count)] = run_size(app, work_dir, count, args.repeat,
+                                                       args.heavy_repeat, args.seed)
+    finally:
+        if args.keep:
+            print(f'📁 Временная папка: {work_dir}', file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f'✅ Результаты: {args.out}', file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
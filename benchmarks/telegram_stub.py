@@ -0,0 +1,60 @@
+"""Заглушка транспорта Telegram для замеров.
+
+Тот же интерфейс, что у notifier.TelegramTransport, но без сети: документы
+вычитываются целиком (как при отправке), сообщения и файлы только
+учитываются. latency добавляет задержку к каждому вызову - имитация
+медленной сети.
+"""
+import time
+
+import notifier
+
+
+class StubTransport(notifier.TelegramTransport):
+    """Bot API без сети: getUpdates пуст, отправки учитываются в sent"""
+
+    def __init__(self, latency=0.0):
+        super().__init__('stub', base_url='http://telegram.invalid')
+        self.latency = latency
+        self.sent = []
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset(self):
+        self.sent = []
+
+    @property
+    def sent_bytes(self):
+        return sum(size for _, _, size in self.sent)
+
+    def call(self, method, timeout=None, **params):
+        self._wait()
+        if method == 'getUpdates':
+            return []
+        if method == 'getFile':
+            return {'file_path': params.get('file_id')}
+        return {}
+
+    def send_message(self, chat_id, text, parse_mode='Markdown', timeout=None, **extra):
+        self._wait()
+        self.sent.append(('message', None, len(text.encode('utf-8'))))
+        return {'ok': True, 'result': {'message_id': len(self.sent)}}
+
+    def send_document(self, chat_id, document, filename=None, timeout=30):
+        self._wait()
+        if hasattr(document, 'read'):
+            size = 0
+            while True:
+                chunk = document.read(64 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+        else:
+            size = len(document)
+        self.sent.append(('document', filename, size))
+        return {'ok': True, 'result': {'message_id': len(self.sent)}}
+
+    def download(self, file_path, timeout=60, stream=False):
+        raise notifier.TelegramError(f'Заглушка не хранит файлов: {file_path}')
@@ -0,0 +1,405 @@
+"""Рендеринг графиков для отчётов.
+
+Графики строятся через объектный API matplotlib (Figure + FigureCanvasAgg),
+без глобального состояния pyplot, поэтому безопасны в потоках. Сам рендер
+выполняется в ограниченном пуле процессов: запрос ждёт результат не дольше
+таймаута, а при переполнении очереди получает отказ, а не копится.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+# matplotlib импортируется внутри функций рендера: веб-процессу он не нужен,
+# а процессы пула получают его заранее через preload forkserver
+MATPLOTLIB_MODULES = ['matplotlib.figure', 'matplotlib.backends.backend_agg',
+                      'matplotlib.backends.backend_svg', 'matplotlib.backends.backend_pdf']
+
+# Форматы картинок графиков. SVG - векторный: печатается чётко при любом
+# масштабе, а DPI на него не влияет
+CHART_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+DEFAULT_SIZE = (14, 6)
+DEFAULT_DPI = 100
+
+# Ряды приходят прореженными до сотен точек: подписываем не каждую,
+# а маркеры рисуем только на коротких рядах
+MAX_TICK_LABELS = 20
+MAX_MARKER_POINTS = 40
+
+
+class RenderError(Exception):
+    """График не удалось получить (таймаут, перегрузка, упавший пул)"""
+
+
+class RenderBusy(RenderError):
+    """Очередь рендера переполнена"""
+
+
+class RenderTimeout(RenderError):
+    """Рендер не уложился в отведённое время"""
+
+
+# ============ ФУНКЦИИ РЕНДЕРА (выполняются в процессах пула) ============
+def _new_figure(figsize):
+    from matplotlib.figure import Figure
+    return Figure(figsize=figsize)
+
+
+def _encode(fig, fmt='png', dpi=DEFAULT_DPI):
+    buf = io.BytesIO()
+    if fmt == 'svg':
+        import matplotlib
+        from matplotlib.backends.backend_svg import FigureCanvasSVG
+        FigureCanvasSVG(fig)
+        # Текст - текстом, а не кривыми: файл в разы меньше. Без даты в
+        # метаданных одинаковые графики дают одинаковые файлы
+        with matplotlib.rc_context({'svg.fonttype': 'none', 'svg.hashsalt': 'glucose'}):
+            fig.savefig(buf, format='svg', bbox_inches='tight', facecolor='white',
+                        metadata={'Date': None})
+    else:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        FigureCanvasAgg(fig)
+        fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight', facecolor='white')
+    return buf.getvalue()
+
+
+def _set_labels(ax, labels):
+    """Подписи оси X: не больше MAX_TICK_LABELS, равномерно по ряду"""
+    if not labels:
+        return
+    step = -(-len(labels) // MAX_TICK_LABELS)
+    ticks = list(range(0, len(labels), step))
+    ax.set_xticks(ticks)
+    ax.set_xticklabels([labels[i] for i in ticks], rotation=45, fontsize=10, ha='right')
+
+
+def _plot_glucose(ax, labels, values):
+    marker = 'o' if len(values) <= MAX_MARKER_POINTS else None
+    ax.plot(values, marker=marker, linewidth=2, markersize=6,
+            color='#2c3e50', markerfacecolor='white', markeredgewidth=2)
+
+    ax.set_title('Динамика уровня глюкозы', fontsize=16, fontweight='bold', pad=20)
+    ax.set_xlabel('Дата и время измерения →', fontsize=12, labelpad=10)
+    ax.set_ylabel('Глюкоза (mmol/L)', fontsize=12, labelpad=10)
+    ax.grid(True, alpha=0.3, linestyle='--')
+
+    _set_labels(ax, labels)
+
+    ax.axhspan(3.9, 5.5, alpha=0.1, color='green')
+
+
+def _plot_pressure(ax, labels, systolic, diastolic):
+    x_indices = range(len(systolic))
+    markers = len(systolic) <= MAX_MARKER_POINTS
+
+    ax.plot(x_indices, systolic, 'ro-' if markers else 'r-',
+            linewidth=2, markersize=8, label='Верхнее (систолическое)')
+    ax.plot(x_indices, diastolic, 'bs-' if markers else 'b-',
+            linewidth=2, markersize=8, label='Нижнее (диастолическое)')
+
+    ax.axhspan(110, 130, alpha=0.1, color='green', label='Норма верхнего')
+    ax.axhspan(70, 85, alpha=0.1, color='lightblue', label='Норма нижнего')
+
+    ax.set_title('Динамика артериального давления', fontsize=16, fontweight='bold', pad=20)
+    ax.set_xlabel('Дата и время измерения →', fontsize=12, labelpad=10)
+    ax.set_ylabel('Давление (мм рт. ст.)', fontsize=12, labelpad=10)
+    ax.grid(True, alpha=0.3, linestyle='--')
+    ax.legend(loc='upper left', fontsize=10)
+
+    _set_labels(ax, labels)
+
+
+def render_glucose_chart(labels, values, fmt='png', dpi=DEFAULT_DPI, size=DEFAULT_SIZE):
+    """График глюкозы: labels - подписи по оси X, values - значения mmol/L.
+    fmt - ключ CHART_FORMATS, size - (ширина, высота) в дюймах"""
+    fig = _new_figure(size)
+    _plot_glucose(fig.add_subplot(), labels, values)
+    fig.tight_layout()
+    return _encode(fig, fmt, dpi)
+
+
+def render_pressure_chart(labels, systolic, diastolic, fmt='png', dpi=DEFAULT_DPI, size=DEFAULT_SIZE):
+    """График давления: верхнее и нижнее на одной оси"""
+    fig = _new_figure(size)
+    _plot_pressure(fig.add_subplot(), labels, systolic, diastolic)
+    fig.tight_layout()
+    return _encode(fig, fmt, dpi)
+
+
+# ============ PDF-ОТЧЁТ ============
+# Тот же отчёт, что /print_report, но собранный на сервере: A4 альбомом,
+# графики - векторные, таблицы - через matplotlib.table
+A4_LANDSCAPE = (11.69, 8.27)
+
+TIR_TITLES = (
+    ('very_low', 'Очень низкий: < 3,0'),
+    ('low', 'Низкий: 3,0-3,8'),
+    ('in_range', 'Целевой: 3,9-10,0'),
+    ('high', 'Высокий: 10,1-13,9'),
+    ('very_high', 'Очень высокий: > 13,9'),
+)
+
+
+def _pdf_page(title, period, page, pages):
+    """Пустая страница с заголовком и номером"""
+    fig = _new_figure(A4_LANDSCAPE)
+    fig.text(0.5, 0.95, title, ha='center', fontsize=16, fontweight='bold')
+    fig.text(0.5, 0.915, f'Период: {period}', ha='center', fontsize=11)
+    fig.text(0.5, 0.02, f'Страница {page} из {pages}', ha='center', fontsize=9, color='#666666')
+    return fig
+
+
+def _pdf_table(ax, header, rows, col_widths=None, font_size=9):
+    ax.axis('off')
+    if not rows:
+        ax.text(0.5, 0.9, 'Нет данных', ha='center', fontsize=11)
+        return
+    table = ax.table(cellText=rows, colLabels=header, colWidths=col_widths,
+                     loc='upper center', cellLoc='center')
+    table.auto_set_font_size(False)
+    table.set_fontsize(font_size)
+    for (row, _), cell in table.get_celld().items():
+        cell.set_height(1.0 / (len(rows) + 2))
+        if row == 0:
+            cell.set_facecolor('#e0e0e0')
+
+
+def _dash(value, suffix=''):
+    return '-' if value is None else f'{value}{suffix}'
+
+
+def render_report_pdf(report):
+    """PDF-отчёт из словаря, собранного в app.build_report_data"""
+    import matplotlib
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    period = report['period']
+    stats = report['stats']
+    analytics = report['analytics']
+    pages = 4
+    buf = io.BytesIO()
+
+    # TrueType вместо Type 3: файл меньше, текст выделяется и ищется
+    with matplotlib.rc_context({'pdf.fonttype': 42}), PdfPages(buf, metadata={
+            'Title': f'Отчет по глюкозе {period}', 'Creator': 'Glucose Tracker'}) as pdf:
+        # Лист 1: сводка и таблица измерений
+        fig = _pdf_page('МЕДИЦИНСКИЙ ОТЧЕТ', period, 1, pages)
+        if stats['total']:
+            summary = (f"Глюкоза: {stats['avg']:.1f} mmol/L ({stats['min']:.1f}-{stats['max']:.1f}) | "
+                       f"Измерений: {stats['total']}")
+        else:
+            summary = 'Измерений: 0'
+        fig.text(0.5, 0.87, summary, ha='center', fontsize=11,
+                 bbox={'facecolor': '#f0f0f0', 'edgecolor': 'black', 'pad': 6})
+        header = ['Дата', 'Время', 'Глюкоза', 'Давление']
+        rows = report['table']
+        _pdf_table(fig.add_axes([0.05, 0.07, 0.43, 0.75]), header, rows[:15])
+        _pdf_table(fig.add_axes([0.52, 0.07, 0.43, 0.75]), header, rows[15:30])
+        pdf.savefig(fig)
+
+        # Лист 2: глюкоза
+        fig = _pdf_page('ДИНАМИКА УРОВНЯ ГЛЮКОЗЫ', period, 2, pages)
+        labels, values = report['glucose']
+        ax = fig.add_axes([0.08, 0.18, 0.88, 0.68])
+        if values:
+            _plot_glucose(ax, labels, values)
+            ax.set_title('')  # заголовок уже на странице
+        else:
+            ax.axis('off')
+            ax.text(0.5, 0.5, 'Нет измерений', ha='center', fontsize=14)
+        pdf.savefig(fig)
+
+        # Лист 3: давление
+        fig = _pdf_page('ДИНАМИКА АРТЕРИАЛЬНОГО ДАВЛЕНИЯ', period, 3, pages)
+        labels, systolic, diastolic = report['pressure']
+        ax = fig.add_axes([0.08, 0.18, 0.88, 0.68])
+        if len(systolic) >= 2:
+            _plot_pressure(ax, labels, systolic, diastolic)
+            ax.set_title('')
+        else:
+            ax.axis('off')
+            text = ('Недостаточно данных о давлении для построения графика'
+                    if stats['total'] else 'Нет измерений давления')
+            ax.text(0.5, 0.5, text, ha='center', fontsize=14)
+        pdf.savefig(fig)
+
+        # Лист 4: гликемические показатели и суточный профиль
+        fig = _pdf_page('ГЛИКЕМИЧЕСКИЕ ПОКАЗАТЕЛИ', period, 4, pages)
+        if analytics and analytics['count']:
+            fig.text(0.5, 0.87,
+                     f"Средняя: {analytics['mean']} mmol/L | SD: {analytics['sd']} | "
+                     f"CV: {analytics['cv']}% | GMI: {analytics['gmi']}% | "
+                     f"Расчётный HbA1c: {analytics['ehba1c']}% | MAGE: {_dash(analytics['mage'])}",
+                     ha='center', fontsize=11,
+                     bbox={'facecolor': '#f0f0f0', 'edgecolor': 'black', 'pad': 6})
+
+            tir = analytics['time_in_range']
+            _pdf_table(fig.add_axes([0.05, 0.55, 0.38, 0.27]),
+                       ['Диапазон (mmol/L)', 'Измерений', 'Доля'],
+                       [[title, tir[key]['count'], _dash(tir[key]['percent'], '%')]
+                        for key, title in TIR_TITLES],
+                       col_widths=[0.5, 0.25, 0.25])
+            _pdf_table(fig.add_axes([0.05, 0.08, 0.38, 0.4]),
+                       ['День недели', 'Измерений', 'Средняя', 'Медиана'],
+                       [[day['name'], day['count'], _dash(day['mean']), _dash(day['p50'])]
+                        for day in analytics['weekday']])
+
+            # Суточный профиль в духе AGP: медиана и полосы 25-75 и 10-90
+            hourly = [hour for hour in analytics['hourly'] if hour['count']]
+            ax = fig.add_axes([0.52, 0.12, 0.44, 0.68])
+            hours = [hour['hour'] for hour in hourly]
+            ax.fill_between(hours, [h['p10'] for h in hourly], [h['p90'] for h in hourly],
+                            color='#3498db', alpha=0.15, label='10-90%')
+            ax.fill_between(hours, [h['p25'] for h in hourly], [h['p75'] for h in hourly],
+                            color='#3498db', alpha=0.35, label='25-75%')
+            ax.plot(hours, [h['p50'] for h in hourly], color='#2c3e50', linewidth=2,
+                    marker='o' if len(hourly) <= 2 else None, label='Медиана')
+            ax.axhspan(3.9, 10.0, alpha=0.08, color='green')
+            ax.set_xlim(0, 23)
+            ax.set_xticks(range(0, 24, 3))
+            ax.set_xticklabels([f'{h:02d}:00' for h in range(0, 24, 3)])
+            ax.set_title('Суточный профиль глюкозы', fontsize=12, fontweight='bold')
+            ax.set_ylabel('Глюкоза (mmol/L)')
+            ax.grid(True, alpha=0.3, linestyle='--')
+            ax.legend(loc='upper left', fontsize=9)
+        else:
+            fig.text(0.5, 0.5, 'Нет измерений для расчёта показателей', ha='center', fontsize=14)
+        pdf.savefig(fig)
+
+    return buf.getvalue()
+
+
+# ============ ПУЛ РЕНДЕРА ============
+class RenderPool:
+    """Ограниченный пул процессов для рендера.
+
+    max_workers=0 - рендер прямо в потоке запроса (для отладки и тестов).
+    max_pending - сколько рендеров может ждать/выполняться одновременно,
+    остальные запросы получают RenderBusy, а не копятся в очереди.
+    observer(name, seconds, status) получает время каждого рендера вместе
+    с ожиданием очереди; status - ok, busy, timeout или error.
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, timeout=30.0, queue_timeout=5.0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._executor = None
+        self.observer = None
+
+    @classmethod
+    def from_env(cls):
+        workers = int(os.environ.get('CHART_WORKERS', min(2, os.cpu_count() or 1)))
+        return cls(
+            max_workers=workers,
+            max_pending=int(os.environ.get('CHART_MAX_PENDING', max(1, workers) * 4)),
+            timeout=float(os.environ.get('CHART_TIMEOUT', 30)),
+            queue_timeout=float(os.environ.get('CHART_QUEUE_TIMEOUT', 5)),
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # forkserver: дочерние процессы не наследуют потоки и блокировки
+                # веб-сервера, а matplotlib импортируется в сервере один раз
+                ctx = multiprocessing.get_context('forkserver')
+                ctx.set_forkserver_preload(['charts'] + MATPLOTLIB_MODULES)
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx)
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _recycle_executor(self, executor):
+        """Убить процессы пула с зависшим рендером и начать новый пул.
+        future.cancel() выполняющуюся задачу не останавливает, поэтому
+        процесс завершается принудительно. Рендеры, шедшие в том же пуле,
+        получат RenderError."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout=1)
+        executor.shutdown(wait=False, cancel_futures=True)
+        print(f"♻️ Пул рендера перезапущен: рендер дольше {self.timeout} с")
+
+    def render(self, func, *args, **kwargs):
+        """Выполнить func(*args, **kwargs) в пуле и вернуть байты картинки"""
+        if self.observer is None:
+            return self._render(func, *args, **kwargs)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            result = self._render(func, *args, **kwargs)
+            status = 'ok'
+            return result
+        except RenderBusy:
+            status = 'busy'
+            raise
+        except RenderTimeout:
+            status = 'timeout'
+            raise
+        finally:
+            self.observer(func.__name__, time.perf_counter() - started, status)
+
+    def _render(self, func, *args, **kwargs):
+        if self.max_workers <= 0:
+            return func(*args, **kwargs)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise RenderBusy('Очередь рендера графиков переполнена')
+
+        try:
+            executor = self._get_executor()
+            future = executor.submit(func, *args, **kwargs)
+        except BrokenProcessPool as e:
+            self._slots.release()
+            self._reset_executor()
+            raise RenderError(f'Пул рендера недоступен: {e}')
+        except Exception:
+            self._slots.release()
+            raise
+
+        # Слот освобождается, когда рендер реально закончился, а не когда
+        # запрос перестал ждать - так зависшие рендеры тоже считаются.
+        # Освободить может и колбэк, и таймаут - но только один раз
+        release_lock = threading.Lock()
+        released = []
+
+        def release(_=None):
+            with release_lock:
+                if released:
+                    return
+                released.append(True)
+            self._slots.release()
+
+        future.add_done_callback(release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Слот - только после того, как зависший процесс убит
+            self._recycle_executor(executor)
+            release()
+            raise RenderTimeout(f'Рендер графика дольше {self.timeout} с')
+        except BrokenProcessPool as e:
+            self._reset_executor()
+            raise RenderError(f'Процесс рендера упал: {e}')
+
+    def shutdown(self):
+        self._reset_executor()
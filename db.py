@@ -0,0 +1,206 @@
+"""Пул подключений к SQLite.
+
+Подключения переиспользуются между запросами: conn.close() в коде маршрутов
+не закрывает соединение, а возвращает его в пул. База работает в режиме WAL,
+поэтому читатели не ждут писателей. Для чтения есть отдельный пул
+подключений только на чтение.
+
+Если у пула задан observer(statement, seconds, fetch), каждый запрос через
+подключение из пула замеряется: execute*/fetch* курсора и сокращения
+conn.execute*. statement - первое слово SQL (SELECT, INSERT, ...).
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Настройки, которые действуют на одно подключение (journal_mode=WAL хранится
+# в самом файле базы и включается в enable_wal)
+CONNECTION_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 8192)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_BYTES', 64 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+}
+
+
+def enable_wal(path):
+    """Перевести файл базы в режим WAL (настройка сохраняется в файле)"""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _statement(sql):
+    word = sql.lstrip().split(None, 1)[:1]
+    return word[0].upper() if word else ''
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, сообщающий наблюдателю пула время запросов и выборки"""
+
+    _statement = ''
+
+    def _observer(self):
+        pool = self.connection.pool
+        return pool.observer if pool is not None else None
+
+    def _timed(self, sql, method, *args):
+        observer = self._observer()
+        if observer is None:
+            return method(self, *args)
+        if sql is not None:
+            self._statement = _statement(sql)
+        started = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            observer(self._statement, time.perf_counter() - started, sql is None)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sql, sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sql, sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._timed(sql_script, sqlite3.Cursor.executescript, sql_script)
+
+    def fetchone(self):
+        return self._timed(None, sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed(None, sqlite3.Cursor.fetchmany)
+        return self._timed(None, sqlite3.Cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._timed(None, sqlite3.Cursor.fetchall)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection, у которого close() возвращает его в пул"""
+
+    pool = None
+
+    # Сокращения conn.execute* в C не вызывают cursor(), поэтому идут
+    # через курсор явно - иначе они не попали бы в замеры
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def close_for_real(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """LIFO-пул подключений к одному файлу базы.
+
+    Подключений больше size не хранится: лишние закрываются при возврате,
+    поэтому пул никогда не блокирует запрос.
+    """
+
+    def __init__(self, path, readonly=False, size=8):
+        self.path = path
+        self.readonly = readonly
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.observer = None
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True,
+                                   factory=PooledConnection, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, factory=PooledConnection, check_same_thread=False)
+        for name, value in CONNECTION_PRAGMAS.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only=1')
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+        conn.generation = self._generation
+        return conn
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if conn.generation == self._generation:
+                return conn
+            conn.close_for_real()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            conn.close_for_real()
+            return
+        if conn.generation != self._generation or self._idle.qsize() >= self.size:
+            conn.close_for_real()
+        else:
+            self._idle.put(conn)
+
+    def reset(self):
+        """Закрыть все свободные подключения; выданные закроются при возврате.
+        Нужно перед подменой файла базы."""
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                self._idle.get_nowait().close_for_real()
+            except queue.Empty:
+                break
+
+
+class Database:
+    """Пулы на запись и на чтение для одного файла базы"""
+
+    def __init__(self, path, size=None):
+        size = size or int(os.environ.get('SQLITE_POOL_SIZE', 8))
+        self.path = path
+        self.writer = ConnectionPool(path, readonly=False, size=size)
+        self.reader = ConnectionPool(path, readonly=True, size=size)
+
+    def connect(self, readonly=False):
+        return (self.reader if readonly else self.writer).acquire()
+
+    def set_observer(self, observer):
+        """observer(statement, seconds, fetch) для запросов обоих пулов (None - выключить)"""
+        self.writer.observer = observer
+        self.reader.observer = observer
+
+    def reset(self):
+        """Сбросить все пулы и влить WAL в основной файл"""
+        self.writer.reset()
+        self.reader.reset()
+        try:
+            conn = sqlite3.connect(self.path)
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,88 @@
+"""Прореживание рядов для графиков (Largest-Triangle-Three-Buckets).
+
+Ряд из тысяч точек сводится к заданному числу так, чтобы форма кривой
+сохранилась: первая и последняя точки остаются, остальные делятся на
+корзины, и из каждой берётся точка, образующая треугольник наибольшей
+площади с уже выбранной точкой предыдущей корзины и средним следующей.
+
+Средние корзин и площади внутри корзины считаются векторно через NumPy;
+цикл на Python идёт только по корзинам (их не больше числа точек на
+выходе), поэтому стоимость определяется размером графика, а не ряда.
+
+NumPy импортируется внутри функций, как matplotlib в charts.py: запуск
+приложения не должен платить за него, пока графики не нужны.
+"""
+
+
+def lttb_indices(x, y, points):
+    """Индексы точек, оставляемых LTTB. x должен возрастать.
+    Если точек и так не больше points (или points < 3) - все индексы."""
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    # Внутренние точки 1..n-2 делятся на points-2 корзины
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # Средние всех корзин разом - через накопленные суммы
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = ends - starts
+    avg_x = (cum_x[ends] - cum_x[starts]) / sizes
+    avg_y = (cum_y[ends] - cum_y[starts]) / sizes
+    # Для последней корзины «следующая» - последняя точка ряда
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    result = np.empty(points, dtype=np.int64)
+    result[0] = 0
+    result[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = starts[i], ends[i]
+        ax, ay = x[a], y[a]
+        # Удвоенная площадь треугольника (a, кандидат, среднее следующей)
+        area = np.abs((ax - next_x[i]) * (y[start:end] - ay)
+                      - (ax - x[start:end]) * (next_y[i] - ay))
+        a = start + int(np.argmax(area))
+        result[i + 1] = a
+    return result
+
+
+
+def _number(value):
+    """float из NumPy -> int/float/None"""
+    if value != value:  # NaN
+        return None
+    return int(value) if value.is_integer() else float(value)
+
+
+def measurement_series(rows, points):
+    """Строки (created_ms, value, systolic, diastolic) по возрастанию
+    времени -> ряды глюкозы и давления, прореженные до points точек:
+    {'total': N, 'glucose': [(ms, value)], 'pressure': [(ms, systolic, diastolic)]}.
+    Давление прореживается по верхнему, нижнее берётся из тех же записей."""
+    import numpy as np
+
+    # NULL становится NaN
+    data = np.array(rows, dtype=float).reshape(-1, 4)
+    data = data[~np.isnan(data[:, 0])]
+    times, values, systolic, diastolic = data.T
+
+    keep = lttb_indices(times, values, points)
+    glucose = [(int(t), float(v)) for t, v in zip(times[keep], values[keep])]
+
+    has_pressure = ~np.isnan(systolic)
+    p_times = times[has_pressure]
+    p_systolic = systolic[has_pressure]
+    p_diastolic = diastolic[has_pressure]
+    keep = lttb_indices(p_times, p_systolic, points)
+    pressure = [(int(t), _number(s), _number(d))
+                for t, s, d in zip(p_times[keep], p_systolic[keep], p_diastolic[keep])]
+
+    return {'total': len(times), 'glucose': glucose, 'pressure': pressure}
@@ -0,0 +1,171 @@
+"""Гликемические показатели за период.
+
+Окно измерений один раз загружается в массивы NumPy, дальше все показатели
+считаются векторными проходами по ним:
+
+- время в диапазонах (TIR) по международному консенсусу (ммоль/л):
+  <3,0 / 3,0-3,8 / 3,9-10,0 / 10,1-13,9 / >13,9 - как доля измерений;
+- среднее, стандартное отклонение и коэффициент вариации (CV, цель - до 36%);
+- GMI (индикатор управления глюкозой) и расчётный HbA1c (формула ADAG);
+- MAGE - средняя амплитуда колебаний, превышающих одно SD;
+- профили по часам суток и дням недели: среднее и перцентили 10/25/50/75/90
+  (как в AGP) - по местному времени измерения.
+
+NumPy импортируется внутри функций, как в downsample.py.
+"""
+
+# (ключ, нижняя граница, верхняя граница) - ммоль/л. Измерения хранятся с
+# одним знаком после запятой, поэтому 3,0-3,8 - это [3,0; 3,9), а
+# 10,1-13,9 - это (10,0; 13,9]
+TIR_BANDS = (
+    ('very_low', None, 3.0),
+    ('low', 3.0, 3.9),
+    ('in_range', 3.9, 10.0),
+    ('high', 10.0, 13.9),
+    ('very_high', 13.9, None),
+)
+
+PROFILE_PERCENTILES = (10, 25, 50, 75, 90)
+
+WEEKDAY_NAMES = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+
+MMOL_TO_MG_DL = 18.018
+
+
+def _round(value, digits=1):
+    return None if value is None else round(float(value), digits)
+
+
+def time_in_ranges(values):
+    """Доли измерений в диапазонах TIR_BANDS -> {ключ: {'count', 'percent'}}"""
+    import numpy as np
+
+    # Нижние границы полуоткрыты слева, верхние (10,0 и 13,9) - справа
+    band = np.searchsorted([3.0, 3.9], values, side='right')
+    band += (values > 10.0).astype(band.dtype) + (values > 13.9)
+    counts = np.bincount(band, minlength=len(TIR_BANDS))
+    total = len(values)
+    return {
+        key: {'count': int(count), 'percent': _round(100.0 * count / total) if total else None}
+        for (key, _, _), count in zip(TIR_BANDS, counts)
+    }
+
+
+def mage(values, sd):
+    """MAGE: средняя амплитуда колебаний (подъём или спад между соседними
+    экстремумами), которые больше sd. Локальные экстремумы находятся
+    векторно; по ним (их намного меньше, чем измерений) идёт один проход,
+    отбрасывающий мелкие колебания внутри крупных."""
+    import numpy as np
+
+    if len(values) < 3 or not sd:
+        return None
+
+    # Плато схлопываются, экстремумы - там, где меняется знак разности
+    changed = np.concatenate(([True], np.diff(values) != 0))
+    series = values[changed]
+    if len(series) < 3:
+        return None
+    direction = np.sign(np.diff(series))
+    turns = np.flatnonzero(direction[1:] != direction[:-1]) + 1
+    extremes = series[np.concatenate(([0], turns, [len(series) - 1]))].tolist()
+
+    amplitudes = []
+    low = high = anchor = peak = extremes[0]
+    trend = 0
+    for value in extremes[1:]:
+        if trend == 0:
+            low, high = min(low, value), max(high, value)
+            if value - low > sd:
+                trend, anchor, peak = 1, low, value
+            elif high - value > sd:
+                trend, anchor, peak = -1, high, value
+        elif (value - peak) * trend > 0:
+            peak = value
+        elif abs(peak - value) > sd:
+            amplitudes.append(abs(peak - anchor))
+            trend, anchor, peak = -trend, peak, value
+    if trend and abs(peak - anchor) > sd:
+        amplitudes.append(abs(peak - anchor))
+
+    return float(np.mean(amplitudes)) if amplitudes else None
+
+
+def group_profile(keys, values, size):
+    """Для групп 0..size-1: число, среднее и PROFILE_PERCENTILES.
+    Перцентили всех групп считаются разом по одной сортировке."""
+    import numpy as np
+
+    counts = np.bincount(keys, minlength=size)
+    sums = np.bincount(keys, weights=values, minlength=size)
+    ordered = values[np.lexsort((values, keys))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # Линейная интерполяция, как в np.percentile, для всех групп сразу
+    quantiles = np.array(PROFILE_PERCENTILES) / 100.0
+    positions = starts[:, None] + quantiles[None, :] * np.maximum(counts - 1, 0)[:, None]
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    if len(ordered):
+        lower = np.minimum(lower, len(ordered) - 1)
+        upper = np.minimum(upper, len(ordered) - 1)
+        percentiles = ordered[lower] + (ordered[upper] - ordered[lower]) * (positions - lower)
+    else:
+        percentiles = np.zeros(positions.shape)
+
+    result = []
+    for group in range(size):
+        count = int(counts[group])
+        item = {'count': count, 'mean': _round(sums[group] / count) if count else None}
+        for q, value in zip(PROFILE_PERCENTILES, percentiles[group]):
+            item[f'p{q}'] = _round(value) if count else None
+        result.append(item)
+    return result
+
+
+def analyze(rows):
+    """Строки (created_ms, местное время в секундах, глюкоза) по возрастанию
+    времени -> словарь показателей для /api/analytics и отчёта"""
+    import numpy as np
+
+    # NULL становится NaN; записи без времени (фоновая миграция created_ms
+    # ещё не дошла до них) не попадают ни в профили, ни в границы периода
+    data = np.array(rows, dtype=float).reshape(-1, 3)
+    data = data[~np.isnan(data[:, 0])]
+    times = data[:, 0]
+    local = data[:, 1].astype(np.int64)
+    values = data[:, 2]
+    count = len(values)
+
+    result = {
+        'count': count,
+        'first_ms': int(times[0]) if count else None,
+        'last_ms': int(times[-1]) if count else None,
+        'mean': None, 'sd': None, 'cv': None, 'min': None, 'max': None,
+        'gmi': None, 'ehba1c': None, 'mage': None,
+        'time_in_range': time_in_ranges(values),
+    }
+    if count:
+        mean = float(values.mean())
+        sd = float(values.std(ddof=1)) if count > 1 else 0.0
+        mean_mg_dl = mean * MMOL_TO_MG_DL
+        result.update({
+            'mean': _round(mean),
+            'sd': _round(sd, 2),
+            'cv': _round(100.0 * sd / mean) if mean else None,
+            'min': _round(values.min()),
+            'max': _round(values.max()),
+            # GMI (%) = 3,31 + 0,02392 * средняя в мг/дл; HbA1c по ADAG
+            'gmi': _round(3.31 + 0.02392 * mean_mg_dl),
+            'ehba1c': _round((mean_mg_dl + 46.7) / 28.7),
+            'mage': _round(mage(values, sd), 2),
+        })
+
+    # 1970-01-01 - четверг: сдвиг на 3 даёт понедельник = 0
+    hours = (local // 3600) % 24
+    weekdays = (local // 86400 + 3) % 7
+    result['hourly'] = [dict({'hour': hour}, **item)
+                        for hour, item in enumerate(group_profile(hours, values, 24))]
+    result['weekday'] = [dict({'weekday': day, 'name': WEEKDAY_NAMES[day]}, **item)
+                         for day, item in enumerate(group_profile(weekdays, values, 7))]
+    return result
@@ -0,0 +1,151 @@
+"""Метрики в текстовом формате Prometheus.
+
+Счётчики и гистограммы без внешних зависимостей. Запись - под коротким
+замком: bisect по границам корзин и пара сложений, поэтому метрики можно
+обновлять на каждый запрос и каждый SQL-запрос. Текст для /metrics
+собирается только при чтении.
+
+Под gunicorn у каждого воркера свои метрики: сервер мониторинга видит
+процесс, которому достался запрос (метка pid в glikosa_process_info).
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин по умолчанию, в секундах: от миллисекунды до 10 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.label_names, labels)} {_number(value)}'
+
+
+class Histogram:
+    """Распределение значений по корзинам (le - включительно), сумма и количество"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Счётчики корзин (последняя - +Inf), сумма
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = {labels: (list(counts), total)
+                        for labels, (counts, total) in self._series.items()}
+        bounds = self.buckets + (float('inf'),)
+        for labels, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}'
+
+
+class Gauge:
+    """Значение, вычисляемое при чтении: func() -> число или {метки: число}.
+    type='counter' - для счётчиков, которые уже ведёт другой объект."""
+
+    def __init__(self, name, help, func, labels=(), type='gauge'):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.func = func
+        self.type = type
+
+    def samples(self):
+        value = self.func()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, number in sorted(items):
+            if number is None:
+                continue
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f'{self.name}{_labels(self.label_names, labels)} {_number(number)}'
+
+
+class Registry:
+    """Набор метрик одного процесса"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, func, labels=(), type='gauge'):
+        return self._add(Gauge(name, help, func, labels, type))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                # Сломанная метрика не должна ронять весь /metrics
+                lines.append(f'# {metric.name}: {type(e).__name__}: {e}'.replace('\n', ' '))
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,295 @@
+"""Исходящие сообщения в Telegram.
+
+TelegramTransport - тонкая обёртка над Bot API с общим requests.Session
+(keep-alive, пул соединений). Адрес API настраивается, поэтому в тестах
+вместо Telegram можно поднять локальную заглушку. observer(method, seconds,
+status) получает время каждого вызова - для метрик.
+
+Notifier - очередь уведомлений с фоновым потоком: запрос кладёт текст в
+ограниченную очередь и сразу отвечает клиенту, поток отправляет сообщения
+с повторами, склеивая пачку подряд идущих уведомлений в одно. Повторяются
+только временные ошибки (429, 5xx, сеть); если склеенное сообщение отвергнуто,
+уведомления досылаются по одному.
+"""
+import atexit
+import queue
+import threading
+import time
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Исход отправки уведомления
+SENT = 'sent'
+REJECTED = 'rejected'
+FAILED = 'failed'
+
+
+class TelegramError(Exception):
+    """Telegram ответил ошибкой или недоступен (status - HTTP-код ответа)"""
+
+    def __init__(self, message, retry_after=None, status=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+def is_transient(error):
+    """Стоит ли повторять: 429, 5xx и сетевые ошибки (исключения requests -
+    наследники OSError). Остальные 4xx - ошибка в самом сообщении."""
+    if isinstance(error, TelegramError):
+        return error.status is None or error.status == 429 or error.status >= 500
+    return isinstance(error, OSError)
+
+
+class TelegramTransport:
+    """Вызовы Bot API через один пул соединений"""
+
+    def __init__(self, token, base_url='https://api.telegram.org', timeout=10, pool_size=4):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+        self.observer = None
+
+    @property
+    def session(self):
+        # requests импортируется только при первой отправке
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def _url(self, method):
+        return f"{self.base_url}/bot{self.token}/{method}"
+
+    def _check(self, response):
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        if response.status_code != 200 or not data.get('ok', False):
+            retry_after = (data.get('parameters') or {}).get('retry_after')
+            raise TelegramError(response.text, retry_after=retry_after, status=response.status_code)
+        return data
+
+    def _timed(self, method, request):
+        """Выполнить request() и сообщить наблюдателю время и исход"""
+        if self.observer is None:
+            return request()
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            result = request()
+            status = 'ok'
+            return result
+        finally:
+            self.observer(method, time.perf_counter() - started, status)
+
+    def call(self, method, timeout=None, **params):
+        """GET-метод Bot API (getUpdates, getFile) -> поле result"""
+        def request():
+            response = self.session.get(self._url(method), params=params,
+                                        timeout=timeout or self.timeout)
+            return self._check(response)['result']
+        return self._timed(method, request)
+
+    def send_message(self, chat_id, text, parse_mode='Markdown', timeout=None, **extra):
+        payload = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        payload.update(extra)
+
+        def request():
+            response = self.session.post(self._url('sendMessage'), json=payload,
+                                         timeout=timeout or self.timeout)
+            return self._check(response)
+        return self._timed('sendMessage', request)
+
+    def send_document(self, chat_id, document, filename=None, timeout=30):
+        """document - открытый файл или байты"""
+        files = {'document': (filename, document) if filename else document}
+
+        def request():
+            response = self.session.post(self._url('sendDocument'), files=files,
+                                         data={'chat_id': chat_id}, timeout=timeout)
+            return self._check(response)
+        return self._timed('sendDocument', request)
+
+    def download(self, file_path, timeout=60, stream=False):
+        """Скачать файл, полученный через getFile (при stream - время до заголовков)"""
+        def request():
+            response = self.session.get(f"{self.base_url}/file/bot{self.token}/{file_path}",
+                                        timeout=timeout, stream=stream)
+            response.raise_for_status()
+            return response
+        return self._timed('download', request)
+
+
+class Notifier:
+    """Фоновая очередь уведомлений.
+
+    notify() никогда не блокирует запрос: при переполнении очереди
+    уведомление отбрасывается (и учитывается в dropped).
+    """
+
+    def __init__(self, transport, chat_id, maxsize=100, coalesce_window=2.0,
+                 max_attempts=4, backoff=1.0):
+        self.transport = transport
+        self.chat_id = chat_id
+        self.coalesce_window = coalesce_window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def notify(self, text):
+        """Поставить сообщение в очередь; True, если принято"""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(text)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='telegram-notifier', daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self, first):
+        """Добрать сообщения, пришедшие в течение coalesce_window после первого"""
+        batch = [first]
+        deadline = time.monotonic() + self.coalesce_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _join(batch):
+        """Разбить пачку на группы, каждая из которых склеивается в сообщение
+        не длиннее лимита Telegram -> [[текст, ...], ...]"""
+        groups = []
+        current = []
+        length = 0
+        for text in batch:
+            text = text[:TELEGRAM_MESSAGE_LIMIT]
+            added = len(text) + (2 if current else 0)
+            if current and length + added > TELEGRAM_MESSAGE_LIMIT:
+                groups.append(current)
+                current = [text]
+                length = len(text)
+            else:
+                current.append(text)
+                length += added
+        if current:
+            groups.append(current)
+        return groups
+
+    def _send_with_retry(self, text, parse_mode='Markdown'):
+        """Отправить сообщение -> SENT, REJECTED (Telegram отверг его, 4xx)
+        или FAILED (временные ошибки не прошли за max_attempts попыток).
+        Повторяются только временные ошибки - см. is_transient."""
+        for attempt in range(self.max_attempts):
+            try:
+                self.transport.send_message(self.chat_id, text, parse_mode=parse_mode)
+                return SENT
+            except Exception as e:
+                if not is_transient(e):
+                    print(f"⚠️ Telegram отверг сообщение: {e}")
+                    return REJECTED
+                if attempt == self.max_attempts - 1:
+                    print(f"⚠️ Telegram: сообщение не отправлено: {e}")
+                    break
+                delay = getattr(e, 'retry_after', None) or self.backoff * (2 ** attempt)
+                time.sleep(delay)
+        return FAILED
+
+    def _deliver(self, group):
+        """Группа уведомлений - одним сообщением. Если Telegram его отверг
+        (обычно из-за разметки в одной из записей), записи уходят по одной,
+        а отвергнутая - ещё раз без Markdown: из-за одной записи не теряются
+        остальные."""
+        if len(group) > 1:
+            result = self._send_with_retry('\n\n'.join(group))
+            if result == SENT:
+                self.sent += 1
+                return
+            if result == FAILED:
+                self.failed += 1
+                return
+
+        for text in group:
+            result = self._send_with_retry(text)
+            if result == REJECTED:
+                result = self._send_with_retry(text, parse_mode=None)
+            if result == SENT:
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.task_done()
+                return
+            batch = self._collect_batch(first)
+            stop = None in batch
+            batch = [text for text in batch if text is not None]
+            try:
+                for group in self._join(batch):
+                    self._deliver(group)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self, timeout=None):
+        """Дождаться отправки всего, что уже в очереди"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=5.0):
+        """Остановить поток, дав ему дослать очередь"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._stopping = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+def create_notifier(token, chat_id, base_url='https://api.telegram.org'):
+    """Транспорт и очередь уведомлений; очередь досылается при выходе"""
+    transport = TelegramTransport(token, base_url=base_url)
+    notifier = Notifier(transport, chat_id)
+    atexit.register(notifier.close)
+    return transport, notifier
@@ -0,0 +1,212 @@
+"""Профилирование отдельных запросов по требованию.
+
+ProfilingMiddleware - WSGI-обёртка: запрос с заголовком X-Profile: <токен>
+(или cookie glikosa_profile=<токен>) выполняется под cProfile вместе с
+выдачей тела ответа, остальные проходят без изменений. В адресе токен не
+принимается: оттуда он попадает в логи, историю браузера и Referer. Обёртка ставится,
+только если профилирование включено, - иначе её просто нет в цепочке.
+
+Результат - файл .prof (pstats, открывается snakeviz/pstats) и рядом .json
+с описанием запроса и разбивкой времени: SQL, графики (matplotlib/NumPy),
+ожидание (замки, пул рендера - рендер идёт в другом процессе и сюда
+попадает только как ожидание), код приложения, Flask. В папке хранится не
+больше keep последних профилей.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from datetime import datetime
+from http.cookies import CookieError, SimpleCookie
+
+HEADER = 'HTTP_X_PROFILE'
+COOKIE = 'glikosa_profile'
+
+# Порядок важен: первая подходящая категория
+CATEGORIES = ('sql', 'charts', 'wait', 'app', 'flask', 'other')
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _category(filename, funcname):
+    """Категория функции из pstats для разбивки времени"""
+    if filename == '~':
+        if 'sqlite3' in funcname:
+            return 'sql'
+        if "'acquire' of '_thread" in funcname or 'sleep' in funcname:
+            return 'wait'
+        return 'other'
+    if 'matplotlib' in filename or 'numpy' in filename or filename.endswith('charts.py'):
+        return 'charts'
+    if os.path.basename(filename) == 'db.py' and filename.startswith(_APP_DIR):
+        return 'sql'
+    if os.sep + 'threading.py' in filename or os.sep + 'concurrent' + os.sep in filename:
+        return 'wait'
+    if filename.startswith(_APP_DIR):
+        return 'app'
+    if any(name in filename for name in ('flask', 'werkzeug', 'jinja2')):
+        return 'flask'
+    return 'other'
+
+
+def breakdown(stats):
+    """Собственное время функций (tottime) по категориям, мс"""
+    totals = dict.fromkeys(CATEGORIES, 0.0)
+    for (filename, _, funcname), (_, _, tottime, _, _) in stats.stats.items():
+        totals[_category(filename, funcname)] += tottime
+    return {name: round(seconds * 1000, 1) for name, seconds in totals.items()}
+
+
+def _slug(path):
+    return re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_')[:60] or 'root'
+
+
+def token_matches(value, token):
+    """Сравнение токена без утечки по времени"""
+    return bool(value) and hmac.compare_digest(value.encode('utf-8'), token.encode('utf-8'))
+
+
+def request_token(environ):
+    """Токен из заголовка X-Profile или cookie glikosa_profile"""
+    value = environ.get(HEADER)
+    if value:
+        return value
+    raw = environ.get('HTTP_COOKIE')
+    if not raw or COOKIE not in raw:
+        return None
+    try:
+        morsel = SimpleCookie(raw).get(COOKIE)
+    except CookieError:
+        return None
+    return morsel.value if morsel else None
+
+
+class Profiler:
+    """Папка профилей: запись с ротацией, список, чтение"""
+
+    def __init__(self, directory, keep=20):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def save(self, profile, info):
+        """Сохранить профиль и описание, удалить лишние старые -> имя профиля"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        name = f"{stamp}-{info['method']}-{_slug(info['path'])}"
+        profile.dump_stats(os.path.join(self.directory, name + '.prof'))
+        info = dict(info, name=name, breakdown_ms=breakdown(pstats.Stats(profile)))
+        with open(os.path.join(self.directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+        self._rotate()
+        return name
+
+    def _rotate(self):
+        with self._lock:
+            names = self._names()
+            for name in names[:-self.keep] if self.keep > 0 else names:
+                for suffix in ('.prof', '.json'):
+                    path = os.path.join(self.directory, name + suffix)
+                    if os.path.exists(path):
+                        os.unlink(path)
+
+    def _names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(entry[:-5] for entry in os.listdir(self.directory) if entry.endswith('.json'))
+
+    def recent(self):
+        """Описания профилей, новые первыми"""
+        result = []
+        for name in reversed(self._names()):
+            try:
+                with open(os.path.join(self.directory, name + '.json'), encoding='utf-8') as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def path(self, name):
+        """Файл .prof по имени из списка или None (имя не из папки не принимается)"""
+        if name not in self._names():
+            return None
+        path = os.path.join(self.directory, name + '.prof')
+        return path if os.path.exists(path) else None
+
+    def report(self, name, sort='cumulative', limit=40):
+        """Текстовый отчёт pstats: топ функций"""
+        path = self.path(name)
+        if path is None:
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """Выполнить под cProfile запросы, предъявившие токен"""
+
+    def __init__(self, wsgi_app, profiler, token, exclude=()):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+        self.token = token
+        # Пути, которые не профилируются (страницы самих профилей)
+        self.exclude = tuple(exclude)
+        # Один профилируемый запрос за раз: профили не мешают друг другу
+        self._lock = threading.Lock()
+
+    def _requested(self, environ):
+        value = request_token(environ)
+        if value is None:
+            return False
+        if environ.get('PATH_INFO', '').startswith(self.exclude):
+            return False
+        return token_matches(value, self.token)
+
+    def __call__(self, environ, start_response):
+        if not self._requested(environ):
+            return self.wsgi_app(environ, start_response)
+
+        status_holder = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            status_holder.append(status)
+            return start_response(status, headers, exc_info)
+
+        with self._lock:
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            profile.enable()
+            try:
+                # Тело ответа вычитывается под профилировщиком: у потоковых
+                # ответов основная работа идёт именно здесь
+                result = self.wsgi_app(environ, capture_start_response)
+                try:
+                    body = list(result)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            finally:
+                profile.disable()
+            duration_ms = (time.perf_counter() - started) * 1000
+
+            try:
+                name = self.profiler.save(profile, {
+                    'method': environ.get('REQUEST_METHOD', 'GET'),
+                    'path': environ.get('PATH_INFO', '/'),
+                    'query': environ.get('QUERY_STRING', ''),
+                    'status': int(status_holder[-1].split()[0]) if status_holder else None,
+                    'duration_ms': round(duration_ms, 1),
+                    'created': datetime.now().isoformat(timespec='seconds'),
+                    'pid': os.getpid(),
+                })
+                print(f"🔬 Профиль {environ.get('PATH_INFO')}: {duration_ms:.0f} мс -> {name}")
+            except OSError as e:
+                print(f"⚠️ Профиль не сохранён: {e}")
+        return body
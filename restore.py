@@ -0,0 +1,202 @@
+"""Восстановление базы из бэкапов.
+
+JSON-бэкап (массив записей) разбирается потоково, кусками: в памяти
+держится только текущий кусок текста и одна пачка записей. Все записи
+вставляются пачками executemany в одной транзакции - при любой ошибке
+транзакция откатывается и база остаётся как была.
+
+Файл .db сначала проверяется во временном файле рядом с базой, а затем
+целиком копируется в рабочую базу через backup API SQLite одной
+транзакцией - читатели видят либо старую базу, либо новую.
+"""
+import codecs
+import json
+import os
+import sqlite3
+import tempfile
+
+READ_CHUNK_SIZE = 64 * 1024
+INSERT_BATCH_SIZE = 1000
+
+
+class RestoreError(Exception):
+    """Бэкап повреждён или не подходит"""
+
+
+# ============ ПОТОКОВЫЙ РАЗБОР JSON ============
+def iter_file_chunks(fp, chunk_size=READ_CHUNK_SIZE):
+    """Файл (бинарный или текстовый) -> куски по chunk_size"""
+    return iter(lambda: fp.read(chunk_size), fp.read(0))
+
+
+def iter_json_items(chunks):
+    """Элементы JSON-массива верхнего уровня по мере чтения кусков.
+
+    chunks - итерируемое кусков bytes (UTF-8) или str. Каждый элемент
+    разбирается json.JSONDecoder.raw_decode, как только он целиком попал
+    в буфер, поэтому весь файл в памяти никогда не держится.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buf, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            text = utf8.decode(b'', final=True)
+        else:
+            text = utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+        buf = buf[pos:] + text
+        pos = 0
+
+    def peek():
+        """Следующий значащий символ ('' - конец файла)"""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n\ufeff':
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                return ''
+            read_more()
+
+    if peek() != '[':
+        raise RestoreError('Бэкап должен быть JSON-массивом')
+    pos += 1
+
+    if peek() == ']':
+        pos += 1
+    else:
+        while True:
+            peek()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    # Элемент, упёршийся в конец буфера, мог обрезаться
+                    # (число "12" из "12.5") - дочитываем и разбираем заново
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError as e:
+                    if eof:
+                        raise RestoreError(f'Повреждённый JSON: {e}')
+                read_more()
+            yield item
+            pos = end
+
+            separator = peek()
+            pos += 1
+            if separator == ']':
+                break
+            if separator != ',':
+                raise RestoreError(f'Повреждённый JSON: ожидалась запятая, а не {separator or "конец файла"!r}')
+
+    if peek():
+        raise RestoreError('Повреждённый JSON: данные после конца массива')
+
+
+# ============ ВОССТАНОВЛЕНИЕ JSON ============
+def restore_json(conn, items, insert_sql, to_params, clear=None, finish=None,
+                 batch_size=INSERT_BATCH_SIZE):
+    """Вставить записи одной транзакцией пачками по batch_size.
+
+    to_params(item) -> кортеж параметров insert_sql (ValueError/KeyError/
+    TypeError - запись неверна). clear(cursor) - очистка перед вставкой,
+    finish(cursor) - после вставки, до фиксации (пересчёт агрегатов).
+    Возвращает число вставленных записей; при ошибке всё откатывается.
+    """
+    count = 0
+    c = conn.cursor()
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        if clear is not None:
+            clear(c)
+
+        batch = []
+        for item in items:
+            try:
+                batch.append(to_params(item))
+            except (ValueError, KeyError, TypeError) as e:
+                raise RestoreError(f'Запись #{count + len(batch) + 1}: {e}')
+            if len(batch) >= batch_size:
+                c.executemany(insert_sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            c.executemany(insert_sql, batch)
+            count += len(batch)
+        if finish is not None:
+            finish(c)
+
+        conn.commit()
+        return count
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+
+
+# ============ ВОССТАНОВЛЕНИЕ .db ============
+def save_temp_copy(fp, db_path, chunk_size=READ_CHUNK_SIZE):
+    """Сохранить загруженный файл во временный рядом с базой -> путь"""
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(db_path) + '.upload-',
+                                    suffix='.db', dir=os.path.dirname(os.path.abspath(db_path)))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter_file_chunks(fp, chunk_size):
+                out.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path
+
+
+def validate_db_file(path, required_columns=('id', 'value', 'note', 'created_at')):
+    """Проверить, что файл - целая база SQLite с таблицей measurements.
+    Возвращает число записей, иначе RestoreError."""
+    try:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    except sqlite3.Error as e:
+        raise RestoreError(f'Не открывается как база SQLite: {e}')
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+        if result != 'ok':
+            raise RestoreError(f'База повреждена: {result}')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(measurements)')]
+        missing = [name for name in required_columns if name not in columns]
+        if not columns:
+            raise RestoreError('В базе нет таблицы measurements')
+        if missing:
+            raise RestoreError(f'В таблице measurements нет колонок: {", ".join(missing)}')
+        return conn.execute('SELECT COUNT(*) FROM measurements').fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        raise RestoreError(f'Не открывается как база SQLite: {e}')
+    finally:
+        conn.close()
+
+
+def swap_database(src_path, dst_path):
+    """Скопировать базу src в dst через backup API одной транзакцией.
+
+    В WAL-режиме backup требует одинаковый размер страницы - при
+    необходимости временная копия перестраивается под размер рабочей базы.
+    """
+    dst = sqlite3.connect(dst_path, timeout=30)
+    src = sqlite3.connect(src_path)
+    try:
+        page_size = dst.execute('PRAGMA page_size').fetchone()[0]
+        if src.execute('PRAGMA page_size').fetchone()[0] != page_size:
+            src.execute('PRAGMA journal_mode=DELETE')
+            src.execute(f'PRAGMA page_size={page_size}')
+            src.execute('VACUUM')
+        # pages=-1: вся база за один шаг, под одной блокировкой записи
+        src.backup(dst, pages=-1)
+    finally:
+        src.close()
+        dst.close()
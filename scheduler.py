@@ -0,0 +1,279 @@
+"""Планировщик периодических задач внутри приложения.
+
+Расписания - в формате cron из пяти полей (минута, час, день месяца,
+месяц, день недели). Поток планировщика спит до ближайшего запуска, а не
+опрашивает часы раз в минуту. Пропущенный запуск (приложение спало или
+перезапускалось) выполняется один раз сразу после старта. К каждому запуску
+можно добавить случайную задержку, чтобы задачи не стартовали секунда в
+секунду.
+
+Под gunicorn каждый воркер импортирует приложение и запускает свой
+планировщик, но задачи выполняет только один - тот, кто держит файловую
+блокировку. Остальные периодически пробуют её перехватить: если лидер
+упал, его место занимает другой воркер.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: считаем процесс единственным
+    fcntl = None
+
+# Как часто не-лидер пробует взять блокировку и максимальный сон лидера
+# (на случай перевода системных часов)
+LEADER_RETRY_SECONDS = 30
+MAX_SLEEP_SECONDS = 3600
+
+
+class CronError(ValueError):
+    """Неверное cron-выражение"""
+
+
+# ============ CRON-РАСПИСАНИЕ ============
+class CronSchedule:
+    """'59 21 * * *' - каждый день в 21:59; поддерживаются *, списки,
+    диапазоны и шаги ('*/15', '1-5', '0,30'). Дни недели: 0 или 7 - воскресенье."""
+
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31),
+              ('month', 1, 12), ('weekday', 0, 7))
+
+    def __init__(self, expr):
+        self.expr = expr
+        parts = expr.split()
+        if len(parts) != 5:
+            raise CronError(f'Нужно 5 полей: {expr!r}')
+        values = [self._parse_field(part, low, high)
+                  for part, (_, low, high) in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        # cron: 0 и 7 - воскресенье; datetime.weekday(): понедельник = 0
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        # Если заданы и день месяца, и день недели - подходит любой из них
+        self.day_restricted = parts[2] != '*'
+        self.weekday_restricted = parts[4] != '*'
+
+    @staticmethod
+    def _parse_field(part, low, high):
+        result = set()
+        for item in part.split(','):
+            step = 1
+            if '/' in item:
+                item, step_text = item.split('/', 1)
+                step = int(step_text)
+                if step < 1:
+                    raise CronError(f'Неверный шаг: {part!r}')
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(x) for x in item.split('-', 1))
+            else:
+                start = end = int(item)
+                if step != 1:
+                    end = high
+            if start < low or end > high or start > end:
+                raise CronError(f'Значение вне диапазона {low}-{high}: {part!r}')
+            result.update(range(start, end + 1, step))
+        return result
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = dt.weekday() in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, dt):
+        """Ближайший момент строго после dt (с точностью до минуты)"""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                month = dt.month % 12 + 1
+                dt = dt.replace(year=dt.year + (month == 1), month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise CronError(f'Расписание никогда не срабатывает: {self.expr!r}')
+
+
+# ============ ЗАДАЧИ И ПЛАНИРОВЩИК ============
+class Job:
+    """Периодическая задача: func() без аргументов по расписанию schedule.
+    jitter - случайная задержка запуска до jitter секунд."""
+
+    def __init__(self, name, schedule, func, jitter=0, catch_up=True):
+        self.name = name
+        self.schedule = CronSchedule(schedule) if isinstance(schedule, str) else schedule
+        self.func = func
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.last_run = None
+        self.due = None
+        self.run_at = None
+        self.runs = 0
+        self.failures = 0
+        self.last_error = None
+
+
+class Scheduler:
+    """Поток с задачами, выполняемыми только в процессе-лидере.
+
+    load_last_run(name) / save_last_run(name, datetime) хранят время
+    последнего запуска между перезапусками - по нему выполняется догонка.
+    """
+
+    def __init__(self, jobs, lock_path, tz, load_last_run=None, save_last_run=None):
+        self.jobs = {job.name: job for job in jobs}
+        self.lock_path = lock_path
+        self.tz = tz
+        self.load_last_run = load_last_run
+        self.save_last_run = save_last_run
+        self.is_leader = False
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._release_leadership()
+
+    def _now(self):
+        return datetime.now(self.tz)
+
+    # --- выборы лидера ---
+    def _try_lead(self):
+        if fcntl is None:
+            return True
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Блокировка держится, пока открыт файл, - до конца жизни процесса
+        self._lock_file = lock_file
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        return True
+
+    def _release_leadership(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
+
+    # --- расписание ---
+    def _plan(self, job, after):
+        job.due = job.schedule.next_after(after)
+        job.run_at = job.due + timedelta(seconds=random.uniform(0, job.jitter) if job.jitter else 0)
+
+    def _prepare(self):
+        now = self._now()
+        for job in self.jobs.values():
+            last_run = self.load_last_run(job.name) if self.load_last_run else None
+            job.last_run = last_run
+            if last_run is None:
+                # Первый запуск: отсчитываем от текущего момента, без догонки,
+                # но запоминаем точку отсчёта, чтобы догонять после перезапусков
+                self._plan(job, now)
+                self._save(job, now)
+                continue
+            self._plan(job, last_run.astimezone(self.tz))
+            if job.due > now:
+                continue
+            if not job.catch_up:
+                self._plan(job, now)
+                continue
+            # Сколько бы запусков ни пропало - догоняем одним, засчитывая
+            # его за последний пропущенный
+            missed = 1
+            while True:
+                following = job.schedule.next_after(job.due)
+                if following > now:
+                    break
+                job.due = following
+                missed += 1
+            print(f"⏰ Планировщик: пропущено запусков {job.name}: {missed} "
+                  f"(последний {job.due.strftime('%d.%m %H:%M')}), выполняю сейчас")
+            job.run_at = now
+
+    def _save(self, job, when):
+        if self.save_last_run:
+            try:
+                self.save_last_run(job.name, when)
+            except Exception as e:
+                print(f"⚠️ Планировщик: не сохранил время запуска {job.name}: {e}")
+
+    def _run_job(self, job):
+        started = time.perf_counter()
+        try:
+            job.func()
+            job.runs += 1
+            job.last_error = None
+            print(f"✅ Задача {job.name} выполнена за {time.perf_counter() - started:.1f} с")
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            print(f"⚠️ Задача {job.name} завершилась ошибкой: {e}")
+        # Время запуска - плановое, чтобы расписание не «уплывало» на джиттер
+        job.last_run = job.due
+        self._save(job, job.due)
+        self._plan(job, max(job.due, self._now()))
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.is_leader:
+                self.is_leader = self._try_lead()
+                if not self.is_leader:
+                    self._stop.wait(LEADER_RETRY_SECONDS)
+                    continue
+                print(f"⏰ Планировщик: процесс {os.getpid()} выполняет задачи")
+                self._prepare()
+
+            job = min(self.jobs.values(), key=lambda j: j.run_at, default=None)
+            if job is None:
+                self._stop.wait(MAX_SLEEP_SECONDS)
+                continue
+
+            delay = (job.run_at - self._now()).total_seconds()
+            if delay > 0:
+                self._stop.wait(min(delay, MAX_SLEEP_SECONDS))
+                continue
+            self._run_job(job)
+
+    def status(self):
+        """Состояние задач для страниц администрирования"""
+        return {
+            'leader': self.is_leader,
+            'jobs': {
+                name: {
+                    'schedule': job.schedule.expr,
+                    'next_run': job.run_at.isoformat() if job.run_at else None,
+                    'last_run': job.last_run.isoformat() if job.last_run else None,
+                    'runs': job.runs,
+                    'failures': job.failures,
+                    'last_error': job.last_error,
+                }
+                for name, job in self.jobs.items()
+            }
+        }
@@ -0,0 +1,108 @@
+"""Согласованные снимки базы без остановки записи.
+
+Снимок снимается через backup API SQLite порциями по несколько страниц.
+Исходное подключение держит одну читающую транзакцию на всё время
+копирования: в режиме WAL это фиксирует состояние базы на момент начала,
+а писатели тем временем спокойно продолжают работу.
+
+Готовый снимок хранится сжатым (gzip) во временной папке и отдаётся
+повторно, пока версия данных не изменилась.
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class Snapshot:
+    """Сжатый снимок базы на диске"""
+
+    def __init__(self, path, version, created_ms):
+        self.path = path
+        self.version = version
+        self.created_ms = created_ms
+        self.size = os.path.getsize(path)
+
+    def open(self):
+        return open(self.path, 'rb')
+
+
+class SnapshotService:
+    """Снимки одной базы с кэшем последнего снимка по версии данных.
+
+    version_func(conn) -> версия данных, читается в той же транзакции, что
+    и копируется, поэтому версия снимка точно соответствует его содержимому.
+    """
+
+    def __init__(self, db_path, version_func, cache_dir=None, pages=256, step_sleep=0.0):
+        self.db_path = db_path
+        self.version_func = version_func
+        self.cache_dir = cache_dir or tempfile.gettempdir()
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self._lock = threading.RLock()
+        self._current = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """Последний снимок; новый снимается, только если данные изменились"""
+        with self._lock:
+            src = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+            try:
+                # Читающая транзакция открывается первым SELECT и держится
+                # до конца копирования
+                src.execute('BEGIN')
+                version = self.version_func(src)
+
+                current = self._current
+                if current is not None and current.version == version and os.path.exists(current.path):
+                    self.hits += 1
+                    return current
+                self.misses += 1
+
+                raw_path = self._temp_path('.db')
+                try:
+                    dst = sqlite3.connect(raw_path)
+                    try:
+                        src.backup(dst, pages=self.pages, sleep=self.step_sleep)
+                    finally:
+                        dst.close()
+                    src.rollback()
+
+                    gz_path = self._temp_path('.db.gz')
+                    with open(raw_path, 'rb') as raw, gzip.open(gz_path, 'wb', compresslevel=6) as out:
+                        shutil.copyfileobj(raw, out, COPY_CHUNK_SIZE)
+                finally:
+                    os.unlink(raw_path)
+            finally:
+                src.close()
+
+            self._current = Snapshot(gz_path, version, time.time_ns() // 1_000_000)
+            # Старый файл удаляем сразу: уже открытые раздачи дочитают его
+            if current is not None and current.path != gz_path and os.path.exists(current.path):
+                os.unlink(current.path)
+            return self._current
+
+    def open(self):
+        """Последний снимок и его открытый файл. Файл открывается под той же
+        блокировкой, поэтому его можно дочитать даже после замены снимка."""
+        with self._lock:
+            snapshot = self.get()
+            return snapshot, snapshot.open()
+
+    def _temp_path(self, suffix):
+        fd, path = tempfile.mkstemp(prefix='glucose-snapshot-', suffix=suffix, dir=self.cache_dir)
+        os.close(fd)
+        return path
+
+    def clear(self):
+        with self._lock:
+            if self._current is not None and os.path.exists(self._current.path):
+                os.unlink(self._current.path)
+            self._current = None